@@ -0,0 +1,274 @@
+'''
+end to end benchmark of `SingleUserScrape.run`, against the local stand-in for sofurry in `mock_sofurry`
+
+run from the root of the repo:
+
+    python -m benchmarks.end_to_end --submissions 10 1000 50000 --latency-ms 20 -- --max-concurrent-submissions 16
+
+each size is scraped in its own process so the peak memory use is per run. Anything after `--` is passed on to the
+scrape, so it can be run with any of the `single_user_scrape` arguments. Rate limiting is disabled unless the scrape
+arguments have `--max-requests-per-second` in them, since we want to measure the scraper and not the limit.
+
+it reports submissions per second, requests per second, the peak RSS of the scraping process, the latency of each
+submission stage and of the requests to each kind of endpoint
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import re
+import resource
+import sys
+import tempfile
+import time
+
+import httpx
+
+from sofurry_scrape import sofurry_session
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+
+logger = logging.getLogger(__name__)
+
+FAKE_WGET_AT_PATH = pathlib.Path(__file__).parent / "mock_sofurry" / "fake_wget_at.py"
+
+RESULT_LINE_PREFIX = "END_TO_END_RESULT "
+
+
+def get_percentile(sorted_values:list[float], percentile:float) -> float:
+
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile))]
+
+
+def summarize_latencies(latencies:dict[str, list[float]]) -> dict:
+
+    summary = dict()
+    for iter_name, iter_values in latencies.items():
+        sorted_values = sorted(iter_values)
+        summary[iter_name] = {
+            "count": len(sorted_values),
+            "mean_ms": 1000 * sum(sorted_values) / len(sorted_values) if sorted_values else 0.0,
+            "p50_ms": 1000 * get_percentile(sorted_values, 0.50),
+            "p95_ms": 1000 * get_percentile(sorted_values, 0.95),
+            "max_ms": 1000 * sorted_values[-1] if sorted_values else 0.0}
+    return summary
+
+
+class MockRedirectTransport(httpx.AsyncBaseTransport):
+    '''
+    sends every request to the mock server instead, keeping the `Host` header as the real one, and keeps track
+    of how many requests were made and how long they took to get a response
+    '''
+
+    def __init__(self, port:int):
+
+        self.port = port
+        self.transport = httpx.AsyncHTTPTransport(http1=False, http2=True)
+        self.request_count = 0
+        self.latencies = dict()
+
+    async def handle_async_request(self, request:httpx.Request) -> httpx.Response:
+
+        # `/view/1234` and `/view/5678` are the same endpoint
+        endpoint = f"{request.method} {request.url.host}{re.sub('[0-9]+', '*', request.url.path)}"
+
+        # a copy, since the client looks at the original request's url to know which host the cookies are for
+        mock_request = httpx.Request(request.method, request.url.copy_with(scheme="http", host="127.0.0.1", port=self.port),
+            headers=request.headers, stream=request.stream, extensions=request.extensions)
+        self.request_count += 1
+
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(mock_request)
+        self.latencies.setdefault(endpoint, list()).append(time.perf_counter() - start)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class InstrumentedSingleUserScrape(SingleUserScrape):
+    '''
+    a `SingleUserScrape` that talks to the mock server and times each submission stage
+    '''
+
+    def __init__(self, port:int):
+        super().__init__()
+
+        self.mock_transport = MockRedirectTransport(port)
+        self.stage_latencies = dict()
+
+    def create_httpx_client(self) -> httpx.AsyncClient:
+        return sofurry_session.create_httpx_client(self.rate_limiter_registry, transport=self.mock_transport)
+
+    async def _timed(self, stage_name:str, coroutine):
+
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            self.stage_latencies.setdefault(stage_name, list()).append(time.perf_counter() - start)
+
+    async def discover_folder_ids(self, httpx_client, uid, content_type):
+        return await self._timed("folder_discovery", super().discover_folder_ids(httpx_client, uid, content_type))
+
+    async def write_submission_metadata(self, work_item):
+        return await self._timed("metadata", super().write_submission_metadata(work_item))
+
+    async def download_submission_thumbnail(self, work_item):
+        return await self._timed("thumbnail", super().download_submission_thumbnail(work_item))
+
+    async def download_submission_html(self, work_item):
+        return await self._timed("html", super().download_submission_html(work_item))
+
+    async def capture_submission_warc(self, work_item):
+        return await self._timed("warc", super().capture_submission_warc(work_item))
+
+
+async def run_one(port:int, submission_count:int, output_path:pathlib.Path, use_fake_wget:bool, scrape_args:list[str]) -> dict:
+    '''
+    scrape one made up user with `submission_count` stories, this is run in its own process
+    '''
+
+    credentials_path = output_path / "credentials.json"
+    credentials_path.write_text(json.dumps({"username": "benchmark", "password": "benchmark"}), encoding="utf-8")
+
+    argument_list = ["--username-to-scrape", f"bench_{submission_count}", "--output-path", str(output_path / "output"),
+        "--credentials-json-file", str(credentials_path)]
+    if use_fake_wget:
+        argument_list += ["--wget-path", str(FAKE_WGET_AT_PATH)]
+    if "--max-requests-per-second" not in scrape_args:
+        argument_list.append("--disable-rate-limiting")
+    argument_list += scrape_args
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--username-to-scrape", dest="username_to_scrape", required=True)
+    SingleUserScrape.add_scrape_arguments(parser)
+    parsed_args = parser.parse_args(argument_list)
+
+    scraper = InstrumentedSingleUserScrape(port)
+
+    start = time.perf_counter()
+    await scraper.run(parsed_args, asyncio.Event())
+    elapsed_seconds = time.perf_counter() - start
+
+    completed_count = len(scraper.stage_latencies.get("html", list()))
+
+    return {
+        "submissions": submission_count,
+        "completed_submissions": completed_count,
+        "seconds": elapsed_seconds,
+        "submissions_per_second": completed_count / elapsed_seconds,
+        "requests": scraper.mock_transport.request_count,
+        "requests_per_second": scraper.mock_transport.request_count / elapsed_seconds,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stage_latencies": summarize_latencies(scraper.stage_latencies),
+        "endpoint_latencies": summarize_latencies(scraper.mock_transport.latencies)}
+
+
+async def start_mock_server(server_args:list[str]) -> tuple[asyncio.subprocess.Process, int]:
+
+    process = await asyncio.create_subprocess_exec(sys.executable, "-m", "benchmarks.mock_sofurry.server", "--port", "0",
+        *server_args, stdout=asyncio.subprocess.PIPE)
+
+    line = (await process.stdout.readline()).decode("utf-8").strip()
+    match = re.search(":(?P<port>[0-9]+)$", line)
+    if not match:
+        process.kill()
+        raise Exception(f"the mock server didn't say which port it is listening on, it said `{line}`")
+
+    return (process, int(match.group("port")))
+
+
+async def run_all(args, scrape_args:list[str]) -> list[dict]:
+
+    server_args = ["--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate)]
+    server_process, port = await start_mock_server(server_args)
+    print(f"mock server is listening on port {port}", flush=True)
+
+    results = list()
+    try:
+        for iter_count in args.submissions:
+
+            with tempfile.TemporaryDirectory() as tmpdirname:
+
+                child_args = [sys.executable, "-m", "benchmarks.end_to_end", "--run-one", "--port", str(port),
+                    "--submissions", str(iter_count), "--output-path", tmpdirname, "--log-level", args.log_level]
+                if args.use_fake_wget:
+                    child_args.append("--use-fake-wget")
+
+                print(f"scraping a user with {iter_count} submissions...", flush=True)
+                process = await asyncio.create_subprocess_exec(*child_args, "--", *scrape_args, stdout=asyncio.subprocess.PIPE)
+                stdout, _ = await process.communicate()
+                if process.returncode != 0:
+                    raise Exception(f"the scrape of `{iter_count}` submissions exited with `{process.returncode}`")
+
+                result_lines = [iter_line for iter_line in stdout.decode("utf-8").splitlines() if iter_line.startswith(RESULT_LINE_PREFIX)]
+                results.append(json.loads(result_lines[-1][len(RESULT_LINE_PREFIX):]))
+
+    finally:
+        server_process.terminate()
+        await server_process.wait()
+
+    return results
+
+
+def print_results(results:list[dict]):
+
+    print()
+    print(f"{'submissions':>12} {'seconds':>9} {'subs/s':>9} {'requests/s':>11} {'peak rss':>10}")
+    for iter_result in results:
+        print(f"{iter_result['submissions']:>12} {iter_result['seconds']:>9.2f} {iter_result['submissions_per_second']:>9.1f} "
+            f"{iter_result['requests_per_second']:>11.1f} {iter_result['peak_rss_mb']:>8.1f}MB")
+
+    for iter_result in results:
+        print()
+        print(f"{iter_result['submissions']} submissions, {iter_result['completed_submissions']} completed:")
+        for iter_kind in ("stage_latencies", "endpoint_latencies"):
+            for iter_name, iter_summary in sorted(iter_result[iter_kind].items()):
+                print(f"  {iter_name:<45} n={iter_summary['count']:<7} mean={iter_summary['mean_ms']:8.2f}ms "
+                    f"p50={iter_summary['p50_ms']:8.2f}ms p95={iter_summary['p95_ms']:8.2f}ms max={iter_summary['max_ms']:8.2f}ms")
+
+
+def main():
+
+    argv = sys.argv[1:]
+    scrape_args = list()
+    if "--" in argv:
+        scrape_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(description="end to end benchmark of a scrape against a local stand-in for sofurry")
+    parser.add_argument("--submissions", type=int, nargs="+", default=[10, 1000],
+        help="the sizes of the users to scrape, each one is a separate run")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="the average latency of the mock server")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of requests the mock server fails with a 503")
+    parser.add_argument("--use-fake-wget", action="store_true", help="capture warcs with the fake wget-at")
+    parser.add_argument("--results-json", type=pathlib.Path, help="also write the results to this file")
+    parser.add_argument("--log-level", default="WARNING", help="the log level of the scrape, defaults to WARNING")
+
+    # used when running a single size in its own process
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output-path", type=pathlib.Path, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, stream=sys.stderr)
+
+    if args.run_one:
+        result = asyncio.run(run_one(args.port, args.submissions[0], args.output_path, args.use_fake_wget, scrape_args))
+        print(RESULT_LINE_PREFIX + json.dumps(result), flush=True)
+        return
+
+    results = asyncio.run(run_all(args, scrape_args))
+    print_results(results)
+
+    if args.results_json:
+        args.results_json.write_text(json.dumps(results, indent=4), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
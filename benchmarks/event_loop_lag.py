@@ -0,0 +1,160 @@
+'''
+benchmark for how long the event loop gets stuck while a scrape writes its output, with the files written, the
+folders created and `sha256sums.txt` updated right on the event loop like they used to be, compared to going
+through `output_writer.OutputWriter`
+
+run from the root of the repo:
+
+    python -m benchmarks.event_loop_lag --submissions 500 --fsync-latency-ms 5
+
+a slow disk (like an nfs or sshfs mount) is made up by having every `os.fsync()` sleep for `--fsync-latency-ms`,
+pass `--fsync-latency-ms 0` to see what the local disk does on its own. Pass `--output-dir` to write somewhere
+other than a temporary folder, like the network mount a real scrape would write to
+'''
+
+import argparse
+import asyncio
+import hashlib
+import os
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+
+from sofurry_scrape import utils
+from sofurry_scrape import output_writer
+
+CHECKSUMS_FILENAME = "sha256sums.txt"
+
+
+def make_submission_files(rng:random.Random, file_size_kb:int) -> list[tuple[str, bytes]]:
+    ''' the files one submission has: the metadata json, the thumbnail, the html and the content file '''
+
+    return [
+        ("info.json", rng.randbytes(2 * 1024)),
+        ("thumbnail.jpg", rng.randbytes(16 * 1024)),
+        ("story.html", rng.randbytes(64 * 1024)),
+        ("content.bin", rng.randbytes(file_size_kb * 1024)),
+    ]
+
+
+async def _write_on_loop(output_dir:pathlib.Path, submission_id:int, files:list):
+    ''' how a submission's output used to be written, everything right on the event loop '''
+
+    submission_dir = output_dir / str(submission_id)
+    submission_dir.mkdir(parents=True, exist_ok=True)
+    for iter_name, iter_data in files:
+        # let the other submissions have a turn, like waiting on the download did
+        await asyncio.sleep(0)
+        utils.write_file_atomically(submission_dir / iter_name, iter_data)
+        utils.update_checksums(submission_dir / CHECKSUMS_FILENAME,
+            {submission_dir / iter_name: hashlib.sha256(iter_data).hexdigest()})
+
+
+async def _write_with_writer(writer:output_writer.OutputWriter, output_dir:pathlib.Path, submission_id:int, files:list):
+
+    submission_dir = output_dir / str(submission_id)
+    await writer.mkdir(submission_dir)
+
+    async def _write_one(name:str, data:bytes):
+        await writer.write_file(submission_dir / name, data)
+        await writer.record_checksum(submission_dir / CHECKSUMS_FILENAME, submission_dir / name,
+            hashlib.sha256(data).hexdigest())
+
+    # the stages of a submission run at the same time, so its checksums get batched
+    await asyncio.gather(*(_write_one(iter_name, iter_data) for iter_name, iter_data in files))
+
+
+async def measure_event_loop_lag(write_submission, submission_count:int, concurrency:int, files:list) -> tuple[list[float], float]:
+    '''
+    write `submission_count` submissions, `concurrency` at a time, while a task checks how late the event loop wakes
+    it up every millisecond
+
+    @return a tuple of (how late each tick was in seconds, how long writing took in seconds)
+    '''
+
+    lags = list()
+    done = False
+
+    async def _ticker():
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(max(0.0, time.perf_counter() - before - 0.001))
+
+    ticker_task = asyncio.create_task(_ticker())
+    await asyncio.sleep(0.01)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _limited(submission_id:int):
+        async with semaphore:
+            await write_submission(submission_id, files)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_limited(x) for x in range(submission_count)))
+    elapsed = time.perf_counter() - start
+
+    done = True
+    await ticker_task
+    return (lags, elapsed)
+
+
+def print_result(name:str, lags:list[float], elapsed:float, submission_count:int):
+
+    p99 = statistics.quantiles(lags, n=100)[98] if len(lags) >= 2 else max(lags, default=0.0)
+    print(f"{name:<40} max lag {max(lags, default=0.0) * 1000:8.1f} ms, p99 lag {p99 * 1000:7.1f} ms, "
+        f"{elapsed:6.2f} s total, {submission_count / elapsed:7.1f} submissions/s")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="benchmark how long writing the output holds up the event loop")
+    parser.add_argument("--submissions", type=int, default=500, help="how many submissions to write")
+    parser.add_argument("--concurrency", type=int, default=16, help="how many submissions are written at a time")
+    parser.add_argument("--file-size-kb", type=int, default=256, help="how big each submission's content file is")
+    parser.add_argument("--fsync-latency-ms", type=float, default=5.0,
+        help="how long every fsync takes on top of the real one, to make up a slow network disk")
+    parser.add_argument("--writer-threads", type=int, default=output_writer.DEFAULT_WRITER_THREADS,
+        help="how many threads the output writer has")
+    parser.add_argument("--output-dir", type=pathlib.Path, help="where to write, defaults to a temporary folder")
+    args = parser.parse_args()
+
+    real_fsync = os.fsync
+
+    def _slow_fsync(fd):
+        time.sleep(args.fsync_latency_ms / 1000)
+        real_fsync(fd)
+
+    os.fsync = _slow_fsync
+
+    files = make_submission_files(random.Random(1234), args.file_size_kb)
+    print(f"{args.submissions} submissions of {sum(len(x) for _, x in files) / 1024:.0f} KB, {args.concurrency} at a time, "
+        f"fsync takes an extra {args.fsync_latency_ms} ms")
+
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as tmpdirname:
+
+        on_loop_dir = pathlib.Path(tmpdirname) / "on_loop"
+        lags, elapsed = asyncio.run(measure_event_loop_lag(
+            lambda submission_id, files: _write_on_loop(on_loop_dir, submission_id, files),
+            args.submissions, args.concurrency, files))
+        print_result("old: on the event loop", lags, elapsed, args.submissions)
+
+        for iter_fsync_policy in output_writer.FSYNC_POLICIES:
+
+            writer_dir = pathlib.Path(tmpdirname) / f"writer_{iter_fsync_policy}"
+            writer = output_writer.OutputWriter(args.writer_threads, iter_fsync_policy)
+            writer.open()
+            lags, elapsed = asyncio.run(measure_event_loop_lag(
+                lambda submission_id, files: _write_with_writer(writer, writer_dir, submission_id, files),
+                args.submissions, args.concurrency, files))
+            # `on-close` syncs everything here, so it counts towards the total
+            close_start = time.perf_counter()
+            writer.close()
+            elapsed += time.perf_counter() - close_start
+            print_result(f"new: OutputWriter, --fsync {iter_fsync_policy}", lags, elapsed, args.submissions)
+
+
+if __name__ == "__main__":
+    main()
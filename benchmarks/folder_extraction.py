@@ -0,0 +1,154 @@
+'''
+benchmark for finding the folder ids on a `/browse/user/stories` page with `html_extract.extract_folder_ids`,
+compared to parsing the whole page with BeautifulSoup like it used to be done
+
+run from the root of the repo:
+
+    python -m benchmarks.folder_extraction --html-dir ./saved_pages
+
+where the html dir has `/browse/user/stories?by=<uid>` pages saved as `.html` files. Without `--html-dir`, a made
+up page with lots of stories and folders is used instead
+'''
+
+import argparse
+import asyncio
+import pathlib
+import random
+import string
+import time
+
+from bs4 import BeautifulSoup
+
+from sofurry_scrape import html_extract
+
+
+def old_extract_folder_ids(html:bytes, features:str) -> list[str]:
+    ''' how the folder ids used to be found, in `SingleUserScrape.discover_story_folder_ids` '''
+
+    soup = BeautifulSoup(html, features=features)
+    folders_to_download = list()
+    for iter_folder_img_tag in soup.select("img.sfFolderItem"):
+        href = iter_folder_img_tag.parent["href"]
+        folders_to_download.append(html_extract.folder_id_regex.search(href).groupdict()["folderid"])
+    return folders_to_download
+
+
+def make_synthetic_page(rng:random.Random, story_count:int, folder_count:int) -> bytes:
+    '''
+    a page shaped like a big profile's story listing, the folders are near the top and then there are the stories
+    '''
+
+    def _words(count):
+        return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(count))
+
+    parts = ["<!DOCTYPE html><html><head><title>stories</title>",
+        "<script>var x = '<a href=\"?folder=999\">';</script></head><body><div id='sf-nav'>",
+        "".join(f"<li><a href='/browse/{_words(1)}'>{_words(2)}</a></li>" for _ in range(60)),
+        "</div><div class='sf-folders'>"]
+
+    for iter_folder_id in range(folder_count):
+        parts.append(f"<div class='sfFolderBox'><a href=\"/browse/folder/stories?by=1234&amp;folder={10000 + iter_folder_id}\">"
+            f"<img class=\"sfFolderItem\" src=\"/images/folder.png\" alt=\"{_words(2)}\"></a>"
+            f"<span class='sfFolderTitle'>{_words(3)}</span></div>")
+
+    parts.append("</div><div class='sf-stories'>")
+    for _ in range(story_count):
+        submission_id = rng.randint(100000, 2000000)
+        parts.append(f"<div class='sf-story'><a href='/view/{submission_id}'><img class='sfThumb' "
+            f"src='https://www.sofurryfiles.com/std/thumb?page={submission_id}'></a>"
+            f"<div class='sf-story-title'><a href='/view/{submission_id}'>{_words(4)}</a></div>"
+            f"<div class='sf-story-desc'>{_words(40)}</div><div class='sf-tags'>"
+            + "".join(f"<a href='/tags/{_words(1)}'>{_words(1)}</a> " for _ in range(10)) + "</div></div>")
+
+    parts.append("</div></body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def load_pages(html_dir:pathlib.Path|None, story_count:int, folder_count:int) -> list[bytes]:
+
+    if html_dir:
+        return [iter_path.read_bytes() for iter_path in sorted(html_dir.glob("*.html"))]
+
+    return [make_synthetic_page(random.Random(1234), story_count, folder_count)]
+
+
+def time_extractor(name:str, extractor, pages:list, repeats:int):
+
+    best_seconds = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for iter_page in pages:
+            extractor(iter_page)
+        elapsed = time.perf_counter() - start
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+
+    print(f"{name:<40} {best_seconds * 1000 / len(pages):9.2f} ms per page")
+
+
+async def measure_event_loop_blocking(pages:list) -> tuple[float, float]:
+    '''
+    @return the longest time the event loop was stuck, when parsing on the event loop, and with `asyncio.to_thread()`
+    '''
+
+    async def _longest_tick_while(coroutine) -> float:
+
+        longest_tick = 0.0
+        done = False
+
+        async def _ticker():
+            nonlocal longest_tick
+            last = time.perf_counter()
+            while not done:
+                await asyncio.sleep(0.001)
+                now = time.perf_counter()
+                longest_tick = max(longest_tick, now - last)
+                last = now
+
+        ticker_task = asyncio.create_task(_ticker())
+        await asyncio.sleep(0.01)
+        await coroutine
+        done = True
+        await ticker_task
+        return longest_tick
+
+    async def _on_loop():
+        for iter_page in pages:
+            old_extract_folder_ids(iter_page, "lxml")
+
+    async def _in_thread():
+        for iter_page in pages:
+            await asyncio.to_thread(html_extract.extract_folder_ids, iter_page)
+
+    return (await _longest_tick_while(_on_loop()), await _longest_tick_while(_in_thread()))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="benchmark finding the folder ids on a user's story listing page")
+    parser.add_argument("--html-dir", type=pathlib.Path, help="folder of saved `.html` pages")
+    parser.add_argument("--story-count", type=int, default=1000, help="how many stories the made up page has")
+    parser.add_argument("--folder-count", type=int, default=50, help="how many folders the made up page has")
+    parser.add_argument("--repeats", type=int, default=5, help="how many times to go through the pages, the best one is reported")
+    args = parser.parse_args()
+
+    pages = load_pages(args.html_dir, args.story_count, args.folder_count)
+    if not pages:
+        raise Exception(f"no `.html` files found in `{args.html_dir}`")
+
+    for iter_page in pages:
+        if old_extract_folder_ids(iter_page, "lxml") != html_extract.extract_folder_ids(iter_page):
+            raise Exception("the old and new extractors don't agree on a page")
+
+    print(f"{len(pages)} pages, {sum(len(iter_page) for iter_page in pages) / 1024:.0f} KB")
+
+    time_extractor("old: BeautifulSoup, html.parser", lambda page: old_extract_folder_ids(page, "html.parser"), pages, args.repeats)
+    time_extractor("old: BeautifulSoup, lxml", lambda page: old_extract_folder_ids(page, "lxml"), pages, args.repeats)
+    time_extractor("new: html_extract.extract_folder_ids", html_extract.extract_folder_ids, pages, args.repeats)
+
+    on_loop_seconds, in_thread_seconds = asyncio.run(measure_event_loop_blocking(pages))
+    print(f"longest event loop stall: {on_loop_seconds * 1000:.1f} ms parsing on the loop (old), "
+        f"{in_thread_seconds * 1000:.1f} ms with asyncio.to_thread (new)")
+
+
+if __name__ == "__main__":
+    main()
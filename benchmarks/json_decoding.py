@@ -0,0 +1,119 @@
+'''
+benchmark for `utils.escape_and_parse_json_omg`, compared to how it used to work (escaping every newline
+and then parsing)
+
+run from the root of the repo:
+
+    python -m benchmarks.json_decoding --corpus-dir ./captured_responses
+
+where the corpus dir has responses from `/browse/user/stories?format=json` saved as `.json` files, for example with
+`curl --cookie ... "https://www.sofurry.com/browse/user/stories?by=<uid>&format=json&stories-page=1" > page1.json`.
+Without `--corpus-dir`, a corpus of made up pages that look like those responses is used instead
+'''
+
+import argparse
+import json
+import pathlib
+import random
+import string
+import time
+
+from sofurry_scrape import utils
+
+
+def old_escape_and_parse_json_omg(maybe_naughty_json_str:str) -> dict:
+    ''' how `utils.escape_and_parse_json_omg` used to work '''
+
+    escaped_json = maybe_naughty_json_str.replace("\n", "\\n")
+    return json.loads(escaped_json)
+
+
+def make_synthetic_page(rng:random.Random, items_per_page:int=30) -> bytes:
+    '''
+    a page shaped like a story listing response, the descriptions have raw newlines in them like the real ones do
+    '''
+
+    def _words(count):
+        return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(count))
+
+    items = list()
+    for _ in range(items_per_page):
+        submission_id = rng.randint(100000, 2000000)
+        description = "\n".join(_words(rng.randint(5, 30)) for _ in range(rng.randint(1, 6)))
+        items.append({
+            "id": str(submission_id),
+            "title": _words(rng.randint(1, 6)),
+            "description": description,
+            "author": _words(1),
+            "authorID": str(rng.randint(1000, 900000)),
+            "contentType": "0",
+            "contentLevel": str(rng.randint(0, 2)),
+            "date": str(rng.randint(1100000000, 1700000000)),
+            "tags": ", ".join(_words(1) for _ in range(rng.randint(0, 25))),
+            "thumbnail": f"http://www.sofurryfiles.com/std/thumb?page={submission_id}",
+            "link": f"http://www.sofurry.com/view/{submission_id}",
+        })
+
+    # the raw newlines are what make this invalid json
+    page = json.dumps({"items": items, "pagination": {"currentPage": 1}}).replace("\\n", "\n")
+    return page.encode("utf-8")
+
+
+def load_corpus(corpus_dir:pathlib.Path|None, synthetic_pages:int) -> list[bytes]:
+
+    if corpus_dir:
+        return [iter_path.read_bytes() for iter_path in sorted(corpus_dir.glob("*.json"))]
+
+    rng = random.Random(1234)
+    return [make_synthetic_page(rng) for _ in range(synthetic_pages)]
+
+
+def time_decoder(name:str, decoder, corpus:list, repeats:int):
+
+    # make sure they all agree first
+    for iter_page in corpus:
+        decoder(iter_page)
+
+    best_seconds = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for iter_page in corpus:
+            decoder(iter_page)
+        elapsed = time.perf_counter() - start
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+
+    total_mb = sum(len(iter_page) for iter_page in corpus) / (1024 * 1024)
+    print(f"{name:<45} {best_seconds * 1000:9.2f} ms  {len(corpus) / best_seconds:10.0f} pages/s  {total_mb / best_seconds:8.1f} MB/s")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="benchmark the json decoding of sofurry api responses")
+    parser.add_argument("--corpus-dir", type=pathlib.Path, help="folder of saved `.json` responses")
+    parser.add_argument("--synthetic-pages", type=int, default=2000, help="how many pages to make up without --corpus-dir")
+    parser.add_argument("--repeats", type=int, default=5, help="how many times to go through the corpus, the best one is reported")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus_dir, args.synthetic_pages)
+    if not corpus:
+        raise Exception(f"no `.json` files found in `{args.corpus_dir}`")
+
+    for iter_page in corpus:
+        if old_escape_and_parse_json_omg(iter_page.decode("utf-8")) != utils.escape_and_parse_json_omg(iter_page):
+            raise Exception("the old and new decoders don't agree on a page in the corpus")
+
+    print(f"{len(corpus)} pages, {sum(len(iter_page) for iter_page in corpus) / (1024 * 1024):.1f} MB, orjson installed: {utils.orjson is not None}")
+
+    time_decoder("old: decode + replace + json.loads", lambda page: old_escape_and_parse_json_omg(page.decode("utf-8")), corpus, args.repeats)
+    time_decoder("new: json.loads(strict=False)", lambda page: json.loads(page, strict=False), corpus, args.repeats)
+    if utils.orjson:
+        time_decoder("new: escape_and_parse_json_omg (orjson first)", utils.escape_and_parse_json_omg, corpus, args.repeats)
+
+        # how fast orjson is on pages that don't need the control characters fixed
+        valid_corpus = [utils.orjson.dumps(utils.escape_and_parse_json_omg(iter_page)) for iter_page in corpus]
+        time_decoder("valid json only: json.loads(strict=False)", lambda page: json.loads(page, strict=False), valid_corpus, args.repeats)
+        time_decoder("valid json only: escape_and_parse_json_omg", utils.escape_and_parse_json_omg, valid_corpus, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
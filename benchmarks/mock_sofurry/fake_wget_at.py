@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+a stand-in for wget-at for benchmarking, it takes the same arguments `wget_utils.get_wget_args()` gives it, waits
+a bit, and writes a small warc with a warcinfo record that has the `--warc-header`s in it, and a made up chunked
+response for the url it was given (the last argument), since it can't reach the mock server
+
+it is controlled with environment variables, since it gets run with the scraper's environment:
+
+* FAKE_WGET_AT_SECONDS: how long to take, defaults to 0.05
+* FAKE_WGET_AT_FAILURE_RATE: the fraction of runs that exit with 4 (network failure), defaults to 0
+'''
+
+import gzip
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+def create_record(record_type:str, headers:str, content:bytes) -> bytes:
+
+    return (f"WARC/1.1\r\nWARC-Type: {record_type}\r\nWARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n" +
+        f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n" + headers +
+        f"Content-Length: {len(content)}\r\n\r\n").encode("utf-8") + content + b"\r\n\r\n"
+
+
+def main():
+
+    args = sys.argv[1:]
+
+    warc_file = None
+    warc_headers = list()
+    index = 0
+    while index < len(args):
+        if args[index] == "--warc-file":
+            warc_file = args[index + 1]
+            index += 1
+        elif args[index] == "--warc-header":
+            warc_headers.append(args[index + 1])
+            index += 1
+        index += 1
+
+    time.sleep(float(os.environ.get("FAKE_WGET_AT_SECONDS", "0.05")))
+
+    if random.random() < float(os.environ.get("FAKE_WGET_AT_FAILURE_RATE", "0")):
+        print("fake wget-at: pretending the network failed", flush=True)
+        sys.exit(4)
+
+    if warc_file is None:
+        print("fake wget-at: no --warc-file given", flush=True)
+        sys.exit(2)
+
+    url = args[-1]
+
+    warcinfo_content = ("software: fake_wget_at\r\nformat: WARC File Format 1.1\r\n" +
+        "".join(f"{iter_header}\r\n" for iter_header in warc_headers)).encode("utf-8")
+
+    body = f"<!DOCTYPE html>\n<html><body>fake wget-at capture of {url}</body></html>\n".encode("utf-8")
+    response_content = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nTransfer-Encoding: chunked\r\n\r\n" + \
+        f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n0\r\n\r\n"
+
+    with gzip.open(f"{warc_file}.warc.gz", "wb") as f:
+        f.write(create_record("warcinfo", "Content-Type: application/warc-fields\r\n", warcinfo_content))
+        f.write(create_record("response", f"WARC-Target-URI: {url}\r\nContent-Type: application/http; msgtype=response\r\n",
+            response_content))
+
+    print(f"fake wget-at: wrote {warc_file}.warc.gz", flush=True)
+
+
+if __name__ == "__main__":
+    main()
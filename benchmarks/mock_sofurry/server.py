@@ -0,0 +1,410 @@
+'''
+a local HTTP/2 stand-in for www.sofurry.com, api2.sofurry.com and the sofurryfiles cdn, built from the files in
+`fixtures/`, for benchmarking a scrape without touching the real site
+
+it speaks cleartext HTTP/2 with prior knowledge, which is what httpx does for `http://` urls with
+`http1=False, http2=True`. It doesn't care about the host, so everything can be sent to it with the `Host` header
+left as the real one
+
+users are made up from their username: `bench_<number>` is a user with that many stories, for example
+`bench_5000`. Some of the stories are in folders, the rest are in the user's listing. Like the real site, asking
+for a page past the last one gives page 1 again
+
+they also have a quarter as many artwork, music, journals and photos, which are listed the same way as the
+stories. Artwork, music and photos have a file at `/std/content`, and journals don't have a thumbnail
+
+run it on its own with:
+
+    python -m benchmarks.mock_sofurry.server --port 8080
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import random
+import re
+import string
+import urllib.parse
+
+import attr
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = pathlib.Path(__file__).parent / "fixtures"
+
+USERNAME_REGEX = re.compile("^bench_(?P<count>[0-9]+)$")
+
+# the path part of each kind of listing -> its `contentType`, in the same order as the submission ids are handed out
+LISTING_KINDS = {"stories": "0", "art": "1", "music": "2", "journals": "3", "photos": "4"}
+
+# the submissions of a user are `uid * 100000` and up, each kind gets this many of those ids
+SUBMISSION_IDS_PER_KIND = 20000
+
+LISTING_PATH_REGEX = re.compile("^/browse/(?P<listing>user|folder)/(?P<kind>[a-z]+)$")
+
+SESSION_COOKIE_NAME = "PHPSESSID"
+SESSION_COOKIE_PREFIX = "benchmarksession"
+
+# what the real login page has on it when you aren't logged in
+LOGIN_FORM_HTML = b'<html><form method="post"><input name="LoginForm[sfLoginUsername]"><input name="LoginForm[sfLoginPassword]"></form></html>'
+
+
+def load_fixture(name:str) -> string.Template:
+    return string.Template((FIXTURES_DIR / name).read_text(encoding="utf-8"))
+
+
+@attr.define
+class MockResponse:
+    status:int
+    content_type:str
+    body:bytes
+    extra_headers:list = attr.Factory(list)
+
+
+class MockSofurrySite:
+    '''
+    makes up the responses, without any of the HTTP/2 parts so it can be used on its own
+    '''
+
+    def __init__(self, page_size:int=30, folders_per_user:int=5, folder_fraction:float=0.2,
+        latency_ms:float=0.0, error_rate:float=0.0, seed:int=1234, rotate_session_every:int=0):
+
+        self.page_size = page_size
+        self.folders_per_user = folders_per_user
+        self.folder_fraction = folder_fraction
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+        self.user_profile_template = load_fixture("user_profile.json")
+        self.story_item_template = load_fixture("story_item.json")
+        self.story_listing_template = load_fixture("story_listing.html")
+        self.story_listing_folder_template = load_fixture("story_listing_folder.html")
+        self.story_listing_story_template = load_fixture("story_listing_story.html")
+        self.submission_template = load_fixture("submission.html")
+        self.thumbnail_bytes = (FIXTURES_DIR / "thumbnail.png").read_bytes()
+
+        self.request_count = 0
+
+        # if set, every this many requests a response to www gives the client a new session cookie
+        self.rotate_session_every = rotate_session_every
+        self.session_number = 0
+
+    def get_user(self, uid:str) -> tuple[str, int]:
+        ''' @return the username and story count of a uid, the uid is the story count '''
+        return (f"bench_{uid}", int(uid))
+
+    def get_folder_ids(self, uid:str) -> list[str]:
+
+        _, story_count = self.get_user(uid)
+        if story_count < 10:
+            return list()
+        return [f"{uid}{iter_index:03}" for iter_index in range(self.folders_per_user)]
+
+    def get_submission_count(self, uid:str, kind:str) -> int:
+
+        _, story_count = self.get_user(uid)
+        if kind == "stories":
+            return story_count
+        return min(story_count // 4, SUBMISSION_IDS_PER_KIND)
+
+    def get_listing_submission_ids(self, uid:str, folder_id:str|None, kind:str="stories") -> list[int]:
+        '''
+        the submissions of a kind in the user's listing (`folder_id` is None) or in one of their folders, newest first
+        '''
+
+        story_count = self.get_submission_count(uid, kind)
+        folder_ids = self.get_folder_ids(uid)
+        first_id = int(uid) * 100000 + list(LISTING_KINDS).index(kind) * SUBMISSION_IDS_PER_KIND
+
+        in_folders = int(story_count * self.folder_fraction) if folder_ids else 0
+        if folder_id is None:
+            submission_ids = range(first_id + in_folders, first_id + story_count)
+        else:
+            folder_index = folder_ids.index(folder_id)
+            per_folder = in_folders // len(folder_ids)
+            end = in_folders if folder_index == len(folder_ids) - 1 else (folder_index + 1) * per_folder
+            submission_ids = range(first_id + (folder_index * per_folder), first_id + end)
+
+        return list(reversed(submission_ids))
+
+    def get_page_count(self, submission_ids:list[int]) -> int:
+        return max(1, -(-len(submission_ids) // self.page_size))
+
+    def get_page(self, submission_ids:list[int], page_number:int) -> list[int]:
+
+        page_count = self.get_page_count(submission_ids)
+        if page_number < 1 or page_number > page_count:
+            # the sofurry quirk, going past the end gives you the first page again
+            page_number = 1
+        return submission_ids[(page_number - 1) * self.page_size:page_number * self.page_size]
+
+    def get_uid_of_submission(self, submission_id:int) -> str:
+        return str(submission_id // 100000)
+
+    def get_kind_of_submission(self, submission_id:int) -> str:
+        return list(LISTING_KINDS)[min((submission_id % 100000) // SUBMISSION_IDS_PER_KIND, len(LISTING_KINDS) - 1)]
+
+    def get_title_of_submission(self, submission_id:int) -> str:
+        return f"{self.get_kind_of_submission(submission_id)} {submission_id}"
+
+    def render_story_item(self, submission_id:int) -> str:
+
+        uid = self.get_uid_of_submission(submission_id)
+        username, _ = self.get_user(uid)
+        kind = self.get_kind_of_submission(submission_id)
+        thumbnail = "" if kind == "journals" else f"http://www.sofurryfiles.com/std/thumb?page={submission_id}"
+        return self.story_item_template.substitute(submission_id=submission_id, title=self.get_title_of_submission(submission_id),
+            username=username, uid=uid, kind=kind, content_type=LISTING_KINDS[kind], thumbnail=thumbnail)
+
+    def get_session_cookie_header(self) -> tuple[str, str]:
+        return ("set-cookie", f"{SESSION_COOKIE_NAME}={SESSION_COOKIE_PREFIX}{self.session_number}; path=/")
+
+    async def handle(self, method:str, path:str, query:dict, cookie_header:str="") -> MockResponse:
+
+        response = await self.handle_request(method, path, query, cookie_header)
+
+        # only the www pages, since the cookie is only for the host that sets it
+        if self.rotate_session_every and self.request_count % self.rotate_session_every == 0 and \
+            path.startswith(("/browse/", "/view/")) and f"{SESSION_COOKIE_NAME}={SESSION_COOKIE_PREFIX}" in cookie_header:
+            self.session_number += 1
+            response.extra_headers.append(self.get_session_cookie_header())
+
+        return response
+
+    async def handle_request(self, method:str, path:str, query:dict, cookie_header:str) -> MockResponse:
+
+        self.request_count += 1
+
+        if self.latency_ms:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency_ms / 1000)
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return MockResponse(503, "text/plain", b"service unavailable", [("retry-after", "1")])
+
+        if path in ("/", "/user/login"):
+            if method == "POST":
+                return MockResponse(200, "text/html", b"<html>logged in</html>", [self.get_session_cookie_header()])
+            if path == "/user/login" and f"{SESSION_COOKIE_NAME}={SESSION_COOKIE_PREFIX}" not in cookie_header:
+                return MockResponse(200, "text/html", LOGIN_FORM_HTML)
+            return MockResponse(200, "text/html", b"<html>sofurry</html>")
+
+        if path == "/std/getUserProfile":
+            match = USERNAME_REGEX.match(query.get("username", ""))
+            if not match:
+                return MockResponse(404, "application/json", b'{"error": "no such user"}')
+            uid = str(int(match.group("count")))
+            body = self.user_profile_template.substitute(uid=uid, username=f"bench_{uid}", submission_count=uid)
+            return MockResponse(200, "application/json", body.encode("utf-8"))
+
+        listing_match = LISTING_PATH_REGEX.match(path)
+        if listing_match and listing_match.group("kind") in LISTING_KINDS:
+
+            kind = listing_match.group("kind")
+            uid = query.get("by", "0")
+            folder_id = query.get("folder") if listing_match.group("listing") == "folder" else None
+            if not uid.isdigit() or (folder_id is not None and folder_id not in self.get_folder_ids(uid)):
+                return MockResponse(404, "text/plain", b"not found")
+
+            listing_ids = self.get_listing_submission_ids(uid, folder_id, kind)
+            page_ids = self.get_page(listing_ids, int(query.get(f"{kind}-page", "1")))
+
+            if query.get("format") == "json":
+                body = '{"items":[' + ",".join(self.render_story_item(iter_id) for iter_id in page_ids) + "]}"
+                return MockResponse(200, "application/json", body.encode("utf-8"))
+
+            username, _ = self.get_user(uid)
+            folders = "\n".join(self.story_listing_folder_template.substitute(uid=uid, folder_id=iter_folder_id, kind=kind)
+                for iter_folder_id in self.get_folder_ids(uid))
+            stories = "\n".join(self.story_listing_story_template.substitute(submission_id=iter_id, title=self.get_title_of_submission(iter_id))
+                for iter_id in page_ids)
+            body = self.story_listing_template.substitute(username=username, uid=uid, folders=folders, stories=stories)
+            return MockResponse(200, "text/html; charset=utf-8", body.encode("utf-8"))
+
+        if path == "/std/thumb":
+            return MockResponse(200, "image/png", self.thumbnail_bytes)
+
+        if path == "/std/content" and query.get("page", "").isdigit():
+            submission_id = int(query["page"])
+            if self.get_kind_of_submission(submission_id) == "music":
+                # something that is a bit bigger than a page, so it takes a few reads to stream
+                body = bytes(iter_index % 251 for iter_index in range(256 * 1024))
+                return MockResponse(200, "audio/mpeg", body, [("content-disposition", f'attachment; filename="song {submission_id}.mp3"')])
+            return MockResponse(200, "image/png", self.thumbnail_bytes)
+
+        if path.startswith("/view/") and path[len("/view/"):].isdigit():
+            submission_id = int(path[len("/view/"):])
+            uid = self.get_uid_of_submission(submission_id)
+            username, _ = self.get_user(uid)
+            story_body = "\n".join(f"<p>paragraph {iter_index} of story {submission_id}, " + ("lorem ipsum " * 40) + "</p>"
+                for iter_index in range(20))
+            body = self.submission_template.substitute(title=self.get_title_of_submission(submission_id), username=username, uid=uid,
+                submission_id=submission_id, body=story_body)
+            return MockResponse(200, "text/html; charset=utf-8", body.encode("utf-8"))
+
+        return MockResponse(404, "text/plain", b"not found")
+
+
+class H2ServerProtocol(asyncio.Protocol):
+    '''
+    one HTTP/2 connection, each request is handled in its own task so slow responses don't hold up the others
+    '''
+
+    def __init__(self, site:MockSofurrySite):
+
+        self.site = site
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        self.transport = None
+
+        # stream id -> (headers, body)
+        self.requests = dict()
+        # stream id -> event that is set when the client gives us more flow control window
+        self.window_events = dict()
+        self.tasks = set()
+
+    def connection_made(self, transport):
+
+        self.transport = transport
+        self.connection.initiate_connection()
+        self.connection.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 1000})
+        self.transport.write(self.connection.data_to_send())
+
+    def connection_lost(self, exc):
+
+        for iter_task in self.tasks:
+            iter_task.cancel()
+        for iter_event in self.window_events.values():
+            iter_event.set()
+
+    def data_received(self, data:bytes):
+
+        try:
+            events = self.connection.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self.transport.write(self.connection.data_to_send())
+            self.transport.close()
+            return
+
+        for iter_event in events:
+
+            if isinstance(iter_event, h2.events.RequestReceived):
+                self.requests[iter_event.stream_id] = (dict(iter_event.headers), bytearray())
+
+            elif isinstance(iter_event, h2.events.DataReceived):
+                if iter_event.stream_id in self.requests:
+                    self.requests[iter_event.stream_id][1].extend(iter_event.data)
+                self.connection.acknowledge_received_data(iter_event.flow_controlled_length, iter_event.stream_id)
+
+            elif isinstance(iter_event, h2.events.StreamEnded):
+                if iter_event.stream_id in self.requests:
+                    task = asyncio.create_task(self.handle_request(iter_event.stream_id))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+
+            elif isinstance(iter_event, h2.events.StreamReset):
+                self.requests.pop(iter_event.stream_id, None)
+                if iter_event.stream_id in self.window_events:
+                    self.window_events[iter_event.stream_id].set()
+
+            elif isinstance(iter_event, h2.events.WindowUpdated):
+                if iter_event.stream_id == 0:
+                    for iter_window_event in self.window_events.values():
+                        iter_window_event.set()
+                elif iter_event.stream_id in self.window_events:
+                    self.window_events[iter_event.stream_id].set()
+
+            elif isinstance(iter_event, h2.events.ConnectionTerminated):
+                self.transport.close()
+
+        self.transport.write(self.connection.data_to_send())
+
+    async def handle_request(self, stream_id:int):
+
+        headers, _ = self.requests.pop(stream_id)
+        url = urllib.parse.urlsplit(headers[":path"])
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        response = await self.site.handle(headers[":method"], url.path, query, headers.get("cookie", ""))
+
+        response_headers = [(":status", str(response.status)), ("content-type", response.content_type),
+            ("content-length", str(len(response.body)))] + response.extra_headers
+
+        try:
+            self.connection.send_headers(stream_id, response_headers, end_stream=not response.body)
+            self.transport.write(self.connection.data_to_send())
+            await self.send_body(stream_id, response.body)
+        except h2.exceptions.StreamClosedError:
+            # the client went away
+            pass
+        finally:
+            self.window_events.pop(stream_id, None)
+
+    async def send_body(self, stream_id:int, body:bytes):
+
+        while body:
+
+            window = min(self.connection.local_flow_control_window(stream_id), self.connection.max_outbound_frame_size)
+            if window < 1:
+                self.window_events[stream_id] = asyncio.Event()
+                await self.window_events[stream_id].wait()
+                if self.transport.is_closing():
+                    return
+                continue
+
+            chunk, body = body[:window], body[window:]
+            self.connection.send_data(stream_id, chunk, end_stream=not body)
+            self.transport.write(self.connection.data_to_send())
+
+
+async def start_server(site:MockSofurrySite, host:str, port:int) -> asyncio.Server:
+
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: H2ServerProtocol(site), host, port)
+
+
+async def serve(site:MockSofurrySite, host:str, port:int):
+
+    server = await start_server(site, host, port)
+    listening_port = server.sockets[0].getsockname()[1]
+
+    # the benchmark harness reads this line to find out which port we got
+    print(f"listening on {host}:{listening_port}", flush=True)
+
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="a local HTTP/2 stand-in for sofurry, for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=0, help="the port to listen on, 0 picks a free one")
+    parser.add_argument("--page-size", type=int, default=30, help="how many stories are on each page of a listing")
+    parser.add_argument("--folders-per-user", type=int, default=5, help="how many story folders each user has")
+    parser.add_argument("--folder-fraction", type=float, default=0.2, help="the fraction of each user's stories that are in folders")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="the average time to wait before responding")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of requests that get a 503")
+    parser.add_argument("--seed", type=int, default=1234, help="seed for the latency and errors")
+    parser.add_argument("--rotate-session-every", type=int, default=0,
+        help="give logged in clients a new session cookie every this many requests, 0 never does")
+    args = parser.parse_args()
+
+    site = MockSofurrySite(page_size=args.page_size, folders_per_user=args.folders_per_user,
+        folder_fraction=args.folder_fraction, latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed,
+        rotate_session_every=args.rotate_session_every)
+
+    try:
+        asyncio.run(serve(site, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''
+benchmark of how long the cli takes to start, since it gets run a lot by schedulers
+
+run from the root of the repo:
+
+    python -m benchmarks.startup_time --runs 20
+
+each command line is run `--runs` times in a new process, and it reports the mean and fastest wall clock time.
+`eager imports` is a python process that imports every command module up front, which is what `main.py` used to do
+before any argument got looked at. With `--import-time`, it also shows the modules that took the longest to import
+for each command line, from `python -X importtime`
+'''
+
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = pathlib.Path(__file__).parent.parent
+
+COMMAND_LINES = {
+    "--help": ["cli.py", "--help"],
+    "single_user_scrape --help": ["cli.py", "single_user_scrape", "--help"],
+    "amqp_worker --help": ["cli.py", "amqp_worker", "--help"],
+    "eager imports": ["-c", "import sofurry_scrape.main, sofurry_scrape.commands.single_user_scrape, " +
+        "sofurry_scrape.commands.multi_user_scrape, sofurry_scrape.commands.amqp_producer, " +
+        "sofurry_scrape.commands.amqp_worker, logging_tree"],
+}
+
+
+def time_command_line(argument_list:list[str], runs:int) -> list[float]:
+
+    durations = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *argument_list], cwd=REPO_ROOT, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def get_slowest_imports(argument_list:list[str], count:int) -> list[tuple[int, str]]:
+    '''
+    @return the `count` top level imports with the biggest cumulative import time in microseconds
+    '''
+
+    result = subprocess.run([sys.executable, "-X", "importtime", *argument_list], cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True, text=True)
+
+    imports = list()
+    for iter_line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = iter_line.removeprefix("import time:").split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        module_name = parts[2]
+        # only the top level ones, which are the ones that are not indented
+        if module_name.startswith("  "):
+            continue
+        imports.append((int(parts[1]), module_name.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="benchmark of how long the cli takes to start")
+    parser.add_argument("--runs", type=int, default=10, help="how many times to run each command line")
+    parser.add_argument("--import-time", action="store_true", help="also show the slowest imports of each command line")
+    args = parser.parse_args()
+
+    # so the first timed run doesn't also include writing the .pyc files
+    time_command_line(COMMAND_LINES["eager imports"], 1)
+
+    print(f"{'command line':<30} {'mean':>9} {'fastest':>9}")
+    for iter_name, iter_argument_list in COMMAND_LINES.items():
+        durations = time_command_line(iter_argument_list, args.runs)
+        print(f"{iter_name:<30} {statistics.mean(durations) * 1000:>7.1f}ms {min(durations) * 1000:>7.1f}ms", flush=True)
+
+    if args.import_time:
+        for iter_name, iter_argument_list in COMMAND_LINES.items():
+            print()
+            print(f"slowest imports for `{iter_name}`:")
+            for iter_microseconds, iter_module_name in get_slowest_imports(iter_argument_list, 8):
+                print(f"  {iter_module_name:<50} {iter_microseconds / 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
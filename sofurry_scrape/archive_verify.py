@@ -0,0 +1,318 @@
+import logging
+import hashlib
+import json
+import os
+import pathlib
+
+import attr
+
+from sofurry_scrape import utils
+from sofurry_scrape import warc_reader
+from sofurry_scrape import scrape_state
+from sofurry_scrape import content_types
+
+logger = logging.getLogger(__name__)
+
+VERIFY_REPORT_FILENAME = "sofurry_verify_report.jsonl"
+
+# the parts of a submission that get checked, each one maps to the stage that is redone when it is broken
+PART_INFO_JSON = "info_json"
+PART_THUMBNAIL = "thumbnail"
+PART_HTML = "html"
+PART_CONTENT = "content"
+PART_WARC = "warc"
+
+PART_STAGES = {
+    PART_INFO_JSON: scrape_state.STAGE_METADATA,
+    PART_THUMBNAIL: scrape_state.STAGE_THUMBNAIL,
+    PART_HTML: scrape_state.STAGE_HTML,
+    PART_CONTENT: scrape_state.STAGE_CONTENT,
+    PART_WARC: scrape_state.STAGE_WARC,
+}
+
+# how far from the end of the file the end of an html document or image can be, for trailing whitespace and such
+END_MARKER_SEARCH_BYTES = 4096
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@attr.define
+class SubmissionToVerify:
+    ''' what the workers get for each submission, the state database can't be opened in every worker so this comes from the main process '''
+    submission_dir:pathlib.Path
+    # the rolling warc location from the state database, see `ScrapeStateDatabase.get_warc_location()`
+    warc_location:tuple[str, int, int]|None
+    # whether the state database says the warc was captured, a submission without a warc is only broken if it was
+    warc_expected:bool
+
+
+@attr.define
+class Problem:
+    part:str
+    message:str
+
+
+@attr.define
+class SubmissionResult:
+    submission_id:str
+    # relative to the output root
+    submission_dir:str
+    problems:list[Problem]
+
+
+@attr.define
+class BatchResult:
+    checked_count:int
+    bytes_read:int
+    # only the submissions that have something wrong with them
+    broken:list[SubmissionResult]
+
+
+@attr.define
+class FileSummary:
+    size:int
+    sha256:str
+    head:bytes
+    # the last `END_MARKER_SEARCH_BYTES` of the file
+    tail:bytes
+
+
+def read_file_summary(path:pathlib.Path) -> FileSummary:
+
+    sha256 = hashlib.sha256()
+    size = 0
+    head = None
+    tail = b""
+    with open(path, "rb") as f:
+        for iter_chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(iter_chunk)
+            size += len(iter_chunk)
+            if head is None:
+                head = iter_chunk[:16]
+            tail = (tail + iter_chunk)[-END_MARKER_SEARCH_BYTES:]
+    return FileSummary(size=size, sha256=sha256.hexdigest(), head=head or b"", tail=tail)
+
+
+def is_image_complete(file_summary:FileSummary) -> bool|None:
+    '''
+    whether an image ends the way its format says it should, a download that got cut off won't
+
+    @return None if it isn't a format we know the end of
+    '''
+
+    tail = file_summary.tail.rstrip(b"\x00\r\n")
+    if file_summary.head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return tail.endswith(b"IEND\xaeB`\x82")
+    if file_summary.head.startswith(b"\xff\xd8"):
+        return tail.endswith(b"\xff\xd9")
+    if file_summary.head.startswith(b"GIF8"):
+        return tail.endswith(b";")
+    return None
+
+
+def check_file(path:pathlib.Path, part:str, expected_hash:str|None, problems:list[Problem]) -> FileSummary|None:
+    '''
+    make sure a file is there and has the hash that was recorded for it in `sha256sums.txt`
+
+    @return None if the file is missing or empty
+    '''
+
+    if not path.exists():
+        problems.append(Problem(part, f"`{path.name}` is missing"))
+        return None
+
+    file_summary = read_file_summary(path)
+    if file_summary.size == 0:
+        problems.append(Problem(part, f"`{path.name}` is empty"))
+        return None
+
+    if expected_hash is not None and file_summary.sha256 != expected_hash:
+        problems.append(Problem(part, f"`{path.name}` has sha256 `{file_summary.sha256}`, but `{expected_hash}` was recorded for it"))
+    return file_summary
+
+
+def check_warc(warc_path:pathlib.Path, submission_id:str, offset:int=0, length:int|None=None) -> tuple[int, list[str]]:
+    '''
+    read every record of a warc (or the part of a rolling warc that a submission is in), and make sure it decompresses,
+    no record is cut off, the block digests match, and its warcinfo record is for `submission_id`
+
+    @return a tuple of (how many compressed bytes were read, what is wrong with it)
+    '''
+
+    if not warc_path.exists():
+        return (0, [f"`{warc_path.name}` is missing"])
+
+    file_size = warc_path.stat().st_size
+    if length is not None and offset + length > file_size:
+        return (0, [f"`{warc_path.name}` is `{file_size}` bytes, but the submission is recorded at `{offset}` + `{length}`"])
+
+    messages = list()
+    warcinfo_ids = list()
+    response_count = 0
+    try:
+        for iter_record in warc_reader.iter_warc_records(warc_path, offset, length):
+
+            content_length = int(iter_record.headers["content-length"])
+            if len(iter_record.block) != content_length:
+                messages.append(f"a `{iter_record.headers.get('warc-type')}` record is cut off at `{len(iter_record.block)}` of `{content_length}` bytes")
+                break
+
+            block_digest = iter_record.headers.get("warc-block-digest", "")
+            if block_digest.startswith("sha1:") and warc_reader.get_warc_digest(iter_record.block) != block_digest:
+                messages.append(f"the block of `{iter_record.headers.get('warc-target-uri', iter_record.headers.get('warc-type'))}` doesn't match its digest")
+
+            if iter_record.headers.get("warc-type") == "warcinfo":
+                warcinfo_ids.append(warc_reader.get_warcinfo_fields(iter_record.block).get("sofurry_submission_id"))
+            elif iter_record.headers.get("warc-type") == "response":
+                response_count += 1
+
+    except Exception as e:
+        # gzip and zlib errors if it is cut off or corrupt, and `read_warc_records()` raises a plain `Exception`
+        messages.append(f"`{warc_path.name}` can't be read: `{e}`")
+
+    if not messages:
+        if not any(warcinfo_ids):
+            messages.append("there is no `sofurry_submission_id` in the warcinfo record")
+        elif any(x != submission_id for x in warcinfo_ids if x):
+            messages.append(f"the warcinfo record is for submission `{', '.join(x for x in warcinfo_ids if x)}`, not `{submission_id}`")
+        if response_count == 0:
+            messages.append("there are no response records")
+
+    return (length if length is not None else file_size, messages)
+
+
+def verify_submission(output_path:pathlib.Path, submission:SubmissionToVerify) -> tuple[int, SubmissionResult]:
+    '''
+    check everything in a submission folder
+
+    @return a tuple of (how many bytes were read, the result)
+    '''
+
+    folders = utils.get_submission_folder_collection_from_dir(submission.submission_dir)
+    submission_id = folders.submission_id
+    checksums = utils.read_checksums(folders.checksums)
+    problems = list()
+    bytes_read = 0
+    submission_json = dict()
+
+    file_summary = check_file(folders.info_json, PART_INFO_JSON, checksums.get(folders.info_json.name), problems)
+    if file_summary:
+        bytes_read += file_summary.size
+        try:
+            submission_json = utils.escape_and_parse_json_omg(folders.info_json.read_bytes())
+            if str(submission_json["id"]) != submission_id:
+                problems.append(Problem(PART_INFO_JSON, f"`info.json` is for submission `{submission_json['id']}`"))
+        except (ValueError, KeyError, TypeError) as e:
+            problems.append(Problem(PART_INFO_JSON, f"`info.json` can't be parsed: `{e}`"))
+
+    # journals don't always have a thumbnail
+    if submission_json.get("thumbnail", True):
+        file_summary = check_file(folders.thumbnail, PART_THUMBNAIL, checksums.get(folders.thumbnail.name), problems)
+        if file_summary:
+            bytes_read += file_summary.size
+            if is_image_complete(file_summary) is False:
+                problems.append(Problem(PART_THUMBNAIL, "the thumbnail is cut off"))
+
+    file_summary = check_file(folders.html, PART_HTML, checksums.get(folders.html.name), problems)
+    if file_summary:
+        bytes_read += file_summary.size
+        if b"</html>" not in file_summary.tail.lower():
+            problems.append(Problem(PART_HTML, "the html is cut off, it doesn't end with `</html>`"))
+
+    # the folder it is in says what kind of submission it is, in case `info.json` is what is broken
+    content_type = content_types.CONTENT_TYPES.get(folders.root_dir.parent.name)
+    if content_type is not None and content_type.has_content_file:
+        content_prefix = f"{folders.content_dir.name}/"
+        content_names = [x.removeprefix(content_prefix) for x in checksums if x.startswith(content_prefix)]
+        if not content_names:
+            problems.append(Problem(PART_CONTENT, "no content file was recorded in `sha256sums.txt`"))
+        for iter_name in content_names:
+            file_summary = check_file(folders.content_dir / iter_name, PART_CONTENT, checksums[content_prefix + iter_name], problems)
+            if file_summary:
+                bytes_read += file_summary.size
+
+    if submission.warc_location is not None:
+        warc_path, offset, length = submission.warc_location
+        size, messages = check_warc(output_path / warc_path, submission_id, offset, length)
+    elif folders.warc.exists() or submission.warc_expected:
+        size, messages = check_warc(folders.warc, submission_id)
+    else:
+        size, messages = (0, list())
+    bytes_read += size
+    problems.extend(Problem(PART_WARC, x) for x in messages)
+
+    return (bytes_read, SubmissionResult(submission_id, str(folders.root_dir.relative_to(output_path)), problems))
+
+
+def verify_submissions(output_path:pathlib.Path, submissions:list[SubmissionToVerify]) -> BatchResult:
+    '''
+    check a batch of submission folders, this runs in the worker processes of `verify`
+    '''
+
+    result = BatchResult(checked_count=0, bytes_read=0, broken=list())
+    for iter_submission in submissions:
+
+        try:
+            bytes_read, submission_result = verify_submission(output_path, iter_submission)
+        except OSError as e:
+            bytes_read = 0
+            submission_result = SubmissionResult(utils.get_submission_folder_collection_from_dir(iter_submission.submission_dir).submission_id,
+                str(iter_submission.submission_dir.relative_to(output_path)), [Problem(PART_INFO_JSON, f"couldn't read the folder: `{e}`")])
+
+        result.checked_count += 1
+        result.bytes_read += bytes_read
+        if submission_result.problems:
+            result.broken.append(submission_result)
+
+    return result
+
+
+def write_report(report_path:pathlib.Path, summary:dict, broken:list[SubmissionResult]):
+    '''
+    write the report as json lines, the summary first and then a line for each broken submission, the ones that are
+    fine aren't in it so it stays small no matter how big the archive is
+    '''
+
+    lines = [json.dumps(summary)]
+    lines.extend(json.dumps(attr.asdict(x)) for x in sorted(broken, key=lambda x: x.submission_dir))
+    utils.write_file_atomically(report_path, "".join(f"{x}\n" for x in lines).encode("utf-8"))
+
+
+def requeue_submission(output_path:pathlib.Path, state_database:scrape_state.ScrapeStateDatabase, submission_result:SubmissionResult):
+    '''
+    forget the broken parts of a submission in the state database, so the next scrape of its user downloads only
+    those again, and `amqp_producer` publishes it again
+    '''
+
+    submission_id = submission_result.submission_id
+    folders = utils.get_submission_folder_collection_from_dir(output_path / submission_result.submission_dir)
+    broken_parts = set(x.part for x in submission_result.problems)
+
+    for iter_part in broken_parts:
+        state_database.clear_submission_stage(submission_id, PART_STAGES[iter_part])
+    state_database.clear_submission_stage(submission_id, scrape_state.STAGE_PUBLISHED)
+
+    if PART_WARC in broken_parts:
+        state_database.clear_warc_location(submission_id)
+
+    if PART_THUMBNAIL in broken_parts:
+        # imported here since it pulls in httpx, which checking an archive doesn't need
+        from sofurry_scrape import blob_store
+
+        # the thumbnail is a hardlink to a blob, so if the thumbnail is broken so is the blob, and the blob store
+        # would just link it again since it is named after the hash it should have
+        recorded_hash = utils.read_checksums(folders.checksums).get(folders.thumbnail.name)
+        blob_path = blob_store.BlobStore(output_path / blob_store.BLOB_STORE_DIRNAME, state_database).get_blob_path(recorded_hash) \
+            if recorded_hash else None
+        if blob_path is not None and folders.thumbnail.exists() and blob_path.exists() and os.path.samefile(folders.thumbnail, blob_path):
+            logger.info("submission `%s`: removing the broken blob `%s` its thumbnail is linked to", submission_id, blob_path)
+            blob_path.unlink()
+
+        try:
+            submission_json = utils.escape_and_parse_json_omg(folders.info_json.read_bytes())
+            state_database.clear_url_blob_hash(submission_json["thumbnail"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("submission `%s`: couldn't get the thumbnail url from `info.json`, it might not get downloaded again: `%s`",
+                submission_id, e)
+
+    logger.debug("submission `%s`: requeued `%s`", submission_id, ", ".join(sorted(broken_parts)))
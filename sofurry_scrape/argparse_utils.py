@@ -47,4 +47,66 @@ def isFileType(strict=True):
                 raise argparse.ArgumentTypeError("The path `{}` is not a file!".format(path_resolved))
 
         return path_resolved
-    return _isFileType
\ No newline at end of file
+    return _isFileType
+
+def isPositiveIntType(intString):
+    ''' see if the string given to us by argparse is an integer that is 1 or greater
+    @param intString - the string we get from argparse
+    @return the string as an int, else we raise a ArgumentTypeError'''
+
+    try:
+        result = int(intString)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("Failed to parse `{}` as an integer: `{}`".format(intString, e))
+
+    if result < 1:
+        raise argparse.ArgumentTypeError("The integer `{}` must be 1 or greater!".format(result))
+
+    return result
+
+
+def isNameAndPositiveIntType(nameAndIntString):
+    ''' see if the string given to us by argparse is in the form `name=N` where N is an integer that is 1 or greater
+    @param nameAndIntString - the string we get from argparse
+    @return a tuple of (name, N), else we raise a ArgumentTypeError'''
+
+    name, separator, int_string = nameAndIntString.partition("=")
+    if not separator or not name:
+        raise argparse.ArgumentTypeError("Failed to parse `{}`, it should look like `name=N`".format(nameAndIntString))
+
+    return (name.strip(), isPositiveIntType(int_string))
+
+
+def isPositiveFloatType(floatString):
+    ''' see if the string given to us by argparse is a number greater than 0
+    @param floatString - the string we get from argparse
+    @return the string as a float, else we raise a ArgumentTypeError'''
+
+    try:
+        result = float(floatString)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("Failed to parse `{}` as a number: `{}`".format(floatString, e))
+
+    if not result > 0:
+        raise argparse.ArgumentTypeError("The number `{}` must be greater than 0!".format(result))
+
+    return result
+
+
+def isArrowType(dateString):
+    ''' see if the string given to us by argparse is a date, either iso 8601 or relative to now like `a week ago`
+    @param dateString - the string we get from argparse
+    @return the date as an arrow.Arrow, else we raise a ArgumentTypeError'''
+
+    # imported here so `--help` doesn't have to import arrow
+    import arrow
+
+    try:
+        return arrow.get(dateString)
+    except (arrow.parser.ParserError, ValueError, TypeError):
+        pass
+
+    try:
+        return arrow.utcnow().dehumanize(dateString)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("Failed to parse `{}` as a date: `{}`".format(dateString, e))
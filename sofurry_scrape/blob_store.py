@@ -0,0 +1,141 @@
+import logging
+import asyncio
+import os
+import pathlib
+import shutil
+import stat
+import uuid
+
+import httpx
+
+from sofurry_scrape import utils
+from sofurry_scrape import http_fetch
+from sofurry_scrape import scrape_state
+from sofurry_scrape import output_writer
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE_DIRNAME = "blobs"
+
+
+class BlobStore:
+    '''
+    a content addressed store under the output root, every file is kept once, named after its sha256,
+    and the submission folders get hardlinks to it. If the filesystem can't do hardlinks, they get a copy instead
+
+    the state database remembers which blob each url gave us, so a url we downloaded before doesn't get
+    fetched again, and if a new url turns out to have the same content we already have, the new copy is thrown away
+    '''
+
+    def __init__(self, root_dir:pathlib.Path, state_database:scrape_state.ScrapeStateDatabase,
+        writer:output_writer.OutputWriter|None=None):
+
+        self.root_dir = root_dir
+        self.state_database = state_database
+        # only needed for `fetch_blob()` and `link_blob()`
+        self.writer = writer
+
+        # where downloads go until we know their hash, it is on the same filesystem so they can be renamed into place
+        self.incoming_dir = root_dir / "incoming"
+
+        # url -> task, so when several submissions want the same url at once it is only downloaded once
+        self.in_flight_downloads = dict()
+
+        self.fetches_skipped = 0
+        self.writes_skipped = 0
+
+    def open(self):
+
+        # this isn't cleaned out since other processes might be downloading into it, failed
+        # downloads delete their own files so only a process getting killed leaves anything behind
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_blob_path(self, content_hash:str) -> pathlib.Path:
+        return self.root_dir / "sha256" / content_hash[:2] / content_hash
+
+    def has_blob(self, content_hash:str) -> bool:
+        return self.get_blob_path(content_hash).exists()
+
+    async def fetch_blob(self, http_fetcher:http_fetch.HttpFetcher, httpx_client:httpx.AsyncClient, url:str, endpoint:str,
+        trust_known_urls:bool=True) -> str:
+        '''
+        make sure the content of a url is in the store, downloading it if we haven't seen the url before
+
+        @param trust_known_urls - if False, the url is downloaded again even if we have seen it before
+        @return the hash of the blob
+        '''
+
+        known_hash = self.state_database.get_url_blob_hash(url) if trust_known_urls else None
+        if known_hash and self.has_blob(known_hash):
+            logger.debug("url `%s` is already in the blob store as `%s`, not downloading it", url, known_hash)
+            self.fetches_skipped += 1
+            return known_hash
+
+        if url not in self.in_flight_downloads:
+            task = asyncio.create_task(self._download_blob(http_fetcher, httpx_client, url, endpoint))
+            self.in_flight_downloads[url] = task
+            task.add_done_callback(lambda _: self.in_flight_downloads.pop(url, None))
+        else:
+            self.fetches_skipped += 1
+
+        # shielded so one of the submissions waiting on it being cancelled doesn't cancel it for the others
+        return await asyncio.shield(self.in_flight_downloads[url])
+
+    async def _download_blob(self, http_fetcher:http_fetch.HttpFetcher, httpx_client:httpx.AsyncClient, url:str, endpoint:str) -> str:
+
+        incoming_path = self.incoming_dir / uuid.uuid4().hex
+        content_hash = await http_fetcher.fetch_to_file(httpx_client, url, endpoint, incoming_path, self.writer)
+
+        if not await self.writer.run(self._store_incoming, incoming_path, content_hash, operation="store_blob"):
+            logger.debug("url `%s` has the same content as blob `%s`, not storing it again", url, content_hash)
+            self.writes_skipped += 1
+
+        self.state_database.save_url_blob_hash(url, content_hash)
+        return content_hash
+
+    def _store_incoming(self, incoming_path:pathlib.Path, content_hash:str) -> bool:
+        '''
+        move a download into its place in the store, or throw it away if the store already has it
+
+        @return whether it was stored
+        '''
+
+        blob_path = self.get_blob_path(content_hash)
+        if blob_path.exists():
+            incoming_path.unlink()
+            return False
+
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        # every submission that links to it shares the same file, so make sure nobody edits it by accident
+        incoming_path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(incoming_path, blob_path)
+        return True
+
+    async def link_blob(self, content_hash:str, destination_path:pathlib.Path):
+        '''
+        put the blob at `destination_path`, replacing whatever is there
+        '''
+
+        await self.writer.run(self._link_blob, content_hash, destination_path, operation="link_blob")
+
+    def _link_blob(self, content_hash:str, destination_path:pathlib.Path):
+
+        blob_path = self.get_blob_path(content_hash)
+
+        if destination_path.exists() and os.path.samefile(blob_path, destination_path):
+            return
+
+        partial_path = utils.get_partial_file_path(destination_path)
+        partial_path.unlink(missing_ok=True)
+        try:
+            os.link(blob_path, partial_path)
+        except OSError as e:
+            logger.debug("couldn't hardlink blob `%s` to `%s`, copying it instead: `%s`", content_hash, destination_path, e)
+            shutil.copyfile(blob_path, partial_path)
+
+        os.replace(partial_path, destination_path)
+
+    def log_summary(self):
+
+        logger.info("blob store: `%s` downloads skipped because the url was known, `%s` writes skipped because the content was",
+            self.fetches_skipped, self.writes_skipped)
@@ -0,0 +1,359 @@
+import logging
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+
+import arrow
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DATABASE_FILENAME = "sofurry_catalog.sqlite3"
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    user_dir TEXT NOT NULL,
+    profile_hash TEXT NOT NULL,
+    last_changed_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS users_last_changed_at ON users (last_changed_at);
+
+CREATE TABLE IF NOT EXISTS submissions (
+    submission_id TEXT PRIMARY KEY,
+    author_id TEXT NOT NULL,
+    author TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    content_type TEXT,
+    posted_at TEXT,
+    submission_dir TEXT NOT NULL,
+    info_json_hash TEXT NOT NULL,
+    captured_at TEXT NOT NULL,
+    changed_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS submissions_author_id ON submissions (author_id);
+CREATE INDEX IF NOT EXISTS submissions_captured_at ON submissions (captured_at);
+CREATE INDEX IF NOT EXISTS submissions_changed_at ON submissions (changed_at);
+
+CREATE TABLE IF NOT EXISTS submission_tags (
+    tag TEXT NOT NULL,
+    submission_id TEXT NOT NULL,
+    PRIMARY KEY (tag, submission_id)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS submissions_fts USING fts5(
+    title, description, tags, author, content='submissions', content_rowid='rowid');
+
+CREATE TRIGGER IF NOT EXISTS submissions_fts_insert AFTER INSERT ON submissions BEGIN
+    INSERT INTO submissions_fts (rowid, title, description, tags, author)
+        VALUES (new.rowid, new.title, new.description, new.tags, new.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS submissions_fts_delete AFTER DELETE ON submissions BEGIN
+    INSERT INTO submissions_fts (submissions_fts, rowid, title, description, tags, author)
+        VALUES ('delete', old.rowid, old.title, old.description, old.tags, old.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS submissions_fts_update AFTER UPDATE ON submissions BEGIN
+    INSERT INTO submissions_fts (submissions_fts, rowid, title, description, tags, author)
+        VALUES ('delete', old.rowid, old.title, old.description, old.tags, old.author);
+    INSERT INTO submissions_fts (rowid, title, description, tags, author)
+        VALUES (new.rowid, new.title, new.description, new.tags, new.author);
+END;
+'''
+
+# the columns of the `submissions` table, in the order the rows from `get_submission_row()` have them
+SUBMISSION_COLUMNS = ["submission_id", "author_id", "author", "title", "description", "tags", "content_type",
+    "posted_at", "submission_dir", "info_json_hash", "captured_at", "changed_at"]
+
+USER_COLUMNS = ["uid", "username", "user_dir", "profile_hash", "last_changed_at"]
+
+
+def get_timestamp(when:arrow.Arrow|None=None) -> str:
+    ''' every timestamp in the catalog is in this format, so they sort and compare as strings '''
+    return (when or arrow.utcnow()).to("UTC").datetime.isoformat(timespec="microseconds")
+
+
+def get_unix_timestamp(seconds:float) -> str:
+    ''' the same as `get_timestamp()`, without going through arrow since the rebuild does this a lot '''
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat(timespec="microseconds")
+
+
+def get_file_timestamp(path:pathlib.Path) -> str:
+    ''' the modification time of a file, which is when the scraper wrote it '''
+    return get_unix_timestamp(path.stat().st_mtime)
+
+
+def split_tags(tags:str|None) -> list[str]:
+    ''' the `tags` of a submission's json are comma separated '''
+    return sorted(set(x.strip().lower() for x in (tags or "").split(",") if x.strip()))
+
+
+def get_submission_row(submission_json:dict, submission_dir:str, info_json_hash:str, captured_at:str) -> tuple:
+    '''
+    @param submission_dir - relative to the output root
+    @return the row for the `submissions` table, in the order of `SUBMISSION_COLUMNS`
+    '''
+
+    posted_at = None
+    if str(submission_json.get("date", "")).isdigit():
+        posted_at = get_unix_timestamp(int(submission_json["date"]))
+
+    return (
+        str(submission_json["id"]),
+        str(submission_json["authorID"]),
+        submission_json.get("author", ""),
+        submission_json.get("title", ""),
+        submission_json.get("description") or "",
+        ", ".join(split_tags(submission_json.get("tags"))),
+        submission_json.get("contentType"),
+        posted_at,
+        submission_dir,
+        info_json_hash,
+        captured_at,
+        captured_at)
+
+
+def get_user_row(user_info:dict, user_dir:str, profile_hash:str, last_changed_at:str) -> tuple:
+
+    return (str(user_info["userID"]), user_info["useralias"], user_dir, profile_hash, last_changed_at)
+
+
+def read_submission_dirs(output_path:pathlib.Path, submission_dirs:list[pathlib.Path]) -> list[tuple]:
+    '''
+    read the `info.json` of each submission folder, this runs in the worker processes of the rebuild
+
+    @return the rows for the `submissions` table, folders without a readable `info.json` are left out
+    '''
+
+    rows = list()
+    for iter_submission_dir in submission_dirs:
+
+        info_json_path = iter_submission_dir / "info.json"
+        try:
+            info_json_bytes = info_json_path.read_bytes()
+            submission_json = json.loads(info_json_bytes)
+            rows.append(get_submission_row(submission_json, str(iter_submission_dir.relative_to(output_path)),
+                hashlib.sha256(info_json_bytes).hexdigest(), get_file_timestamp(info_json_path)))
+
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("skipping `%s`, couldn't read it: `%s`", info_json_path, e)
+
+    return rows
+
+
+class CatalogDatabase:
+    '''
+    a sqlite database in the output root with a row for every user and submission that is in it, so finding out
+    what we have doesn't mean going through the whole output folder. The scrapers update it as they write each
+    `profile.json` and `info.json`, and `rebuild_catalog` makes it from an existing output folder
+
+    titles, descriptions, tags and authors are searchable with sqlite's full text search
+    '''
+
+    def __init__(self, database_path:pathlib.Path):
+
+        self.database_path = database_path
+        self.connection = None
+
+    def open(self):
+
+        logger.info("opening catalog database at `%s`", self.database_path)
+        self.connection = sqlite3.connect(self.database_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def update_user(self, user_info:dict, user_dir:str, profile_hash:str):
+        '''
+        @param user_dir - relative to the output root
+        '''
+
+        now = get_timestamp()
+        with self.connection:
+            self.connection.execute(
+                f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES (?, ?, ?, ?, ?) " +
+                "ON CONFLICT (uid) DO UPDATE SET username = excluded.username, user_dir = excluded.user_dir, " +
+                "profile_hash = excluded.profile_hash, " +
+                "last_changed_at = CASE WHEN profile_hash = excluded.profile_hash THEN last_changed_at ELSE excluded.last_changed_at END",
+                get_user_row(user_info, user_dir, profile_hash, now))
+
+    def update_submission(self, submission_json:dict, submission_dir:str, info_json_hash:str):
+        '''
+        add or update a submission after its `info.json` is written. If it changed, the submission and its
+        author are marked as changed now
+
+        @param submission_dir - relative to the output root
+        '''
+
+        now = get_timestamp()
+        row = get_submission_row(submission_json, submission_dir, info_json_hash, now)
+        submission_id, author_id = row[0], row[1]
+
+        with self.connection:
+            previous_hash = self.connection.execute(
+                "SELECT info_json_hash FROM submissions WHERE submission_id = ?", (submission_id,)).fetchone()
+
+            self.connection.execute(
+                f"INSERT INTO submissions ({', '.join(SUBMISSION_COLUMNS)}) VALUES ({', '.join('?' * len(SUBMISSION_COLUMNS))}) " +
+                "ON CONFLICT (submission_id) DO UPDATE SET " +
+                ", ".join(f"{x} = excluded.{x}" for x in SUBMISSION_COLUMNS[1:-1]) + ", " +
+                "changed_at = CASE WHEN info_json_hash = excluded.info_json_hash THEN changed_at ELSE excluded.changed_at END",
+                row)
+
+            self.connection.execute("DELETE FROM submission_tags WHERE submission_id = ?", (submission_id,))
+            self.connection.executemany("INSERT INTO submission_tags (tag, submission_id) VALUES (?, ?)",
+                [(iter_tag, submission_id) for iter_tag in split_tags(submission_json.get("tags"))])
+
+            if previous_hash is None or previous_hash[0] != info_json_hash:
+                self.connection.execute("UPDATE users SET last_changed_at = ? WHERE uid = ?", (now, author_id))
+
+    def start_bulk_load(self):
+        '''
+        for filling a new catalog with `insert_rows()`, the full text index is made all at once in
+        `finish_bulk_load()` instead of a row at a time, which is about twice as fast
+        '''
+
+        with self.connection:
+            self.connection.execute("DROP TRIGGER submissions_fts_insert")
+
+    def finish_bulk_load(self):
+        '''
+        make the full text index and put the trigger back, and set each user's last change to the newest of their
+        profile and their submissions
+        '''
+
+        with self.connection:
+            self.connection.execute("INSERT INTO submissions_fts (submissions_fts) VALUES ('rebuild')")
+            self.connection.execute(
+                "UPDATE users SET last_changed_at = MAX(last_changed_at, " +
+                "COALESCE((SELECT MAX(changed_at) FROM submissions WHERE author_id = users.uid), ''))")
+        self.connection.executescript(_SCHEMA)
+
+    def insert_rows(self, user_rows:list[tuple], submission_rows:list[tuple]):
+        '''
+        add rows made by `get_user_row()` and `get_submission_row()` to a new catalog in one transaction, see
+        `start_bulk_load()`
+        '''
+
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO users ({', '.join(USER_COLUMNS)}) VALUES (?, ?, ?, ?, ?)", user_rows)
+
+            # a submission that is in the output path twice only gets the first one
+            self.connection.executemany(
+                f"INSERT INTO submissions ({', '.join(SUBMISSION_COLUMNS)}) VALUES ({', '.join('?' * len(SUBMISSION_COLUMNS))}) " +
+                "ON CONFLICT (submission_id) DO NOTHING",
+                submission_rows)
+
+            tag_rows = list()
+            for iter_row in submission_rows:
+                tag_rows.extend((iter_tag, iter_row[0]) for iter_tag in split_tags(iter_row[5]))
+            self.connection.executemany("INSERT OR IGNORE INTO submission_tags (tag, submission_id) VALUES (?, ?)", tag_rows)
+
+
+    def get_submission(self, submission_id) -> dict|None:
+
+        row = self.connection.execute("SELECT * FROM submissions WHERE submission_id = ?", (str(submission_id),)).fetchone()
+        return dict(row) if row else None
+
+    def find_submissions(self, author_id:str|None=None, title:str|None=None, tag:str|None=None, text:str|None=None,
+        captured_since:str|None=None, captured_before:str|None=None, limit:int=100) -> list[dict]:
+        '''
+        the submissions that match every one of the filters that are given, newest capture first
+
+        @param title - words that all have to be in the title
+        @param text - words that all have to be in the title, description, tags or author
+        @param captured_since, captured_before - timestamps from `get_timestamp()`
+        '''
+
+        conditions = list()
+        params = list()
+
+        if author_id is not None:
+            conditions.append("submissions.author_id = ?")
+            params.append(str(author_id))
+        if tag is not None:
+            conditions.append("submissions.submission_id IN (SELECT submission_id FROM submission_tags WHERE tag = ?)")
+            params.append(tag.strip().lower())
+        if captured_since is not None:
+            conditions.append("submissions.captured_at >= ?")
+            params.append(captured_since)
+        if captured_before is not None:
+            conditions.append("submissions.captured_at < ?")
+            params.append(captured_before)
+
+        match_terms = list()
+        if title:
+            match_terms.extend(f"title : {get_fts_phrase(x)}" for x in title.split())
+        if text:
+            match_terms.extend(get_fts_phrase(x) for x in text.split())
+        if match_terms:
+            conditions.append("submissions.rowid IN (SELECT rowid FROM submissions_fts WHERE submissions_fts MATCH ?)")
+            params.append(" AND ".join(match_terms))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(
+            f"SELECT * FROM submissions {where} ORDER BY captured_at DESC LIMIT ?", params + [limit]).fetchall()
+        return [dict(x) for x in rows]
+
+    def get_users_changed_since(self, since:str) -> list[dict]:
+
+        rows = self.connection.execute(
+            "SELECT * FROM users WHERE last_changed_at >= ? ORDER BY last_changed_at DESC", (since,)).fetchall()
+        return [dict(x) for x in rows]
+
+    def get_counts(self) -> tuple[int, int]:
+        '''
+        @return a tuple of (user count, submission count)
+        '''
+
+        user_count = self.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        submission_count = self.connection.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+        return (user_count, submission_count)
+
+
+def get_fts_phrase(word:str) -> str:
+    ''' quote a word so the full text search doesn't treat anything in it as syntax '''
+    return '"' + word.replace('"', '""') + '"'
+
+
+def remove_database_files(database_path:pathlib.Path):
+    ''' remove a sqlite database along with its `-wal` and `-shm` files '''
+
+    for iter_suffix in ("", "-wal", "-shm"):
+        pathlib.Path(f"{database_path}{iter_suffix}").unlink(missing_ok=True)
+
+
+def replace_database(source_path:pathlib.Path, destination_path:pathlib.Path):
+    '''
+    move a closed database over another one, getting rid of the other one's `-wal` and `-shm` files first so
+    they don't get applied to the new one
+    '''
+
+    for iter_suffix in ("-wal", "-shm"):
+        pathlib.Path(f"{destination_path}{iter_suffix}").unlink(missing_ok=True)
+    os.replace(source_path, destination_path)
@@ -0,0 +1,206 @@
+import logging
+import hashlib
+import pathlib
+import tempfile
+import asyncio
+
+import aio_pika
+import httpx
+
+from sofurry_scrape.argparse_utils import isFolderType, isFileType
+from sofurry_scrape import utils
+from sofurry_scrape import amqp_utils
+from sofurry_scrape import scrape_state
+from sofurry_scrape import catalog
+from sofurry_scrape import sofurry_session
+from sofurry_scrape import content_types
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+from sofurry_scrape.commands.multi_user_scrape import read_usernames_file
+
+logger = logging.getLogger(__name__)
+
+
+class PublishingUserScrape(SingleUserScrape):
+    '''
+    goes through a user's listings the same way `SingleUserScrape` does, but instead of downloading
+    each submission it publishes it to the work queue for an `amqp_worker` to download
+    '''
+
+    def __init__(self):
+        super().__init__()
+
+        self.exchange = None
+        self.queue_name = None
+        self.user_info = None
+        self.published_count = 0
+
+    async def scrape_user(self, httpx_client:httpx.AsyncClient, user_to_scrape:str, output_path:pathlib.Path,
+        tempdir:pathlib.Path, cookiefile_path:pathlib.Path, stop_event:asyncio.Event):
+
+        # the user info is needed when publishing, so fetch it here instead of in the parent's scrape_user
+        self.user_info = await self.get_user_info(httpx_client, user_to_scrape)
+        folder_collection = await self.output_writer.run(utils.create_necessary_output_directories,
+            output_path, self.user_info["useralias"], self.user_info["userID"])
+        await self.write_profile_json(self.user_info, folder_collection)
+
+        await self.scrape_content_types(httpx_client, self.user_info["userID"], folder_collection, tempdir, cookiefile_path, stop_event)
+
+    def is_submission_archived(self, submission_json:dict) -> bool:
+        '''
+        the producer can't see what the workers downloaded, so for `--incremental` a submission
+        counts as archived once it has been published and hasn't changed since
+        '''
+
+        profile_json_hash = hashlib.sha256(self.get_submission_json_bytes(submission_json)).hexdigest()
+        return self.state_database.get_stage_hash(submission_json["id"], scrape_state.STAGE_PUBLISHED) == profile_json_hash
+
+    async def handle_submission_json(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path):
+
+        submission_id = submission_json["id"]
+
+        if self.incremental and self.is_submission_archived(submission_json):
+            logger.debug("submission `%s`: already published and unchanged, not publishing it again", submission_id)
+            return
+
+        logger.debug("submission `%s`: publishing to queue `%s`", submission_id, self.queue_name)
+        await self.exchange.publish(
+            amqp_utils.create_work_item_message(self.user_info, submission_json),
+            routing_key=self.queue_name)
+
+        self.published_count += 1
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_PUBLISHED,
+            hashlib.sha256(self.get_submission_json_bytes(submission_json)).hexdigest())
+
+
+class AmqpProducer:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("amqp_producer")
+
+        parser.add_argument(
+            "--usernames-to-scrape",
+            required=False,
+            default=list(),
+            nargs="+",
+            dest="usernames_to_scrape",
+            type=str,
+            help="the usernames of the sofurry users whom you want to scrape")
+
+        parser.add_argument(
+            "--usernames-file",
+            required=False,
+            dest="usernames_file",
+            type=isFileType(True),
+            help="a file with the usernames of the sofurry users whom you want to scrape, one per line")
+
+        parser.add_argument(
+            "--output-path",
+            required=True,
+            dest="output_path",
+            type=isFolderType(False),
+            help="the output path, the profile json of each user and the state database that keeps track of " +
+                "what was published go here")
+
+        parser.add_argument(
+            "--credentials-json-file",
+            required=True,
+            dest="credentials_json_file",
+            type=isFileType(True),
+            help="json file that holds the credentials, two keys, 'username' and 'password'")
+
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            dest="incremental",
+            help="only publish submissions that are new or changed since a previous run, and stop going through " +
+                "a listing once a page only has submissions that were already published")
+
+        content_types.add_content_types_argument(parser)
+
+        amqp_utils.add_amqp_arguments(parser)
+        SingleUserScrape.add_http_arguments(parser)
+        sofurry_session.add_session_arguments(parser)
+
+        amqp_producer_obj = AmqpProducer()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=amqp_producer_obj.run)
+
+
+    def __init__(self):
+
+        self.publishing_user_scrape = PublishingUserScrape()
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        output_path:pathlib.Path = parsed_args.output_path
+
+        usernames_to_scrape = list(parsed_args.usernames_to_scrape)
+        if parsed_args.usernames_file:
+            usernames_to_scrape.extend(read_usernames_file(parsed_args.usernames_file))
+        usernames_to_scrape = list(dict.fromkeys(usernames_to_scrape))
+        if not usernames_to_scrape:
+            raise Exception("no usernames to scrape, pass in --usernames-to-scrape and/or --usernames-file")
+
+        # publishing is quick so there is no need for more than one at a time
+        self.publishing_user_scrape.submission_semaphore = asyncio.Semaphore(1)
+        self.publishing_user_scrape.incremental = parsed_args.incremental
+        self.publishing_user_scrape.content_types = content_types.get_content_types(parsed_args.content_types)
+        self.publishing_user_scrape.queue_name = parsed_args.queue_name
+        self.publishing_user_scrape.configure_http_from_parsed_args(parsed_args)
+
+        credential_json = sofurry_session.load_credentials(parsed_args.credentials_json_file)
+
+        logger.info("connecting to amqp broker")
+        amqp_connection = await aio_pika.connect_robust(parsed_args.amqp_url)
+
+        async with amqp_connection:
+
+            # publisher confirms are on by default, so publish() waits for the broker to have the message
+            channel = await amqp_connection.channel()
+            await amqp_utils.declare_queues(channel, parsed_args.queue_name)
+            self.publishing_user_scrape.exchange = channel.default_exchange
+
+            with tempfile.TemporaryDirectory() as tmpdirname:
+
+                async with self.publishing_user_scrape.create_httpx_client() as httpx_client:
+
+                    # there is no wget-at, so no cookie file
+                    session_cookie_manager = sofurry_session.SessionCookieManager(
+                        httpx_client, sofurry_session.get_session_cache_path(parsed_args), None)
+                    await session_cookie_manager.log_in(credential_json)
+
+                    output_path.mkdir(parents=True, exist_ok=True)
+                    self.publishing_user_scrape.output_path = output_path
+                    with scrape_state.ScrapeStateDatabase(output_path / scrape_state.STATE_DATABASE_FILENAME) as state_database, \
+                        catalog.CatalogDatabase(output_path / catalog.CATALOG_DATABASE_FILENAME) as catalog_database, \
+                        self.publishing_user_scrape.output_writer:
+                        self.publishing_user_scrape.state_database = state_database
+                        # the workers add the submissions, this only adds the users
+                        self.publishing_user_scrape.catalog = catalog_database
+
+                        for iter_username in usernames_to_scrape:
+
+                            if stop_event.is_set():
+                                logger.info("stopping early, stop event is set!")
+                                break
+
+                            logger.info("publishing submissions for user `%s`", iter_username)
+                            await self.publishing_user_scrape.scrape_user(
+                                httpx_client, iter_username, output_path, pathlib.Path(tmpdirname), None, stop_event)
+
+                        await self.publishing_user_scrape.retry_failed_submissions(stop_event)
+
+        logger.info("published `%s` submissions to queue `%s`", self.publishing_user_scrape.published_count, parsed_args.queue_name)
@@ -0,0 +1,218 @@
+import logging
+import collections
+import pathlib
+import tempfile
+import asyncio
+
+import aio_pika
+import httpx
+
+from sofurry_scrape.argparse_utils import isPositiveIntType
+from sofurry_scrape import utils
+from sofurry_scrape import amqp_utils
+from sofurry_scrape import sofurry_session
+from sofurry_scrape import rolling_warc
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+
+logger = logging.getLogger(__name__)
+
+# with `--rolling-warcs user`, how many users' rolling warcs are kept open once there is nothing of theirs in progress.
+# The work items of a user usually come one after the other, so keeping a few open means their submissions still end
+# up in the same rolling warc, without a long running worker keeping one open for every user it has ever seen
+MAX_IDLE_USER_ROLLING_WARCS = 16
+
+
+class AmqpWorker:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("amqp_worker")
+
+        parser.add_argument(
+            "--prefetch-count",
+            required=False,
+            default=None,
+            dest="prefetch_count",
+            type=isPositiveIntType,
+            help="how many submissions the broker hands to this worker before it has to acknowledge any of them, " +
+                "defaults to --max-concurrent-submissions")
+
+        parser.add_argument(
+            "--max-attempts",
+            required=False,
+            default=3,
+            dest="max_attempts",
+            type=isPositiveIntType,
+            help="how many times a submission is tried before it is moved to the failed queue, defaults to 3")
+
+        amqp_utils.add_amqp_arguments(parser)
+        # the listings are gone through by `amqp_producer`, so the arguments about them would do nothing here
+        SingleUserScrape.add_scrape_arguments(parser, listing_arguments=False)
+
+        amqp_worker_obj = AmqpWorker()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=amqp_worker_obj.run)
+
+
+    def __init__(self):
+
+        self.single_user_scrape = SingleUserScrape()
+
+        self.in_flight_tasks = set()
+
+        # user folder -> how many of their work items are in progress, for `--rolling-warcs user`
+        self.user_in_flight_counts = collections.Counter()
+        # user folder -> `utils.ProfileFolderCollection` of the users with nothing in progress, least recently used first
+        self.idle_users = collections.OrderedDict()
+
+        # set in run()
+        self.httpx_client = None
+        self.exchange = None
+        self.queue_name = None
+        self.max_attempts = None
+        self.output_path = None
+        self.tempdir = None
+        self.cookiefile_path = None
+        self.stop_event = None
+
+
+    async def handle_work_item(self, message:aio_pika.abc.AbstractIncomingMessage):
+        '''
+        download the submission in a work item, then acknowledge it
+
+        if it fails, a copy with the attempt count bumped up is published to the back of the queue, or to
+        the failed queue if it has been tried too many times, and the original is acknowledged
+        '''
+
+        work_item, attempts = amqp_utils.parse_work_item_message(message)
+        submission_json = work_item["submission"]
+        submission_id = submission_json["id"]
+
+        try:
+            folder_collection = await self.single_user_scrape.output_writer.run(utils.create_necessary_output_directories,
+                self.output_path, work_item["useralias"], work_item["userID"])
+
+            self.user_in_flight_counts[folder_collection.root_dir] += 1
+            self.idle_users.pop(folder_collection.root_dir, None)
+            try:
+                await self.single_user_scrape.handle_submission_json_limited(
+                    submission_json, self.httpx_client, folder_collection, self.tempdir, self.cookiefile_path, self.stop_event)
+            finally:
+                await self.finish_user_work_item(folder_collection)
+
+        except Exception as e:
+
+            attempts += 1
+            if attempts < self.max_attempts:
+                logger.exception("submission `%s`: failed on attempt `%s` of `%s`, putting it back on the queue",
+                    submission_id, attempts, self.max_attempts)
+                routing_key = self.queue_name
+            else:
+                logger.exception("submission `%s`: failed `%s` times, moving it to the failed queue", submission_id, attempts)
+                routing_key = amqp_utils.get_failed_queue_name(self.queue_name)
+
+            await self.exchange.publish(
+                amqp_utils.create_work_item_message(work_item, submission_json, attempts),
+                routing_key=routing_key)
+            await message.ack()
+            return
+
+        if self.stop_event.is_set():
+            # it might not have been downloaded, put it back so it gets picked up by the next worker
+            logger.debug("submission `%s`: stop event is set, returning it to the queue", submission_id)
+            await message.nack(requeue=True)
+            return
+
+        logger.debug("submission `%s`: acknowledging", submission_id)
+        await message.ack()
+
+
+    async def finish_user_work_item(self, folder_collection:utils.ProfileFolderCollection):
+        '''
+        with `--rolling-warcs user`, once a user has nothing in progress their rolling warc can be closed, this closes
+        the ones of the users that have been idle the longest once there are more than `MAX_IDLE_USER_ROLLING_WARCS`.
+        A rolling warc that is still being appended to is never closed
+        '''
+
+        self.user_in_flight_counts[folder_collection.root_dir] -= 1
+        if self.user_in_flight_counts[folder_collection.root_dir] > 0:
+            return
+
+        del self.user_in_flight_counts[folder_collection.root_dir]
+        if self.single_user_scrape.rolling_warcs != rolling_warc.ROLLING_WARCS_PER_USER:
+            return
+
+        self.idle_users[folder_collection.root_dir] = folder_collection
+        while len(self.idle_users) > MAX_IDLE_USER_ROLLING_WARCS:
+            _, idle_folder_collection = self.idle_users.popitem(last=False)
+            logger.debug("closing the rolling warc of `%s`, nothing of theirs is in progress", idle_folder_collection.username)
+            await self.single_user_scrape.close_user_rolling_warc_writer(idle_folder_collection)
+
+
+    async def on_message(self, message:aio_pika.abc.AbstractIncomingMessage):
+
+        # keep track of it so we can wait for it to finish when stopping
+        task = asyncio.current_task()
+        self.in_flight_tasks.add(task)
+        try:
+            await self.handle_work_item(message)
+        finally:
+            self.in_flight_tasks.discard(task)
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        self.output_path = parsed_args.output_path
+        self.queue_name = parsed_args.queue_name
+        self.max_attempts = parsed_args.max_attempts
+        self.stop_event = stop_event
+        self.single_user_scrape.configure_from_parsed_args(parsed_args, listing_arguments=False)
+
+        prefetch_count = parsed_args.prefetch_count or parsed_args.max_concurrent_submissions
+
+        credential_json = sofurry_session.load_credentials(parsed_args.credentials_json_file)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+
+            async with self.single_user_scrape.create_httpx_client() as httpx_client:
+                self.httpx_client = httpx_client
+
+                self.tempdir = pathlib.Path(tmpdirname)
+                self.cookiefile_path = self.tempdir / "cookie.dat"
+                await self.single_user_scrape.log_in(httpx_client, credential_json, self.cookiefile_path)
+
+                with self.single_user_scrape.open_output_path(self.output_path):
+
+                    async with self.single_user_scrape.report_metrics():
+
+                        logger.info("connecting to amqp broker")
+                        amqp_connection = await aio_pika.connect_robust(parsed_args.amqp_url)
+
+                        async with amqp_connection:
+
+                            channel = await amqp_connection.channel()
+
+                            # the broker won't send more than this many unacknowledged messages
+                            await channel.set_qos(prefetch_count=prefetch_count)
+                            self.exchange = channel.default_exchange
+
+                            queue = await amqp_utils.declare_queues(channel, self.queue_name)
+
+                            logger.info("consuming from queue `%s` with a prefetch count of `%s`", self.queue_name, prefetch_count)
+                            consumer_tag = await queue.consume(self.on_message)
+
+                            await stop_event.wait()
+
+                            logger.info("stop event is set, waiting for `%s` submissions to finish", len(self.in_flight_tasks))
+                            await queue.cancel(consumer_tag)
+                            if self.in_flight_tasks:
+                                await asyncio.wait(self.in_flight_tasks)
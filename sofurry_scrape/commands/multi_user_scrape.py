@@ -0,0 +1,157 @@
+import logging
+import pathlib
+import tempfile
+import asyncio
+
+import httpx
+
+from sofurry_scrape.argparse_utils import isFileType, isPositiveIntType
+from sofurry_scrape import sofurry_session
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+
+logger = logging.getLogger(__name__)
+
+
+def read_usernames_file(usernames_file:pathlib.Path) -> list[str]:
+    '''
+    read a file that has one username per line, blank lines and lines starting with `#` are skipped
+    '''
+
+    usernames = list()
+    with open(usernames_file, "r", encoding="utf-8") as f:
+        for iter_line in f:
+            iter_line = iter_line.strip()
+            if iter_line and not iter_line.startswith("#"):
+                usernames.append(iter_line)
+
+    return usernames
+
+
+class MultiUserScrape:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("multi_user_scrape")
+
+        parser.add_argument(
+            "--usernames-to-scrape",
+            required=False,
+            default=list(),
+            nargs="+",
+            dest="usernames_to_scrape",
+            type=str,
+            help="the usernames of the sofurry users whom you want to scrape")
+
+        parser.add_argument(
+            "--usernames-file",
+            required=False,
+            dest="usernames_file",
+            type=isFileType(True),
+            help="a file with the usernames of the sofurry users whom you want to scrape, one per line")
+
+        parser.add_argument(
+            "--max-concurrent-users",
+            required=False,
+            default=1,
+            dest="max_concurrent_users",
+            type=isPositiveIntType,
+            help="how many users to scrape at the same time, defaults to 1. " +
+                "--max-concurrent-submissions and --max-concurrent-wget are shared between all users")
+
+        SingleUserScrape.add_scrape_arguments(parser)
+
+        multi_user_scrape_obj = MultiUserScrape()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=multi_user_scrape_obj.run)
+
+
+    def __init__(self):
+
+        # one of these is shared between every user so they share the
+        # submission and wget-at limits as well as the state database
+        self.single_user_scrape = SingleUserScrape()
+
+        self.failed_usernames = list()
+
+
+    async def scrape_user_limited(self, user_semaphore:asyncio.Semaphore, httpx_client:httpx.AsyncClient,
+        username:str, output_path:pathlib.Path, tempdir:pathlib.Path, cookiefile_path:pathlib.Path,
+        stop_event:asyncio.Event):
+        '''
+        scrape a user once there is room in the user semaphore, a user failing is logged
+        and doesn't stop the other users from being scraped
+        '''
+
+        async with user_semaphore:
+
+            if stop_event.is_set():
+                logger.debug("user `%s`: not starting, stop event is set", username)
+                return
+
+            logger.info("scraping user `%s`", username)
+            try:
+                await self.single_user_scrape.scrape_user(httpx_client, username, output_path, tempdir, cookiefile_path, stop_event)
+                logger.info("user `%s` done", username)
+
+            except Exception as e:
+                logger.exception("scraping user `%s` failed", username)
+                self.failed_usernames.append(username)
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        output_path:pathlib.Path = parsed_args.output_path
+
+        usernames_to_scrape = list(parsed_args.usernames_to_scrape)
+        if parsed_args.usernames_file:
+            usernames_to_scrape.extend(read_usernames_file(parsed_args.usernames_file))
+
+        # skip duplicates but keep the order
+        usernames_to_scrape = list(dict.fromkeys(usernames_to_scrape))
+        if not usernames_to_scrape:
+            raise Exception("no usernames to scrape, pass in --usernames-to-scrape and/or --usernames-file")
+
+        logger.info("going to scrape `%s` users", len(usernames_to_scrape))
+
+        self.single_user_scrape.configure_from_parsed_args(parsed_args)
+
+        credential_json = sofurry_session.load_credentials(parsed_args.credentials_json_file)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+
+            async with self.single_user_scrape.create_httpx_client() as httpx_client:
+
+                # only log in once, every user shares the client and its cookies
+                tempdir = pathlib.Path(tmpdirname)
+                cookiefile_path =  tempdir / "cookie.dat"
+                await self.single_user_scrape.log_in(httpx_client, credential_json, cookiefile_path)
+
+                with self.single_user_scrape.open_output_path(output_path):
+
+                    async with self.single_user_scrape.report_metrics():
+
+                        # with --use-stage-pipeline, the users' work is done by the pipeline's stages, so it has to
+                        # outlive the task group. Each `scrape_user()` waits for its own work, so only
+                        # --max-concurrent-users users are in the pipeline at a time
+                        async with self.single_user_scrape.run_pipeline_if_enabled(stop_event):
+
+                            user_semaphore = asyncio.Semaphore(parsed_args.max_concurrent_users)
+                            async with asyncio.TaskGroup() as task_group:
+                                for iter_username in usernames_to_scrape:
+                                    task_group.create_task(self.scrape_user_limited(
+                                        user_semaphore, httpx_client, iter_username, output_path, tempdir, cookiefile_path, stop_event))
+
+                        await self.single_user_scrape.retry_failed_submissions(stop_event)
+
+        if self.failed_usernames:
+            logger.error("`%s` of `%s` users failed: `%s`", len(self.failed_usernames), len(usernames_to_scrape), self.failed_usernames)
+            raise Exception(f"failed to scrape `{len(self.failed_usernames)}` users")
@@ -0,0 +1,141 @@
+import logging
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+from sofurry_scrape.argparse_utils import isFolderType, isPositiveIntType
+from sofurry_scrape import utils
+from sofurry_scrape import catalog
+
+logger = logging.getLogger(__name__)
+
+# how many submission folders a worker process reads at a time
+DEFAULT_BATCH_SIZE = 500
+
+
+def find_users_and_submission_dirs(output_path:pathlib.Path) -> tuple[list[tuple], list[pathlib.Path]]:
+    '''
+    go through the output root for the user folders (the ones with a `profile.json`) and the submission
+    folders in them, this only lists folders, the `info.json` files are read by the workers
+
+    @return a tuple of (rows for the `users` table, submission folders)
+    '''
+
+    user_rows = list()
+    submission_dirs = list()
+
+    for iter_user_dir in utils.find_user_dirs(output_path):
+
+        profile_json_path = iter_user_dir / "profile.json"
+        try:
+            profile_json_bytes = profile_json_path.read_bytes()
+            user_rows.append(catalog.get_user_row(json.loads(profile_json_bytes), iter_user_dir.name,
+                hashlib.sha256(profile_json_bytes).hexdigest(), catalog.get_file_timestamp(profile_json_path)))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("skipping `%s`, couldn't read it: `%s`", profile_json_path, e)
+            continue
+
+        submission_dirs.extend(utils.find_submission_dirs(iter_user_dir))
+
+    return (user_rows, submission_dirs)
+
+
+class RebuildCatalog:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("rebuild_catalog")
+
+        parser.add_argument(
+            "--output-path",
+            required=True,
+            dest="output_path",
+            type=isFolderType(True),
+            help=f"the output path of a scrape, the `{catalog.CATALOG_DATABASE_FILENAME}` in it is replaced")
+
+        parser.add_argument(
+            "--workers",
+            required=False,
+            default=os.cpu_count(),
+            dest="workers",
+            type=isPositiveIntType,
+            help="how many processes read the `info.json` files, defaults to the number of cpus")
+
+        parser.add_argument(
+            "--batch-size",
+            required=False,
+            default=DEFAULT_BATCH_SIZE,
+            dest="batch_size",
+            type=isPositiveIntType,
+            help=f"how many submission folders each worker reads at a time, defaults to {DEFAULT_BATCH_SIZE}")
+
+        rebuild_catalog_obj = RebuildCatalog()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=rebuild_catalog_obj.run)
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        output_path:pathlib.Path = parsed_args.output_path
+        database_path = output_path / catalog.CATALOG_DATABASE_FILENAME
+
+        # built next to the real one and renamed over it at the end, so it is never half done
+        partial_path = utils.get_partial_file_path(database_path)
+        catalog.remove_database_files(partial_path)
+
+        start_time = time.monotonic()
+        logger.info("finding users and submissions in `%s`", output_path)
+        user_rows, submission_dirs = await asyncio.to_thread(find_users_and_submission_dirs, output_path)
+        logger.info("found `%s` users and `%s` submission folders, reading them with `%s` workers",
+            len(user_rows), len(submission_dirs), parsed_args.workers)
+
+        batches = [submission_dirs[x:x + parsed_args.batch_size] for x in range(0, len(submission_dirs), parsed_args.batch_size)]
+
+        loop = asyncio.get_running_loop()
+        try:
+            with catalog.CatalogDatabase(partial_path) as catalog_database, \
+                concurrent.futures.ProcessPoolExecutor(parsed_args.workers) as executor:
+
+                catalog_database.start_bulk_load()
+                catalog_database.insert_rows(user_rows, list())
+
+                futures = [loop.run_in_executor(executor, catalog.read_submission_dirs, output_path, iter_batch)
+                    for iter_batch in batches]
+
+                read_count = 0
+                for iter_future in asyncio.as_completed(futures):
+
+                    if stop_event.is_set():
+                        for iter_other_future in futures:
+                            iter_other_future.cancel()
+                        raise Exception("stopped before the catalog was rebuilt, the old one was left as it was")
+
+                    submission_rows = await iter_future
+                    catalog_database.insert_rows(list(), submission_rows)
+                    read_count += len(submission_rows)
+                    logger.debug("added `%s` submissions to the catalog so far", read_count)
+
+                logger.info("read every submission folder, making the full text index")
+                catalog_database.finish_bulk_load()
+                user_count, submission_count = catalog_database.get_counts()
+
+        except BaseException:
+            catalog.remove_database_files(partial_path)
+            raise
+
+        catalog.replace_database(partial_path, database_path)
+        logger.info("rebuilt `%s` with `%s` users and `%s` submissions in `%.1f` seconds",
+            database_path, user_count, submission_count, time.monotonic() - start_time)
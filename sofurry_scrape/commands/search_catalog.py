@@ -0,0 +1,139 @@
+import logging
+import asyncio
+import json
+import pathlib
+
+from sofurry_scrape.argparse_utils import isFolderType, isPositiveIntType, isArrowType
+from sofurry_scrape import catalog
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCatalog:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("search_catalog")
+
+        parser.add_argument(
+            "--output-path",
+            required=True,
+            dest="output_path",
+            type=isFolderType(True),
+            help=f"the output path of a scrape, that has a `{catalog.CATALOG_DATABASE_FILENAME}` in it")
+
+        parser.add_argument(
+            "--submission-id",
+            required=False,
+            dest="submission_id",
+            help="just look up this submission, the other filters are ignored")
+
+        parser.add_argument(
+            "--users-changed-since",
+            required=False,
+            dest="users_changed_since",
+            type=isArrowType,
+            help="list the users that got a new or changed submission or profile since this date (an iso 8601 date, " +
+                "or something like `a week ago`) instead of submissions, the other filters are ignored")
+
+        parser.add_argument(
+            "--author-id",
+            required=False,
+            dest="author_id",
+            help="only submissions by this user id")
+
+        parser.add_argument(
+            "--title",
+            required=False,
+            dest="title",
+            help="only submissions with all of these words in the title")
+
+        parser.add_argument(
+            "--tag",
+            required=False,
+            dest="tag",
+            help="only submissions that have this tag")
+
+        parser.add_argument(
+            "--text",
+            required=False,
+            dest="text",
+            help="only submissions with all of these words in the title, description, tags or author")
+
+        parser.add_argument(
+            "--captured-since",
+            required=False,
+            dest="captured_since",
+            type=isArrowType,
+            help="only submissions whose info.json was written on or after this date")
+
+        parser.add_argument(
+            "--captured-before",
+            required=False,
+            dest="captured_before",
+            type=isArrowType,
+            help="only submissions whose info.json was written before this date")
+
+        parser.add_argument(
+            "--limit",
+            required=False,
+            default=100,
+            dest="limit",
+            type=isPositiveIntType,
+            help="the most submissions to list, newest capture first. defaults to 100")
+
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            dest="json",
+            help="print each result as a line of json instead of a summary")
+
+        search_catalog_obj = SearchCatalog()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=search_catalog_obj.run)
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        database_path:pathlib.Path = parsed_args.output_path / catalog.CATALOG_DATABASE_FILENAME
+        if not database_path.exists():
+            raise Exception(f"there is no catalog at `{database_path}`, run `rebuild_catalog` to make one")
+
+        with catalog.CatalogDatabase(database_path) as catalog_database:
+
+            if parsed_args.submission_id is not None:
+                submission = catalog_database.get_submission(parsed_args.submission_id)
+                results = [submission] if submission else list()
+
+            elif parsed_args.users_changed_since is not None:
+                results = catalog_database.get_users_changed_since(catalog.get_timestamp(parsed_args.users_changed_since))
+
+            else:
+                results = catalog_database.find_submissions(
+                    author_id=parsed_args.author_id,
+                    title=parsed_args.title,
+                    tag=parsed_args.tag,
+                    text=parsed_args.text,
+                    captured_since=catalog.get_timestamp(parsed_args.captured_since) if parsed_args.captured_since else None,
+                    captured_before=catalog.get_timestamp(parsed_args.captured_before) if parsed_args.captured_before else None,
+                    limit=parsed_args.limit)
+
+        for iter_result in results:
+            if parsed_args.json:
+                print(json.dumps(iter_result))
+            elif "submission_id" in iter_result:
+                print(f"{iter_result['submission_id']}\t{iter_result['author']}\t{iter_result['title']}\t" +
+                    f"{iter_result['captured_at']}\t{iter_result['submission_dir']}")
+            else:
+                print(f"{iter_result['uid']}\t{iter_result['username']}\t{iter_result['last_changed_at']}\t{iter_result['user_dir']}")
+
+        logger.info("`%s` results", len(results))
@@ -4,20 +4,104 @@ import json
 import pathlib
 import tempfile
 import asyncio
-import re
+import hashlib
+import time
+
+import contextlib
+import functools
+import itertools
 
 import httpx
-from bs4 import BeautifulSoup
+import attr
 
 
 
-from sofurry_scrape.argparse_utils import isFolderType, isFileType
+from sofurry_scrape.argparse_utils import isFolderType, isFileType, isPositiveIntType, isPositiveFloatType, isNameAndPositiveIntType
 from sofurry_scrape import utils
 from sofurry_scrape import wget_utils
+from sofurry_scrape import scrape_state
+from sofurry_scrape import sofurry_session
+from sofurry_scrape import pipeline
+from sofurry_scrape import rate_limit
+from sofurry_scrape import http_fetch
+from sofurry_scrape import blob_store
+from sofurry_scrape import html_extract
+from sofurry_scrape import metrics
+from sofurry_scrape import warc_writer
+from sofurry_scrape import rolling_warc
+from sofurry_scrape import catalog
+from sofurry_scrape import content_types
+from sofurry_scrape import pagination
+from sofurry_scrape import output_writer
 
 logger = logging.getLogger(__name__)
 
-folder_id_regex = re.compile(".*folder=(?P<folderid>[0-9]+)")
+# the stages of the `--use-stage-pipeline` mode, in the order that things flow through them
+PIPELINE_STAGE_FOLDER_DISCOVERY = "folder_discovery"
+PIPELINE_STAGE_PAGE_DISCOVERY = "page_discovery"
+PIPELINE_STAGE_METADATA = "metadata"
+PIPELINE_STAGE_THUMBNAIL = "thumbnail"
+PIPELINE_STAGE_HTML = "html"
+PIPELINE_STAGE_CONTENT = "content"
+PIPELINE_STAGE_WARC = "warc"
+
+# the ways a submission's warc can be captured
+WARC_BACKEND_WGET_AT = "wget-at"
+WARC_BACKEND_NATIVE = "native"
+
+# the warc stage defaults to --max-concurrent-wget
+DEFAULT_PIPELINE_STAGE_CONCURRENCY = {
+    PIPELINE_STAGE_FOLDER_DISCOVERY: 1,
+    PIPELINE_STAGE_PAGE_DISCOVERY: 2,
+    PIPELINE_STAGE_METADATA: 4,
+    PIPELINE_STAGE_THUMBNAIL: 4,
+    PIPELINE_STAGE_HTML: 4,
+    PIPELINE_STAGE_CONTENT: 2}
+
+
+@attr.define
+class UserWorkItem:
+    ''' a user whose folders need to be found, used by the folder discovery stage '''
+    httpx_client:httpx.AsyncClient
+    uid:str
+    folder_collection:utils.ProfileFolderCollection
+    temporary_dir:pathlib.Path
+    cookiefile:pathlib.Path
+    stop_event:asyncio.Event
+    # counts everything in the pipeline that came from this user, so `scrape_user()` can wait for it
+    tracker:pipeline.WorkTracker = attr.Factory(pipeline.WorkTracker)
+
+@attr.define
+class ListingWorkItem:
+    ''' a paginated listing to go through, used by the page discovery stage, and the folder discovery stage for the user's own listings '''
+    content_type:content_types.ContentType
+    url:str
+    params:dict
+    user:UserWorkItem
+
+@attr.define
+class SubmissionWorkItem:
+    ''' a single submission, this is what gets passed to each of the per submission stages '''
+    submission_json:dict
+    submission_folders:utils.SubmissionFolderCollection
+    content_type:content_types.ContentType
+    folder_collection:utils.ProfileFolderCollection
+    httpx_client:httpx.AsyncClient
+    temporary_dir:pathlib.Path
+    cookiefile:pathlib.Path
+    # the `pipeline.WorkTracker`s it is counted by while it goes through the stages of `--use-stage-pipeline`
+    trackers:tuple = ()
+
+@attr.define
+class DeferredSubmission:
+    ''' a submission that failed during the run, it gets tried again once everything else is done '''
+    submission_json:dict
+    httpx_client:httpx.AsyncClient
+    folder_collection:utils.ProfileFolderCollection
+    temporary_dir:pathlib.Path
+    cookiefile:pathlib.Path
+    error:str
+
 
 class SingleUserScrape:
 
@@ -40,6 +124,25 @@ class SingleUserScrape:
             type=str,
             help="the username of the sofurry user whom you want to scrape")
 
+        SingleUserScrape.add_scrape_arguments(parser)
+
+        single_user_scrape_obj = SingleUserScrape()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=single_user_scrape_obj.run)
+
+
+    @staticmethod
+    def add_scrape_arguments(parser, listing_arguments:bool=True):
+        '''
+        add the arguments that control how a user gets scraped, these are shared with the
+        other commands that scrape users
+
+        @param parser - the argparse parser to add the arguments to
+        @param listing_arguments - whether to add the ones about going through a user's listings, `amqp_worker` only
+        downloads the submissions it is handed so it leaves them out
+        '''
+
         parser.add_argument(
             "--output-path",
             required=True,
@@ -62,126 +165,582 @@ class SingleUserScrape:
             type=isFileType(True),
             help="path to the wget-at binary")
 
+        parser.add_argument(
+            "--warc-backend",
+            required=False,
+            default=WARC_BACKEND_WGET_AT,
+            dest="warc_backend",
+            choices=[WARC_BACKEND_WGET_AT, WARC_BACKEND_NATIVE],
+            help=f"how to capture each submission's warc. `{WARC_BACKEND_WGET_AT}` runs the wget-at from --wget-path, " +
+                f"and no warc is captured if it isn't given. `{WARC_BACKEND_NATIVE}` captures it with the same http/2 " +
+                f"connection the rest of the scrape uses, without starting a process. defaults to `{WARC_BACKEND_WGET_AT}`")
 
-        single_user_scrape_obj = SingleUserScrape()
+        parser.add_argument(
+            "--html-from-warc",
+            action="store_true",
+            dest="html_from_warc",
+            help="get each submission page once, for the warc, and write the html file from the warc's response " +
+                "instead of downloading the page again. Needs --wget-path or --warc-backend native")
 
-        # set the function that is called when this command is used
-        parser.set_defaults(func_to_run=single_user_scrape_obj.run)
+        parser.add_argument(
+            "--rolling-warcs",
+            required=False,
+            default=None,
+            dest="rolling_warcs",
+            choices=[rolling_warc.ROLLING_WARCS_PER_USER, rolling_warc.ROLLING_WARCS_PER_RUN],
+            help="append every submission's warc to a few big warcs instead of writing one warc per submission, " +
+                f"either one set in each user's `{rolling_warc.ROLLING_WARC_DIRNAME}` folder (`{rolling_warc.ROLLING_WARCS_PER_USER}`) " +
+                f"or one set in the output path's `{rolling_warc.ROLLING_WARC_DIRNAME}` folder for the whole run " +
+                f"(`{rolling_warc.ROLLING_WARCS_PER_RUN}`). Each one gets a cdxj index next to it")
+
+        parser.add_argument(
+            "--rolling-warc-max-size",
+            required=False,
+            default=rolling_warc.DEFAULT_MAX_SIZE_MB,
+            dest="rolling_warc_max_size",
+            type=isPositiveIntType,
+            help="how many megabytes a rolling warc can get to before a new one is started, a submission is never " +
+                f"split between two of them. defaults to {rolling_warc.DEFAULT_MAX_SIZE_MB}")
+
+        if listing_arguments:
+            content_types.add_content_types_argument(parser)
+
+            parser.add_argument(
+                "--listing-prefetch-pages",
+                required=False,
+                default=pagination.DEFAULT_PREFETCH_PAGES,
+                dest="listing_prefetch_pages",
+                type=isPositiveIntType,
+                help="how many pages of a listing to fetch ahead of the one whose submissions are being downloaded, the " +
+                    f"number of pages is found first so they can all be asked for at once. defaults to {pagination.DEFAULT_PREFETCH_PAGES}")
+
+        parser.add_argument(
+            "--max-concurrent-submissions",
+            required=False,
+            default=1,
+            dest="max_concurrent_submissions",
+            type=isPositiveIntType,
+            help="how many submissions to download at the same time, defaults to 1")
+
+        parser.add_argument(
+            "--max-concurrent-wget",
+            required=False,
+            default=1,
+            dest="max_concurrent_wget",
+            type=isPositiveIntType,
+            help="how many wget-at processes to run at the same time, defaults to 1")
+
+        parser.add_argument(
+            "--wget-timeout",
+            required=False,
+            default=600,
+            dest="wget_timeout",
+            type=isPositiveIntType,
+            help="how many seconds a wget-at process gets before it is killed and retried, defaults to 600")
+
+        parser.add_argument(
+            "--wget-attempts",
+            required=False,
+            default=3,
+            dest="wget_attempts",
+            type=isPositiveIntType,
+            help="how many times to try a wget-at capture that times out, defaults to 3")
+
+        parser.add_argument(
+            "--ignore-previous-progress",
+            action="store_true",
+            dest="ignore_previous_progress",
+            help="download everything again and start every listing from page 1, instead of resuming from " +
+                f"what the `{scrape_state.STATE_DATABASE_FILENAME}` file in the output path says is done")
+
+        if listing_arguments:
+            parser.add_argument(
+                "--incremental",
+                action="store_true",
+                dest="incremental",
+                help="only download submissions that are new or changed since a previous run, and stop going through " +
+                    "a listing once a page only has submissions that are already archived")
+
+            parser.add_argument(
+                "--use-stage-pipeline",
+                action="store_true",
+                dest="use_stage_pipeline",
+                help="run the scrape as a pipeline of stages (folder discovery, page discovery, metadata, thumbnail, html, " +
+                    "content and warc) that each have their own workers and queue, so the cheap stages don't wait behind wget-at")
+
+            parser.add_argument(
+                "--stage-concurrency",
+                required=False,
+                default=list(),
+                action="append",
+                dest="stage_concurrency",
+                type=isNameAndPositiveIntType,
+                metavar="STAGE=N",
+                help="how many workers a stage of --use-stage-pipeline gets, can be given more than once. defaults: " +
+                    ", ".join(f"{k}={v}" for k,v in DEFAULT_PIPELINE_STAGE_CONCURRENCY.items()) +
+                    f", {PIPELINE_STAGE_WARC}=--max-concurrent-wget")
+
+            parser.add_argument(
+                "--stage-mailbox-size",
+                required=False,
+                default=100,
+                dest="stage_mailbox_size",
+                type=isPositiveIntType,
+                help="how many items can be waiting for each stage of --use-stage-pipeline before the stage " +
+                    "feeding it has to wait, defaults to 100")
+
+        parser.add_argument(
+            "--writer-threads",
+            required=False,
+            default=output_writer.DEFAULT_WRITER_THREADS,
+            dest="writer_threads",
+            type=isPositiveIntType,
+            help="how many threads write the output files and create the folders, so a slow disk doesn't hold up the " +
+                f"requests. defaults to {output_writer.DEFAULT_WRITER_THREADS}")
+
+        parser.add_argument(
+            "--fsync",
+            required=False,
+            default=output_writer.FSYNC_ALWAYS,
+            dest="fsync_policy",
+            choices=output_writer.FSYNC_POLICIES,
+            help=f"when to make sure the output files are on disk. `{output_writer.FSYNC_ALWAYS}` syncs each one before it is " +
+                f"renamed into place, `{output_writer.FSYNC_ON_CLOSE}` syncs everything once at the end of the run, and " +
+                f"`{output_writer.FSYNC_NEVER}` leaves it to the operating system. The last two are much quicker on network " +
+                f"storage, but a crash of the whole machine can leave empty files behind. defaults to `{output_writer.FSYNC_ALWAYS}`")
+
+        SingleUserScrape.add_http_arguments(parser)
+
+        parser.add_argument(
+            "--progress-interval",
+            required=False,
+            default=60,
+            dest="progress_interval",
+            type=isPositiveIntType,
+            help="how many seconds between logging the progress and eta of the scrape, and writing to --metrics-file, " +
+                "defaults to 60")
+
+        parser.add_argument(
+            "--metrics-file",
+            required=False,
+            dest="metrics_file",
+            type=pathlib.Path,
+            help="append a json line with every metric (request latencies per endpoint, bytes downloaded, wget-at " +
+                "durations and exit codes, queue depths, retries and completions per stage) to this file every --progress-interval")
+
+        parser.add_argument(
+            "--metrics-port",
+            required=False,
+            dest="metrics_port",
+            type=isPositiveIntType,
+            help="serve the metrics in the prometheus text format on this port on 127.0.0.1")
+
+        sofurry_session.add_session_arguments(parser)
+
+
+    @staticmethod
+    def add_http_arguments(parser):
+        '''
+        add the arguments for the rate limiting and retrying of requests, `amqp_producer` only has these since it
+        doesn't download any submissions
+
+        @param parser - the argparse parser to add the arguments to
+        '''
+
+        parser.add_argument(
+            "--max-requests-per-second",
+            required=False,
+            default=5.0,
+            dest="max_requests_per_second",
+            type=isPositiveFloatType,
+            help="the most requests per second to send to each of www.sofurry.com, api2.sofurry.com and the " +
+                "sofurryfiles cdn, wget-at processes count as a request. The rate starts at half of this, goes up " +
+                "while responses are healthy and is cut in half on 429s, 5xx errors or rising latency. defaults to 5")
+
+        parser.add_argument(
+            "--max-concurrent-requests-per-host",
+            required=False,
+            default=8,
+            dest="max_concurrent_requests_per_host",
+            type=isPositiveIntType,
+            help="the most requests that can be in flight to each of those hosts at once, this adapts " +
+                "the same way --max-requests-per-second does. defaults to 8")
+
+        parser.add_argument(
+            "--disable-rate-limiting",
+            action="store_true",
+            dest="disable_rate_limiting",
+            help="don't limit the requests per host at all")
+
+        parser.add_argument(
+            "--http-attempts",
+            required=False,
+            default=5,
+            dest="http_attempts",
+            type=isPositiveIntType,
+            help="how many times to try a request that fails with a connection error, a timeout, a 429 or a 5xx " +
+                "before giving up on it, defaults to 5")
 
 
     def __init__(self):
 
         self.wget_path = None
+        self.wget_process_pool = None
+        self.native_warc_capture = None
+        self.html_from_warc = False
+        self.content_types = [content_types.STORIES]
+        self.listing_prefetch_pages = pagination.DEFAULT_PREFETCH_PAGES
+        self.rolling_warcs = None
+        self.rolling_warc_max_size = None
+        # directory -> RollingWarcWriter, opened as they are needed and closed with the output path
+        self.rolling_warc_writers = dict()
+        self.output_path = None
+        self.catalog = None
+        self.state_database = None
+        self.ignore_previous_progress = False
+        self.incremental = False
+        self.use_stage_pipeline = False
+        self.stage_concurrency = dict()
+        self.stage_mailbox_size = None
+
+        # created in `run()` since it has to be made while the event loop is running
+        self.submission_semaphore = None
+        self.pipeline = None
+        self.rate_limiter_registry = None
+
+        self.metrics = metrics.MetricsRegistry()
+        self.progress_interval = 60
+        self.metrics_file = None
+        self.metrics_port = None
+        self.session_cache_path = None
+
+        self.http_fetcher = http_fetch.HttpFetcher(metrics_registry=self.metrics)
+        self.blob_store = None
+        # everything written to the output path goes through this, it is opened with the output path
+        self.output_writer = output_writer.OutputWriter(metrics_registry=self.metrics)
+
+        # submission id -> DeferredSubmission
+        self.failed_submissions = dict()
 
 
     async def get_user_info(self, client:httpx.AsyncClient, username:str) -> dict:
 
         logger.debug("making http call for user info for username `%s`", username)
-        resp = await client.get(f"https://api2.sofurry.com/std/getUserProfile?username={username}&format=json")
+        resp = await self.http_fetcher.fetch(client, "https://api2.sofurry.com/std/getUserProfile",
+            http_fetch.ENDPOINT_USER_PROFILE, params={"username": username, "format": "json"})
 
-        resp.raise_for_status()
-
-        unescaped_json:str = resp.text
-        escaped_json_dict:dict = utils.escape_and_parse_json_omg(unescaped_json)
+        escaped_json_dict:dict = utils.escape_and_parse_json_omg(resp.content)
 
         return escaped_json_dict
 
 
-    def write_profile_json(self, user_info:dict, folder_collection:utils.ProfileFolderCollection):
+    async def write_profile_json(self, user_info:dict, folder_collection:utils.ProfileFolderCollection):
 
         logger.debug("writing profile json to `%s`", folder_collection.profile_json)
-        with open(folder_collection.profile_json, "w", encoding="utf-8") as f:
-            json.dump(user_info, f)
+        profile_json_bytes = json.dumps(user_info).encode("utf-8")
+        await self.output_writer.write_file(folder_collection.profile_json, profile_json_bytes)
 
+        self.catalog.update_user(user_info, str(folder_collection.root_dir.relative_to(self.output_path)),
+            hashlib.sha256(profile_json_bytes).hexdigest())
 
-    async def scrape_stories_handle_paginated_api(self, url:str, params:dict,
-        httpx_client:httpx.AsyncClient, uid:str, folder_collection:utils.ProfileFolderCollection,
-        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event):
 
+    async def scrape_listing_handle_paginated_api(self, content_type:content_types.ContentType, url:str, params:dict,
+        httpx_client:httpx.AsyncClient, uid:str, folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event, trackers:tuple=()):
+        '''
+        @param trackers - with `--use-stage-pipeline`, the `pipeline.WorkTracker`s that count the submissions that are queued
+        '''
 
         ## need to cache since pagination is broken
         submission_id_cache = set()
         page_number = 1
 
-        # add the page number
-        params_updated = params.copy()
-        params_updated.update({"stories-page": f"{page_number}"})
+        # see if a previous run got partway through this listing, and if so, start from the page after
+        # the last one it finished. The submission ids it saw are needed so we can still skip the ones that
+        # got pushed onto the next page
+        listing_key = scrape_state.get_listing_key(url, params)
+        checkpoint = self.state_database.get_listing_checkpoint(listing_key)
 
-        # whether we have seen a duplicate page because when we go past the available pages it
-        # just returns the first page again
-        should_stop_while_loop = False
-        while not should_stop_while_loop:
+        # with `--incremental`, going through the listing can only stop at the first page where everything is archived
+        # if a previous run went all the way through it. Otherwise the pages past where that run stopped were never
+        # looked at, and the submissions on them would never get downloaded
+        can_stop_early = False
 
-            if stop_event.is_set():
-                logger.info("stopping scrape stories early, stop event is set!")
-                return
+        if checkpoint is None or self.ignore_previous_progress:
+            self.state_database.reset_listing(listing_key)
+        else:
+            next_page, is_complete = checkpoint
+            if is_complete:
+                # every submission gets checked again in case something new got posted,
+                # the ones that are already downloaded get skipped. Incremental scrapes start from page 1 too
+                # since that is where the new submissions are
+                logger.info("listing `%s` was finished in a previous run, starting from page 1", listing_key)
+                self.state_database.reset_listing(listing_key)
+                can_stop_early = self.incremental
+            else:
+                # even with `--incremental`, the rest of the listing has to be gone through before it can stop early
+                logger.info("listing `%s` was interrupted in a previous run, resuming at page `%s`", listing_key, next_page)
+                page_number = next_page
+                submission_id_cache = self.state_database.get_listing_submission_ids(listing_key)
+
+        async def _fetch_page(iter_page_number:int) -> list[dict]:
+            return (await self.fetch_listing_page(content_type, url, params, iter_page_number, httpx_client))["items"]
+
+        listing_progress = scrape_state.ListingProgress(self.state_database, listing_key)
+
+        # page 1 is needed even when resuming, to know how many pages there are
+        first_page = await _fetch_page(1)
+
+        if len(first_page) == 0:
+            logger.info("empty item collection, maybe empty folder?")
+            self.state_database.mark_listing_complete(listing_key)
+            return
+
+        # the listings are newest first, so once we get to a page where everything was
+        # archived by a previous run, the rest of the pages will be too. This is checked before finding the
+        # page count, since usually page 1 is as far as an incremental scrape gets
+        if can_stop_early and all(self.is_submission_archived(iter_item) for iter_item in first_page):
+            logger.info("incremental: every submission on page `1` is already archived, stopping")
+            self.state_database.mark_listing_complete(listing_key)
+            return
+
+        # the listing json doesn't say how many pages there are
+        fetched_pages = {1: first_page}
+        page_count = None
+        prefetch_pages = self.listing_prefetch_pages
+
+        if can_stop_early:
+            # an incremental scrape usually stops after a page or two, so finding the page count and prefetching would
+            # cost more requests than going through the pages one at a time. We know we went past the last one when
+            # a page is page 1 again
+            prefetch_pages = 0
+            page_numbers = itertools.count(page_number)
+        else:
+            page_count, probed_pages = await pagination.probe_page_count(_fetch_page, first_page, lambda x: x["id"])
+            fetched_pages.update(probed_pages)
+            logger.info("`%s`: listing `%s` has `%s` pages", content_type.name, listing_key, page_count)
+            page_numbers = range(page_number, page_count + 1)
 
-            logger.info("on page `%s`", page_number)
+        first_page_ids = set(iter_item["id"] for iter_item in first_page)
 
-            page_result_response=None
-            for i in range(5):
-                try:
-                    page_result_response = await httpx_client.get(url, params=params_updated)
+        # without the pipeline, the submissions of every page go in one task group, so the next pages get read and their
+        # submissions wait for the semaphore while the ones before them download, instead of each page waiting for its
+        # slowest submission. The task group waits for all of them before going on
+        async with asyncio.TaskGroup() as task_group, \
+            contextlib.aclosing(pagination.iter_pages(_fetch_page, page_numbers, prefetch_pages, fetched_pages)) as pages:
+
+            async for iter_page_number, item_collection in pages:
+
+                if stop_event.is_set():
+                    logger.info("stopping scrape of `%s` early, stop event is set!", content_type.name)
+                    return
+
+                logger.info("`%s`: on page `%s` of `%s`", content_type.name, iter_page_number, page_count or "unknown")
+
+                if len(item_collection) == 0:
+                    # submissions were taken down since we found the page count
+                    logger.info("empty item collection on page `%s`, the listing got shorter", iter_page_number)
+                    break
+
+                if page_count is None and iter_page_number > 1 and all(iter_item["id"] in first_page_ids for iter_item in item_collection):
+                    logger.info("page `%s` is page `1` again, went past the last page", iter_page_number)
                     break
-                except httpx.HttpError as e:
-                    logger.exception("caught error, retrying")
-            logger.debug("result from story api page `%s` was `%s`", page_number, page_result_response)
-            page_result_response.raise_for_status()
 
-            story_json_sanitized = utils.escape_and_parse_json_omg(page_result_response.text)
+                if can_stop_early and all(self.is_submission_archived(iter_item) for iter_item in item_collection):
+                    logger.info("incremental: every submission on page `%s` is already archived, stopping", iter_page_number)
+                    break
+
+                # figure out which submissions on this page are new, the submission ids are added to the cache
+                # before the downloads are started. Anything new posted while we go through the listing pushes
+                # the rest down a page, so some of them can show up twice
+                submissions_to_download = list()
+                for iter_item in item_collection:
+
+                    iter_submission_id = iter_item["id"]
 
-            item_collection = story_json_sanitized["items"]
+                    logger.debug("page id: `%s`, submission id: `%s`", iter_page_number, iter_submission_id)
+                    if iter_submission_id in submission_id_cache:
+                        logger.debug("skipping submission `%s`, it was on an earlier page", iter_submission_id)
+                        continue
 
+                    submission_id_cache.add(iter_submission_id)
+                    submissions_to_download.append(iter_item)
 
-            if len(item_collection) == 0:
-                logger.info("empty item collection, maybe empty folder?")
-                should_stop_while_loop = True
-                break
+                self.metrics.increment(metrics.LISTING_PAGES)
+                self.metrics.increment(metrics.SUBMISSIONS_DISCOVERED, len(submissions_to_download))
+                for iter_stage_name in self.get_submission_stage_names(content_type):
+                    self.metrics.increment(metrics.SUBMISSION_STAGE_EXPECTED, len(submissions_to_download), stage=iter_stage_name)
 
+                # the page is only saved once every submission on it is done. With the pipeline that is after
+                # they went through their last stage, which can be long after they got queued here. It is held
+                # until they are all queued, and never saved if any of them got skipped because we were told to
+                # stop, or failed and got deferred, since a run that is stopped before the retry would never get them
+                listing_progress.add_page(iter_page_number, [iter_item["id"] for iter_item in submissions_to_download])
+                page_tracker = pipeline.WorkTracker(on_done=functools.partial(self._finish_listing_page, listing_progress, iter_page_number))
+                page_tracker.add()
+
+                await self.dispatch_page_submissions(submissions_to_download, httpx_client, folder_collection,
+                    temporary_dir, cookiefile, stop_event, task_group, trackers + (page_tracker,))
 
-            for iter_item in item_collection:
                 if stop_event.is_set():
-                    logger.info("stopping scrape stories early, stop event is set!")
-                    should_stop_while_loop = True
+                    logger.info("stopping scrape of `%s` early, stop event is set!", content_type.name)
                     return
 
-                iter_submission_id = iter_item["id"]
+                page_tracker.finish()
+
+        listing_progress.finish()
+
+
+    def _finish_listing_page(self, listing_progress:scrape_state.ListingProgress, page_number:int, page_tracker:pipeline.WorkTracker):
+
+        if page_tracker.skipped_count:
+            logger.info("listing `%s`: `%s` submissions on page `%s` were skipped or deferred, not saving it",
+                listing_progress.listing_key, page_tracker.skipped_count, page_number)
+            return
+        listing_progress.finish_page(page_number)
+
+
+    async def fetch_listing_page(self, content_type:content_types.ContentType, url:str, params:dict, page_number:int,
+        httpx_client:httpx.AsyncClient) -> dict:
+        '''
+        get one page of a json listing
+
+        @param params - the params without the page number
+        '''
+
+        params_updated = params.copy()
+        params_updated.update({content_type.page_param: f"{page_number}"})
+
+        page_result_response = await self.http_fetcher.fetch(httpx_client, url, http_fetch.ENDPOINT_LISTING, params=params_updated)
+        logger.debug("result from `%s` api page `%s` was `%s`", content_type.name, page_number, page_result_response)
+
+        return utils.escape_and_parse_json_omg(page_result_response.content)
 
-                logger.debug("page id: `%s`, submission id: `%s`", page_number, iter_submission_id)
-                if iter_submission_id in submission_id_cache:
-                    # break out of loop, we already have this page
-                    # this will get called for every item in the page but whatever its fine,quick and dirty
-                    logger.info("breaking out of loop, looks like we processed this page already")
-                    should_stop_while_loop = True
-                    # break out of for loop, and should_stop_while_loop should break out of the while loop
-                    break
 
-                # keep going
+    async def dispatch_page_submissions(self, submissions:list[dict], httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event, task_group:asyncio.TaskGroup,
+        trackers:tuple=()):
+        '''
+        start downloading the submissions from a page of a listing
+
+        @param task_group - the listing's task group the submissions are started in when there is no pipeline,
+        the semaphore limits how many of them run at once across every page and folder
+        '''
+
+        if self.pipeline:
+            for iter_item in submissions:
+                work_item = self.create_submission_work_item(iter_item, httpx_client, folder_collection, temporary_dir, cookiefile)
+                work_item.trackers = trackers
+                await self.pipeline.put(PIPELINE_STAGE_METADATA, work_item, work_item.trackers)
+            return
 
-                logger.info("processing story submission `%s` - `%s`", iter_submission_id, iter_item["title"])
-                await self.handle_story_iter_submission_json(iter_item, httpx_client, folder_collection, temporary_dir, cookiefile)
-                submission_id_cache.add(iter_submission_id)
+        async def _handle_and_finish(submission_json:dict):
 
+            is_done = False
+            try:
+                is_done = await self.handle_submission_json_or_defer(
+                    submission_json, httpx_client, folder_collection, temporary_dir, cookiefile, stop_event)
+            finally:
+                for iter_tracker in trackers:
+                    iter_tracker.finish(skipped=not is_done)
 
-            # increment page number
-            page_number += 1
+        for iter_item in submissions:
+            for iter_tracker in trackers:
+                iter_tracker.add()
+            task_group.create_task(_handle_and_finish(iter_item))
 
 
-    async def scrape_stories(self, httpx_client:httpx.AsyncClient, uid:str, folder_collection:utils.ProfileFolderCollection,
+    async def discover_folder_ids(self, httpx_client:httpx.AsyncClient, uid:str, content_type:content_types.ContentType) -> list[str]:
+        '''
+        find the ids of the folders a user has for a kind of submission
+        '''
+
+        async def _fetch_page(iter_page_number:int) -> list[str]:
+
+            params_html = {"by": f"{uid}", content_type.page_param: f"{iter_page_number}"}
+            html_response = await self.http_fetcher.fetch(httpx_client, content_type.listing_url, http_fetch.ENDPOINT_FOLDER_HTML, params=params_html)
+            logger.debug("html response for page `%s`: `%s`", iter_page_number, html_response)
+
+            # big profiles have big pages, so don't block the event loop while going through them
+            return await asyncio.to_thread(html_extract.extract_folder_ids, html_response.content)
+
+        # we download the html and scrape it because there is no json api for us. The folder list can have
+        # more than one page, and like the json api, going past the last page gives us the first page again,
+        # so the pages after the last one with folders we haven't seen yet are found the same way
+        first_page = await _fetch_page(1)
+        if not first_page:
+            return list()
+
+        if self.incremental:
+            # most users have a page or two of folders, so like a listing that can stop early, going through them
+            # one at a time until a page is page 1 again costs fewer requests than finding the page count first
+            page_numbers = itertools.count(1)
+            prefetch_pages = 0
+            fetched_pages = {1: first_page}
+        else:
+            page_count, fetched_pages = await pagination.probe_page_count(_fetch_page, first_page)
+            fetched_pages[1] = first_page
+            page_numbers = range(1, page_count + 1)
+            prefetch_pages = self.listing_prefetch_pages
+
+        first_page_ids = set(first_page)
+        folders_to_download = dict()
+        async with contextlib.aclosing(pagination.iter_pages(_fetch_page, page_numbers, prefetch_pages, fetched_pages)) as pages:
+
+            async for iter_page_number, iter_page_folder_ids in pages:
+
+                if iter_page_number > 1 and all(x in first_page_ids for x in iter_page_folder_ids):
+                    logger.debug("`%s` folder page `%s` is page `1` again, went past the last page", content_type.name, iter_page_number)
+                    break
+
+                for iter_folder_id in iter_page_folder_ids:
+                    if iter_folder_id not in folders_to_download:
+                        logger.info("found `%s` folder id: `%s`", content_type.name, iter_folder_id)
+                        folders_to_download[iter_folder_id] = None
+
+        return list(folders_to_download.keys())
+
+
+    async def scrape_content_types(self, httpx_client:httpx.AsyncClient, uid:str, folder_collection:utils.ProfileFolderCollection,
         temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event):
+        '''
+        go through every kind of submission in `--content-types` at the same time, they share the client and the
+        submission semaphore, so a user with a lot of one kind doesn't hold up the others
+        '''
 
-        story_api_url_template = "https://www.sofurry.com/browse/user/stories"
+        if self.pipeline:
+            # the stages take it from here. Waiting for everything this user put into the pipeline to be done keeps
+            # `--max-concurrent-users` working, and means the user is really done once `scrape_user()` returns
+            user_work_item = UserWorkItem(httpx_client, uid, folder_collection, temporary_dir, cookiefile, stop_event)
+            for iter_content_type in self.content_types:
+                params_json = {"by": f"{uid}", "format": "json"}
+                listing_work_item = ListingWorkItem(iter_content_type, iter_content_type.listing_url, params_json, user_work_item)
+                await self.pipeline.put(PIPELINE_STAGE_PAGE_DISCOVERY, listing_work_item, (user_work_item.tracker,))
+                await self.pipeline.put(PIPELINE_STAGE_FOLDER_DISCOVERY, listing_work_item, (user_work_item.tracker,))
 
+            await user_work_item.tracker.wait()
+            return
 
-        #params_html = {"by": f"{uid}", "stories-page": f"{page_number}"}
+        async with asyncio.TaskGroup() as task_group:
+            for iter_content_type in self.content_types:
+                task_group.create_task(self.scrape_content_type(
+                    iter_content_type, httpx_client, uid, folder_collection, temporary_dir, cookiefile, stop_event))
 
 
-        # get regular submissions
+    async def scrape_content_type(self, content_type:content_types.ContentType, httpx_client:httpx.AsyncClient, uid:str,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event):
+
 
         # pass in the params without the page number which will be added in
         params_json = {"by": f"{uid}", "format": "json"}
-        await self.scrape_stories_handle_paginated_api(
-            url=story_api_url_template,
+
+        # get regular submissions
+
+        await self.scrape_listing_handle_paginated_api(
+            content_type=content_type,
+            url=content_type.listing_url,
             params=params_json,
             httpx_client=httpx_client,
             uid=uid,
@@ -190,45 +749,20 @@ class SingleUserScrape:
             cookiefile=cookiefile,
             stop_event=stop_event)
 
-        logger.info("stories without a folder done")
-
+        logger.info("`%s` without a folder done", content_type.name)
 
-        folders_api_uri_template = "https://www.sofurry.com/browse/folder/stories"
         # now get the folders
-        # we download the html and scrape using bs4 because there is no json api for us
-        params_html = {"by": f"{uid}"}
-        html_response=None
-        for i in range(5):
-            try:
-                html_response = await httpx_client.get(story_api_url_template, params=params_html, timeout=10.0)
-                break
-            except httpx.HTTPError as e:
-                logger.exception("caught exception, trying again")
-                await asyncio.sleep(5)
-        logger.debug("html response: `%s`", html_response)
-        html_response.raise_for_status()
-
-        soup = BeautifulSoup(html_response.read())
-        folder_img_results = soup.select("img.sfFolderItem")
-        folders_to_download = list()
-        for iter_folder_img_tag in folder_img_results:
-
-            parent_a_tag = iter_folder_img_tag.parent
-            href = parent_a_tag["href"]
-
-            logger.info("searching the href tag `%s` with the regex `%s`", href, folder_id_regex)
-            iter_folderid = folder_id_regex.search(href).groupdict()["folderid"]
-            logger.info("found folder id: `%s`", iter_folderid)
-            folders_to_download.append(iter_folderid)
-
-        # for each folder, download the stories in them
+        folders_to_download = await self.discover_folder_ids(httpx_client, uid, content_type)
+
+        # for each folder, download the submissions in them
         for iter_folder_id in folders_to_download:
-            logger.info("downloading folder with id `%s`", iter_folder_id)
+            logger.info("downloading `%s` folder with id `%s`", content_type.name, iter_folder_id)
 
             params_folder = params_json.copy()
             params_folder["folder"] = iter_folder_id
-            await self.scrape_stories_handle_paginated_api(
-                url=folders_api_uri_template,
+            await self.scrape_listing_handle_paginated_api(
+                content_type=content_type,
+                url=content_type.folder_listing_url,
                 params=params_folder,
                 httpx_client=httpx_client,
                 uid=uid,
@@ -238,167 +772,776 @@ class SingleUserScrape:
                 stop_event=stop_event)
 
 
+    def create_pipeline(self, stop_event:asyncio.Event) -> pipeline.Pipeline:
+        '''
+        create the pipeline for `--use-stage-pipeline`, the submission stages after metadata all run
+        independently of each other
+        '''
+
+        async def _folder_discovery_stage(listing_work_item:ListingWorkItem):
+
+            content_type = listing_work_item.content_type
+            user_work_item = listing_work_item.user
+            for iter_folder_id in await self.discover_folder_ids(user_work_item.httpx_client, user_work_item.uid, content_type):
+                logger.info("queueing `%s` folder with id `%s`", content_type.name, iter_folder_id)
+                params_folder = {"by": f"{user_work_item.uid}", "format": "json", "folder": iter_folder_id}
+                await self.pipeline.put(PIPELINE_STAGE_PAGE_DISCOVERY,
+                    ListingWorkItem(content_type, content_type.folder_listing_url, params_folder, user_work_item),
+                    (user_work_item.tracker,))
+
+        async def _page_discovery_stage(listing_work_item:ListingWorkItem):
+
+            user_work_item = listing_work_item.user
+            await self.scrape_listing_handle_paginated_api(
+                content_type=listing_work_item.content_type,
+                url=listing_work_item.url,
+                params=listing_work_item.params,
+                httpx_client=user_work_item.httpx_client,
+                uid=user_work_item.uid,
+                folder_collection=user_work_item.folder_collection,
+                temporary_dir=user_work_item.temporary_dir,
+                cookiefile=user_work_item.cookiefile,
+                stop_event=user_work_item.stop_event,
+                trackers=(user_work_item.tracker,))
+
+        async def _metadata_stage(work_item:SubmissionWorkItem):
+
+            await self.run_submission_stage(scrape_state.STAGE_METADATA, self.write_submission_metadata, work_item)
+
+            await self.pipeline.put(PIPELINE_STAGE_THUMBNAIL, work_item, work_item.trackers)
+            if work_item.content_type.has_content_file:
+                await self.pipeline.put(PIPELINE_STAGE_CONTENT, work_item, work_item.trackers)
+            if self.html_from_warc:
+                # the html stage gets it once the warc is done, see `_warc_stage()`
+                await self.pipeline.put(PIPELINE_STAGE_WARC, work_item, work_item.trackers)
+                return
+
+            await self.pipeline.put(PIPELINE_STAGE_HTML, work_item, work_item.trackers)
+            if self.is_warc_enabled():
+                await self.pipeline.put(PIPELINE_STAGE_WARC, work_item, work_item.trackers)
+
+        async def _warc_stage(work_item:SubmissionWorkItem):
+
+            await self.run_submission_stage(scrape_state.STAGE_WARC, self.capture_submission_warc, work_item)
+
+            if self.html_from_warc:
+                await self.pipeline.put(PIPELINE_STAGE_HTML, work_item, work_item.trackers)
+
+        stage_handlers = [
+            (PIPELINE_STAGE_FOLDER_DISCOVERY, _folder_discovery_stage),
+            (PIPELINE_STAGE_PAGE_DISCOVERY, _page_discovery_stage),
+            (PIPELINE_STAGE_METADATA, _metadata_stage),
+            (PIPELINE_STAGE_THUMBNAIL, lambda x: self.run_submission_stage(scrape_state.STAGE_THUMBNAIL, self.download_submission_thumbnail, x)),
+            (PIPELINE_STAGE_HTML, lambda x: self.run_submission_stage(scrape_state.STAGE_HTML, self.download_submission_html, x)),
+            (PIPELINE_STAGE_CONTENT, lambda x: self.run_submission_stage(scrape_state.STAGE_CONTENT, self.download_submission_content, x)),
+            (PIPELINE_STAGE_WARC, _warc_stage)]
+
+        # a submission failing in one of these gets tried again at the end of the run
+        def _defer_work_item(work_item:SubmissionWorkItem, e:Exception):
+            self.defer_failed_submission(work_item.submission_json, work_item.httpx_client,
+                work_item.folder_collection, work_item.temporary_dir, work_item.cookiefile, e)
+
+        submission_stages = [PIPELINE_STAGE_METADATA, PIPELINE_STAGE_THUMBNAIL, PIPELINE_STAGE_HTML, PIPELINE_STAGE_CONTENT, PIPELINE_STAGE_WARC]
+
+        self.pipeline = pipeline.Pipeline(stop_event)
+        for iter_stage_name, iter_handler in stage_handlers:
+            stage = self.pipeline.add_stage(iter_stage_name, iter_handler,
+                self.stage_concurrency[iter_stage_name], self.stage_mailbox_size,
+                on_failure=_defer_work_item if iter_stage_name in submission_stages else None)
+            self.metrics.set_gauge_function(metrics.PIPELINE_QUEUE_DEPTH, stage.mailbox.qsize, stage=iter_stage_name)
+
+        return self.pipeline
+
+
+    @contextlib.asynccontextmanager
+    async def run_pipeline_if_enabled(self, stop_event:asyncio.Event):
+        '''
+        with `--use-stage-pipeline`, runs the pipeline for the duration of the `async with` block and waits for
+        everything put into it to finish at the end, otherwise this does nothing
+        '''
+
+        if not self.use_stage_pipeline:
+            yield
+            return
+
+        async with self.create_pipeline(stop_event):
+            yield
+
+        failed_count = self.pipeline.get_failed_count()
+        self.pipeline = None
+        if failed_count:
+            raise Exception(f"`{failed_count}` items failed in the pipeline, see the log for details")
+
+
+    async def handle_submission_json_limited(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event) -> bool:
+        '''
+        calls `handle_submission_json` once there is room in the submission semaphore
+
+        the stop event is checked after getting the semaphore so submissions that are still waiting
+        don't get started once we have been told to stop
+
+        @return False if it wasn't started because we were told to stop
+        '''
+
+        self.metrics.add_to_gauge(metrics.SUBMISSIONS_WAITING, 1)
+        try:
+            await self.submission_semaphore.acquire()
+        finally:
+            self.metrics.add_to_gauge(metrics.SUBMISSIONS_WAITING, -1)
+
+        try:
+            if stop_event.is_set():
+                logger.debug("submission `%s`: not starting, stop event is set", submission_json["id"])
+                return False
+
+            logger.info("processing `%s` submission `%s` - `%s`", content_types.get_content_type_of_submission(submission_json).name,
+                submission_json["id"], submission_json["title"])
+            self.metrics.add_to_gauge(metrics.SUBMISSIONS_IN_PROGRESS, 1)
+            try:
+                await self.handle_submission_json(submission_json, httpx_client, folder_collection, temporary_dir, cookiefile)
+            finally:
+                self.metrics.add_to_gauge(metrics.SUBMISSIONS_IN_PROGRESS, -1)
+            return True
+
+        finally:
+            self.submission_semaphore.release()
+
+
+    async def handle_submission_json_or_defer(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, stop_event:asyncio.Event) -> bool:
+        '''
+        calls `handle_submission_json_limited`, but if the submission fails it is put aside to be
+        tried again at the end of the run instead of stopping the whole scrape
+
+        @return whether the submission is done, False if it was deferred or never started
+        '''
+
+        try:
+            return await self.handle_submission_json_limited(
+                submission_json, httpx_client, folder_collection, temporary_dir, cookiefile, stop_event)
+        except Exception as e:
+            logger.warning("submission `%s`: failed, will try it again at the end of the run: `%s`", submission_json["id"], e)
+            self.defer_failed_submission(submission_json, httpx_client, folder_collection, temporary_dir, cookiefile, e)
+            return False
+
 
-    async def handle_story_iter_submission_json(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+    def defer_failed_submission(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path, e:Exception):
+
+        self.failed_submissions[submission_json["id"]] = DeferredSubmission(
+            submission_json, httpx_client, folder_collection, temporary_dir, cookiefile, str(e))
+
+
+    async def retry_failed_submissions(self, stop_event:asyncio.Event):
+        '''
+        try the submissions that failed during the run one more time, the stages that did finish get skipped.
+        raises if any of them still fail, after logging which ones
+        '''
+
+        if self.failed_submissions and not stop_event.is_set():
+
+            logger.info("trying the `%s` submissions that failed during the run again", len(self.failed_submissions))
+            deferred_submissions = list(self.failed_submissions.values())
+            self.failed_submissions.clear()
+
+            async with asyncio.TaskGroup() as task_group:
+                for iter_deferred in deferred_submissions:
+                    task_group.create_task(self.handle_submission_json_or_defer(
+                        iter_deferred.submission_json, iter_deferred.httpx_client, iter_deferred.folder_collection,
+                        iter_deferred.temporary_dir, iter_deferred.cookiefile, stop_event))
+
+        self.http_fetcher.log_failure_summary()
+
+        if self.failed_submissions:
+            for iter_submission_id, iter_deferred in self.failed_submissions.items():
+                logger.error("submission `%s` failed: %s", iter_submission_id, iter_deferred.error)
+            raise Exception(f"`{len(self.failed_submissions)}` submissions failed, see the log for details")
+
+
+    def create_submission_work_item(self, submission_json:dict, httpx_client:httpx.AsyncClient,
+        folder_collection:utils.ProfileFolderCollection,
+        temporary_dir:pathlib.Path, cookiefile:pathlib.Path) -> SubmissionWorkItem:
+
+        content_type = content_types.get_content_type_of_submission(submission_json)
+
+        return SubmissionWorkItem(
+            submission_json=submission_json,
+            submission_folders=utils.get_submission_folder_collection(folder_collection.get_content_dir(content_type.name), submission_json),
+            content_type=content_type,
+            folder_collection=folder_collection,
+            httpx_client=httpx_client,
+            temporary_dir=temporary_dir,
+            cookiefile=cookiefile)
+
+
+    async def handle_submission_json(self, submission_json:dict, httpx_client:httpx.AsyncClient,
         folder_collection:utils.ProfileFolderCollection,
         temporary_dir:pathlib.Path, cookiefile:pathlib.Path):
 
-        # make folder under stories folder
-        safe_submission_name = utils.make_safe_filename(submission_json["title"])
-        submission_id = submission_json["id"]
+        work_item = self.create_submission_work_item(submission_json, httpx_client, folder_collection, temporary_dir, cookiefile)
+
+        await self.run_submission_stage(scrape_state.STAGE_METADATA, self.write_submission_metadata, work_item)
+        await self.run_submission_stage(scrape_state.STAGE_THUMBNAIL, self.download_submission_thumbnail, work_item)
+        if work_item.content_type.has_content_file:
+            await self.run_submission_stage(scrape_state.STAGE_CONTENT, self.download_submission_content, work_item)
+        await self.run_submission_stage(scrape_state.STAGE_WARC, self.capture_submission_warc, work_item)
+        await self.run_submission_stage(scrape_state.STAGE_HTML, self.download_submission_html, work_item)
 
-        iter_submission_folder = folder_collection.stories_dir / f"{safe_submission_name} [{submission_id}]"
-        logger.debug("submission `%s`: creating submission folder at `%s`", submission_id, iter_submission_folder)
-        iter_submission_folder.mkdir(exist_ok=True)
+        logger.debug("submission `%s` done", work_item.submission_folders.submission_id)
 
 
+    async def run_submission_stage(self, stage_name:str, stage_function, work_item:SubmissionWorkItem):
+        '''
+        call `await stage_function(work_item)`, keeping track of how long it took and whether it worked
+        '''
+
+        start_time = time.monotonic()
+        try:
+            await stage_function(work_item)
+        except Exception:
+            self.metrics.increment(metrics.SUBMISSION_STAGE_FAILURES, stage=stage_name)
+            raise
+
+        self.metrics.observe(metrics.SUBMISSION_STAGE_SECONDS, time.monotonic() - start_time, stage=stage_name)
+        self.metrics.increment(metrics.SUBMISSION_STAGE_COMPLETIONS, stage=stage_name)
+
+
+    async def write_submission_metadata(self, work_item:SubmissionWorkItem):
+        '''
+        create the submission's folder and write its info.json, this has to happen before the other stages
+        '''
+
+        submission_json = work_item.submission_json
+        submission_folders = work_item.submission_folders
+        submission_id = submission_folders.submission_id
+
+        # make folder under the folder for its kind of submission
+        logger.debug("submission `%s`: creating submission folder at `%s`", submission_id, submission_folders.root_dir)
+        await self.output_writer.mkdir(submission_folders.root_dir)
+
         # write profile json
-        profile_json_path = iter_submission_folder / f"info.json"
-        logger.debug("submission `%s`: creating submission json at `%s`", submission_id, profile_json_path)
+        profile_json_bytes = self.get_submission_json_bytes(submission_json)
+        profile_json_hash = hashlib.sha256(profile_json_bytes).hexdigest()
 
-        with open(profile_json_path, "w", encoding="utf-8") as f:
-            json.dump(submission_json, f)
+        previous_profile_json_hash = self.state_database.get_stage_hash(submission_id, scrape_state.STAGE_METADATA)
+        if self.incremental and previous_profile_json_hash not in (None, profile_json_hash):
+            logger.info("submission `%s`: changed since it was last archived, downloading it again", submission_id)
+            self.state_database.clear_submission_stages(submission_id)
+            # the thumbnail url usually stays the same when the thumbnail changes, so don't go by what it had before
+            if submission_json.get("thumbnail"):
+                self.state_database.clear_url_blob_hash(submission_json["thumbnail"])
 
-        # get thumbnail
-        thumbnail_path = iter_submission_folder / "thumbnail.png"
-        thumbnail_response = None
-        for i in range(5):
-            try:
-                thumbnail_response = await httpx_client.get(submission_json["thumbnail"])
-                break
-            except httpx.HTTPError as e:
-                logger.exception("caught error, retrying")
-                await asyncio.sleep(5)
-        logger.debug("submission `%s`, thumbnail response: `%s`", submission_id, thumbnail_response)
-        thumbnail_response.raise_for_status()
-        logger.debug("submission `%s`, writing thumbnail to `%s`", submission_id, thumbnail_path)
-        with open(thumbnail_path, "wb") as f:
-            f.write(thumbnail_response.read())
-
-        # download html
-        fixed_link = utils.ensure_link_is_https(submission_json["link"])
+        if previous_profile_json_hash == profile_json_hash and \
+            await self.is_stage_already_done(submission_id, scrape_state.STAGE_METADATA, submission_folders.info_json):
+            logger.debug("submission `%s`: submission json is unchanged, not writing it", submission_id)
+            return
 
+        logger.debug("submission `%s`: creating submission json at `%s`", submission_id, submission_folders.info_json)
+
+        await self.output_writer.write_file(submission_folders.info_json, profile_json_bytes)
+        await self.output_writer.record_checksum(submission_folders.checksums, submission_folders.info_json, profile_json_hash)
+        self.catalog.update_submission(submission_json, str(submission_folders.root_dir.relative_to(self.output_path)), profile_json_hash)
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_METADATA, profile_json_hash)
+
+
+    def get_submission_json_bytes(self, submission_json:dict) -> bytes:
+        '''
+        the bytes written to a submission's info.json, the hash of these is used to tell if a submission changed
+        '''
+
+        return json.dumps(submission_json).encode("utf-8")
+
+
+    def is_submission_archived(self, submission_json:dict) -> bool:
+        '''
+        whether a previous run finished every stage of this submission, and the submission
+        json is the same as it was back then
+        '''
+
+        submission_id = submission_json["id"]
+
+        profile_json_hash = hashlib.sha256(self.get_submission_json_bytes(submission_json)).hexdigest()
+        if self.state_database.get_stage_hash(submission_id, scrape_state.STAGE_METADATA) != profile_json_hash:
+            return False
+
+        stages_to_check = [scrape_state.STAGE_THUMBNAIL, scrape_state.STAGE_HTML]
+        if content_types.get_content_type_of_submission(submission_json).has_content_file:
+            stages_to_check.append(scrape_state.STAGE_CONTENT)
+        if self.is_warc_enabled():
+            stages_to_check.append(scrape_state.STAGE_WARC)
+
+        return all(self.state_database.is_stage_complete(submission_id, iter_stage) for iter_stage in stages_to_check)
+
+
+    async def is_stage_already_done(self, submission_id, stage:str, output_path:pathlib.Path) -> bool:
+        '''
+        whether a previous run finished this stage of the submission and what it wrote is still on disk
+        '''
+
+        if self.ignore_previous_progress or not self.state_database.is_stage_complete(submission_id, stage):
+            return False
+
+        return await self.output_writer.run(output_path.exists, operation="exists")
+
+
+    async def download_submission_thumbnail(self, work_item:SubmissionWorkItem):
+
+        submission_json = work_item.submission_json
+        submission_id = work_item.submission_folders.submission_id
+        thumbnail_path = work_item.submission_folders.thumbnail
+
+        if await self.is_stage_already_done(submission_id, scrape_state.STAGE_THUMBNAIL, thumbnail_path):
+            logger.debug("submission `%s`: thumbnail was downloaded in a previous run", submission_id)
+            return
+
+        if not submission_json.get("thumbnail"):
+            # journals don't always have one
+            logger.debug("submission `%s`: doesn't have a thumbnail", submission_id)
+            self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_THUMBNAIL)
+            return
+
+        # lots of submissions have the same default thumbnail, so these go in the blob store
+        thumbnail_hash = await self.blob_store.fetch_blob(
+            self.http_fetcher, work_item.httpx_client, submission_json["thumbnail"], http_fetch.ENDPOINT_THUMBNAIL,
+            trust_known_urls=not self.ignore_previous_progress)
+        logger.debug("submission `%s`, linking thumbnail blob `%s` to `%s`", submission_id, thumbnail_hash, thumbnail_path)
+        await self.blob_store.link_blob(thumbnail_hash, thumbnail_path)
+
+        await self.output_writer.record_checksum(work_item.submission_folders.checksums, thumbnail_path, thumbnail_hash)
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_THUMBNAIL, thumbnail_hash)
+
+
+    async def download_submission_content(self, work_item:SubmissionWorkItem):
+        '''
+        download the full size file of an artwork, song or photo into the submission's `content` folder. It is
+        streamed to disk, so a big file is never all in memory
+        '''
+
+        submission_id = work_item.submission_folders.submission_id
+        content_dir = work_item.submission_folders.content_dir
+
+        if await self.is_stage_already_done(submission_id, scrape_state.STAGE_CONTENT, content_dir):
+            logger.debug("submission `%s`: content was downloaded in a previous run", submission_id)
+            return
+
+        await self.output_writer.mkdir(content_dir)
+        content_path, content_hash = await self.http_fetcher.fetch_to_directory(
+            work_item.httpx_client, content_types.get_content_url(work_item.submission_json), http_fetch.ENDPOINT_SUBMISSION_CONTENT,
+            content_dir, work_item.submission_folders.safe_submission_name or str(submission_id), self.output_writer)
+        logger.debug("submission `%s`: downloaded content to `%s`", submission_id, content_path)
+
+        # if it was downloaded before under another name, that one is out of date now
+        old_content_paths = await self.output_writer.run(
+            lambda: [x for x in content_dir.iterdir() if x != content_path and not x.name.startswith(".")], operation="list_dir")
+        for iter_path in old_content_paths:
+            logger.debug("submission `%s`: removing old content file `%s`", submission_id, iter_path)
+            await self.output_writer.unlink(iter_path)
+
+        await self.output_writer.record_checksum(work_item.submission_folders.checksums, content_path, content_hash, old_content_paths)
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_CONTENT, content_hash)
+
+
+    async def capture_submission_warc(self, work_item:SubmissionWorkItem):
+
+        submission_json = work_item.submission_json
+        submission_folders = work_item.submission_folders
+        submission_id = submission_folders.submission_id
 
         # download warc with get if it was passed in
-        if self.wget_path:
-            # warc path has no extension it is added automatically
-            warc_path = iter_submission_folder / f"{safe_submission_name} [{submission_id}]"
-
-            # call wget
-
-            logger.info("submission `%s`: calling wget", submission_id)
-
-            with tempfile.TemporaryDirectory(dir=temporary_dir) as warctempdir:
-                warc_temp_dir = pathlib.Path(warctempdir)
-                wget_args = wget_utils.get_wget_args(
-                    cookie_path=cookiefile,
-                    warc_path=warc_path,
-                    tempdir=warc_temp_dir,
-                    submission_json=submission_json,
-                    url=fixed_link)
-
-                logger.debug("submission `%s`: calling wget-at to create a warc at `%s`", submission_id, warc_path)
-
-                await wget_utils.run_command_and_wait(
-                    binary_to_run=self.wget_path,
-                    argument_list=wget_args,
-                    timeout=20,
-                    acceptable_return_codes= [0,1, 8],
-                    cwd=warc_temp_dir)
-        else:
+        if not self.is_warc_enabled():
             logger.debug("submission `%s`: skipping warc download cause wget path was not provided", submission_id)
+            return
 
-        # download html raw
-        html_path = iter_submission_folder / f"{safe_submission_name} [{submission_id}].html"
-        html_response=None
-        for i in range(5):
-            try:
-                html_response = await httpx_client.get(fixed_link)
-                break
-            except httpx.HTTPError as e:
-                logger.exception("caught error, retrying")
-                await asyncio.sleep(5)
+        if await self.is_warc_already_captured(work_item):
+            logger.debug("submission `%s`: warc was captured in a previous run", submission_id)
+            return
 
-        logger.debug("submission `%s`, html response: `%s`", submission_id, html_response)
-        html_response.raise_for_status()
-        logger.debug("submission `%s`, writing html to `%s`", submission_id, html_path)
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html_response.text)
+        fixed_link = utils.ensure_link_is_https(submission_json["link"])
 
+        if not self.rolling_warcs:
+            await self.capture_submission_warc_to_path(work_item, fixed_link, submission_folders.warc)
+            self.state_database.clear_warc_location(submission_id)
+            warc_stat = await self.output_writer.run(submission_folders.warc.stat, operation="stat")
+            self.metrics.increment(metrics.WARC_BYTES, warc_stat.st_size)
+            self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_WARC)
+            return
 
+        # capture it on its own first, so a capture that fails halfway never ends up in the rolling warc
+        with tempfile.TemporaryDirectory(dir=work_item.temporary_dir) as capture_dir:
+            capture_path = pathlib.Path(capture_dir) / submission_folders.warc.name
+            await self.capture_submission_warc_to_path(work_item, fixed_link, capture_path)
 
-        logger.debug("submission `%s` done", submission_id)
+            rolling_warc_writer = await self.get_rolling_warc_writer(work_item.folder_collection)
+            warc_location = await rolling_warc_writer.append_warc_file(capture_path)
 
+        logger.debug("submission `%s`: appended warc to `%s` at offset `%s`", submission_id, warc_location.warc_path, warc_location.offset)
+        self.state_database.save_warc_location(submission_id,
+            str(warc_location.warc_path.relative_to(self.output_path)), warc_location.offset, warc_location.length)
+        self.metrics.increment(metrics.WARC_BYTES, warc_location.length)
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_WARC)
 
 
+    async def capture_submission_warc_to_path(self, work_item:SubmissionWorkItem, fixed_link:str, warc_path:pathlib.Path):
 
+        if self.native_warc_capture:
+            await self.capture_submission_warc_natively(work_item, fixed_link, warc_path)
+        else:
+            await self.capture_submission_warc_with_wget(work_item, fixed_link, warc_path)
 
-    async def run(self, parsed_args, stop_event:asyncio.Event):
 
+    async def is_warc_already_captured(self, work_item:SubmissionWorkItem) -> bool:
+
+        submission_id = work_item.submission_folders.submission_id
+        warc_location = self.get_submission_warc_location(submission_id)
+        if warc_location is not None:
+            return await self.is_stage_already_done(submission_id, scrape_state.STAGE_WARC, warc_location.warc_path)
+        return await self.is_stage_already_done(submission_id, scrape_state.STAGE_WARC, work_item.submission_folders.warc)
+
+
+    def get_submission_warc_location(self, submission_id) -> rolling_warc.WarcLocation|None:
+        '''
+        @return where the submission's records are if they were appended to a rolling warc, or None
+        '''
+
+        row = self.state_database.get_warc_location(submission_id)
+        if row is None:
+            return None
+
+        warc_path, offset, length = row
+        return rolling_warc.WarcLocation(warc_path=self.output_path / warc_path, offset=offset, length=length)
+
+
+    async def get_rolling_warc_writer(self, folder_collection:utils.ProfileFolderCollection) -> rolling_warc.RollingWarcWriter:
+
+        if self.rolling_warcs == rolling_warc.ROLLING_WARCS_PER_USER:
+            directory = folder_collection.root_dir / rolling_warc.ROLLING_WARC_DIRNAME
+            name_prefix = f"sofurry_{utils.make_safe_filename(folder_collection.username)}"
+        else:
+            directory = self.output_path / rolling_warc.ROLLING_WARC_DIRNAME
+            name_prefix = "sofurry"
+
+        if directory not in self.rolling_warc_writers:
+            rolling_warc_writer = rolling_warc.RollingWarcWriter(directory, name_prefix, self.rolling_warc_max_size * 1024 * 1024)
+            self.rolling_warc_writers[directory] = rolling_warc_writer
+            # opening it can mean indexing a warc a previous run didn't finish. Anything else that wants to append to
+            # it in the meantime waits for the lock
+            async with rolling_warc_writer.lock:
+                try:
+                    await self.output_writer.run(rolling_warc_writer.open, operation="open_rolling_warc")
+                except BaseException:
+                    self.rolling_warc_writers.pop(directory, None)
+                    raise
+
+        return self.rolling_warc_writers[directory]
+
+
+    async def close_user_rolling_warc_writer(self, folder_collection:utils.ProfileFolderCollection):
+        '''
+        with `--rolling-warcs user`, finish the user's rolling warc and write its index once we are done with the user,
+        instead of keeping it open until the end of the run. Otherwise scraping a lot of users runs out of open files.
+        If a deferred submission of the user is tried again later, a new one is started
+        '''
+
+        if self.rolling_warcs != rolling_warc.ROLLING_WARCS_PER_USER:
+            return
+
+        rolling_warc_writer = self.rolling_warc_writers.pop(folder_collection.root_dir / rolling_warc.ROLLING_WARC_DIRNAME, None)
+        if rolling_warc_writer is None:
+            return
+
+        # wait for anything still being appended to it
+        async with rolling_warc_writer.lock:
+            await asyncio.to_thread(rolling_warc_writer.close)
+
+
+    async def capture_submission_warc_natively(self, work_item:SubmissionWorkItem, fixed_link:str, warc_path:pathlib.Path):
+
+        submission_id = work_item.submission_folders.submission_id
+        logger.info("submission `%s`: capturing warc", submission_id)
+
+        capture_result = await self.native_warc_capture.capture(
+            work_item.httpx_client, fixed_link, warc_path, warc_writer.get_submission_warcinfo_fields(work_item.submission_json))
+
+        logger.debug("submission `%s`: captured warc at `%s` with `%s` linked assets, `%s` of them failed",
+            submission_id, warc_path, capture_result.asset_count, capture_result.failed_asset_count)
+
+
+    async def capture_submission_warc_with_wget(self, work_item:SubmissionWorkItem, fixed_link:str, warc_path:pathlib.Path):
+
+        submission_json = work_item.submission_json
+        submission_folders = work_item.submission_folders
+        submission_id = submission_folders.submission_id
+
+        # call wget
+
+        logger.info("submission `%s`: calling wget", submission_id)
+
+        with tempfile.TemporaryDirectory(dir=work_item.temporary_dir) as warctempdir:
+            warc_temp_dir = pathlib.Path(warctempdir)
+            wget_args = wget_utils.get_wget_args(
+                cookie_path=work_item.cookiefile,
+                # wget-at adds the extension itself
+                warc_path=warc_path.with_name(warc_path.name.removesuffix(".warc.gz")),
+                tempdir=warc_temp_dir,
+                submission_json=submission_json,
+                url=fixed_link)
+
+            logger.debug("submission `%s`: calling wget-at to create a warc at `%s`", submission_id, warc_path)
+
+            await self.wget_process_pool.run_capture(
+                argument_list=wget_args,
+                cwd=warc_temp_dir,
+                rate_limiter=self.get_rate_limiter_for_url(fixed_link))
+
+
+    async def download_submission_html(self, work_item:SubmissionWorkItem):
+
+        submission_id = work_item.submission_folders.submission_id
+        html_path = work_item.submission_folders.html
+
+        if await self.is_stage_already_done(submission_id, scrape_state.STAGE_HTML, html_path):
+            logger.debug("submission `%s`: html was downloaded in a previous run", submission_id)
+            return
+
+        fixed_link = utils.ensure_link_is_https(work_item.submission_json["link"])
+
+        if self.html_from_warc:
+            # the warc stage already got the page, so take it from there instead of asking the site for it again
+            logger.debug("submission `%s`, writing html from the warc to `%s`", submission_id, html_path)
+            html_hash = await self.output_writer.run(self.write_submission_html_from_warc,
+                work_item, fixed_link, self.get_submission_warc_location(submission_id))
+        else:
+            # download html raw
+            logger.debug("submission `%s`, downloading html to `%s`", submission_id, html_path)
+            html_hash = await self.http_fetcher.fetch_to_file(
+                work_item.httpx_client, fixed_link, http_fetch.ENDPOINT_SUBMISSION_HTML, html_path, self.output_writer)
+
+        await self.output_writer.record_checksum(work_item.submission_folders.checksums, html_path, html_hash)
+        self.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_HTML, html_hash)
+
+
+    def write_submission_html_from_warc(self, work_item:SubmissionWorkItem, fixed_link:str,
+        warc_location:rolling_warc.WarcLocation|None) -> str:
+        '''
+        write the html file from the response for the submission page in its warc, which has to be captured first
+
+        @param warc_location - where the submission is if it is in a rolling warc, see `get_submission_warc_location()`
+        @return the sha256 hex digest of the html
+        '''
+
+        if warc_location is not None:
+            html_bytes = warc_writer.get_page_content_from_warc(warc_location.warc_path, fixed_link, warc_location.offset, warc_location.length)
+        else:
+            html_bytes = warc_writer.get_page_content_from_warc(work_item.submission_folders.warc, fixed_link)
+        utils.write_file_atomically(work_item.submission_folders.html, html_bytes, fsync=self.output_writer.fsync_each_file)
+        return hashlib.sha256(html_bytes).hexdigest()
+
+
+    def create_httpx_client(self) -> httpx.AsyncClient:
+        '''
+        create the client used for the whole scrape, call after `configure_from_parsed_args()`
+        '''
+
+        return sofurry_session.create_httpx_client(self.rate_limiter_registry)
+
+
+    async def log_in(self, httpx_client:httpx.AsyncClient, credential_json:dict, cookiefile_path:pathlib.Path):
+        '''
+        log in, or reuse the session from the session cache, and write the cookie file for wget-at. The cookie
+        file and session cache are kept up to date if the cookies change during the run
+        '''
+
+        session_cookie_manager = sofurry_session.SessionCookieManager(httpx_client, self.session_cache_path, cookiefile_path)
+        await session_cookie_manager.log_in(credential_json)
+
+
+    def is_warc_enabled(self) -> bool:
+        return self.wget_process_pool is not None or self.native_warc_capture is not None
+
+
+    def get_rate_limiter_for_url(self, url:str) -> rate_limit.HostRateLimiter|None:
+
+        if not self.rate_limiter_registry:
+            return None
+        return self.rate_limiter_registry.get_limiter_for_host(httpx.URL(url).host)
+
+
+    def configure_from_parsed_args(self, parsed_args, listing_arguments:bool=True):
+        '''
+        set up the things that are shared between every user that gets scraped, from the
+        arguments added by `add_scrape_arguments()`
+
+        @param listing_arguments - the same as what was passed to `add_scrape_arguments()`
+        '''
 
-        # create output directory
-        output_path:pathlib.Path = parsed_args.output_path
-        user_to_scrape:str = parsed_args.username_to_scrape
         self.wget_path = parsed_args.wget_path
+        if self.wget_path and parsed_args.warc_backend == WARC_BACKEND_WGET_AT:
+            self.wget_process_pool = wget_utils.WgetProcessPool(
+                wget_path=self.wget_path,
+                max_concurrent_processes=parsed_args.max_concurrent_wget,
+                timeout=parsed_args.wget_timeout,
+                max_attempts=parsed_args.wget_attempts,
+                metrics_registry=self.metrics)
+        self.submission_semaphore = asyncio.Semaphore(parsed_args.max_concurrent_submissions)
+        self.configure_http_from_parsed_args(parsed_args)
+        if parsed_args.warc_backend == WARC_BACKEND_NATIVE:
+            self.native_warc_capture = warc_writer.NativeWarcCapture(self.http_fetcher, wget_utils.WGET_ACCEPT_REGEX)
+        self.output_writer = output_writer.OutputWriter(parsed_args.writer_threads, parsed_args.fsync_policy, self.metrics)
+        self.html_from_warc = parsed_args.html_from_warc
+        if self.html_from_warc and not self.is_warc_enabled():
+            raise Exception("--html-from-warc needs a warc to get the html from, pass in --wget-path or --warc-backend native")
+        self.rolling_warcs = parsed_args.rolling_warcs
+        self.rolling_warc_max_size = parsed_args.rolling_warc_max_size
+        if self.rolling_warcs and not self.is_warc_enabled():
+            raise Exception("--rolling-warcs needs warcs to be captured, pass in --wget-path or --warc-backend native")
+        self.metrics.set_gauge_function(metrics.SUBMISSIONS_DEFERRED, lambda: len(self.failed_submissions))
+        self.progress_interval = parsed_args.progress_interval
+        self.metrics_file = parsed_args.metrics_file
+        self.metrics_port = parsed_args.metrics_port
+        self.session_cache_path = sofurry_session.get_session_cache_path(parsed_args)
+        self.ignore_previous_progress = parsed_args.ignore_previous_progress
+
+        if not listing_arguments:
+            # the work items can be any kind of submission, so every kind gets counted in the progress
+            self.content_types = list(content_types.CONTENT_TYPES.values())
+            return
+
+        self.content_types = content_types.get_content_types(parsed_args.content_types)
+        self.listing_prefetch_pages = parsed_args.listing_prefetch_pages
+        self.incremental = parsed_args.incremental
+
+        self.use_stage_pipeline = parsed_args.use_stage_pipeline
+        self.stage_mailbox_size = parsed_args.stage_mailbox_size
+        self.stage_concurrency = dict(DEFAULT_PIPELINE_STAGE_CONCURRENCY)
+        self.stage_concurrency[PIPELINE_STAGE_WARC] = parsed_args.max_concurrent_wget
+        for iter_stage_name, iter_concurrency in parsed_args.stage_concurrency:
+            if iter_stage_name not in self.stage_concurrency:
+                raise Exception(f"unknown pipeline stage `{iter_stage_name}` passed to --stage-concurrency, " +
+                    f"the stages are: `{list(self.stage_concurrency.keys())}`")
+            self.stage_concurrency[iter_stage_name] = iter_concurrency
+
+
+    def configure_http_from_parsed_args(self, parsed_args):
+        '''
+        set up the request retrying and the rate limiters, from the arguments added by `add_http_arguments()`
+        '''
 
-        # load credential file
-        credential_json = None
-        with open(parsed_args.credentials_json_file, "r", encoding="utf-8") as f:
-            credential_json = json.load(f)
+        self.http_fetcher = http_fetch.HttpFetcher(max_attempts=parsed_args.http_attempts, metrics_registry=self.metrics)
+        if not parsed_args.disable_rate_limiting:
+            self.rate_limiter_registry = rate_limit.RateLimiterRegistry(
+                parsed_args.max_requests_per_second, parsed_args.max_concurrent_requests_per_host)
 
-        logger.info("loaded credential file from `%s`", parsed_args.credentials_json_file)
 
+    def get_submission_stage_names(self, content_type:content_types.ContentType) -> list[str]:
+        '''
+        @return the stages a submission of this kind goes through, for the progress
+        '''
 
+        stage_names = [scrape_state.STAGE_METADATA, scrape_state.STAGE_THUMBNAIL, scrape_state.STAGE_HTML]
+        if content_type.has_content_file:
+            stage_names.append(scrape_state.STAGE_CONTENT)
+        if self.is_warc_enabled():
+            stage_names.append(scrape_state.STAGE_WARC)
+        return stage_names
 
-        logger.info("creating httpx client")
 
+    def report_metrics(self) -> metrics.MetricsReporter:
+        '''
+        @return a reporter to `async with` for the duration of the scrape, it logs the progress and writes
+        the metrics to `--metrics-file` / serves them on `--metrics-port`
+        '''
 
-        headers = utils.get_headers()
+        stage_names = list()
+        for iter_content_type in self.content_types:
+            stage_names.extend(x for x in self.get_submission_stage_names(iter_content_type) if x not in stage_names)
 
+        return metrics.MetricsReporter(self.metrics, stage_names, self.progress_interval,
+            metrics_file=self.metrics_file, prometheus_port=self.metrics_port)
 
-        login_post_data = utils.get_login_post_data(credential_json["username"], credential_json["password"])
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
+    @contextlib.contextmanager
+    def open_output_path(self, output_path:pathlib.Path):
+        '''
+        create the output root and open the state database, catalog and blob store in it, which are shared between
+        every user scraped into the same output root, along with the output writer
+        '''
 
-            # it HAS to be http2=True and http1=False or else the sofurry api refuses to work LOL
-            async with httpx.AsyncClient(headers=headers, follow_redirects=True, http1=False, http2=True) as httpx_client:
+        output_path.mkdir(parents=True, exist_ok=True)
+        self.output_path = output_path
+        with scrape_state.ScrapeStateDatabase(output_path / scrape_state.STATE_DATABASE_FILENAME) as state_database, \
+            catalog.CatalogDatabase(output_path / catalog.CATALOG_DATABASE_FILENAME) as catalog_database, \
+            self.output_writer:
+            self.state_database = state_database
+            self.catalog = catalog_database
 
-                logger.info("making initial calls to sofurry...")
+            self.blob_store = blob_store.BlobStore(output_path / blob_store.BLOB_STORE_DIRNAME, state_database, self.output_writer)
+            self.blob_store.open()
 
-                # hit the main page to get some headers and cookies
-                homepage_resp = await httpx_client.get("https://www.sofurry.com", timeout=10.0)
-                logger.debug("homepage response: `%s`", homepage_resp)
-                homepage_resp.raise_for_status()
+            try:
+                yield state_database
+            finally:
+                self.blob_store.log_summary()
 
-                login_pg_resp = await httpx_client.get("https://www.sofurry.com/user/login", timeout=10.0)
-                logger.debug("login page get response: `%s`", login_pg_resp)
-                login_pg_resp.raise_for_status()
+                # so the last rolling warcs get their index
+                for iter_rolling_warc_writer in self.rolling_warc_writers.values():
+                    iter_rolling_warc_writer.close()
+                self.rolling_warc_writers = dict()
 
-                logger.info("logging in to sofurry...")
-                login_post_resp = await httpx_client.post("https://www.sofurry.com/user/login", data=login_post_data, timeout=10.0)
-                logger.debug("login page post response: `%s`", login_post_resp)
-                login_post_resp.raise_for_status()
-                logger.info("login successful")
 
-                # write cookie file
-                tempdir = pathlib.Path(tmpdirname)
-                cookiefile_path =  tempdir / "cookie.dat"
-                wget_utils.write_cookie_file(cookiefile_path, dict(httpx_client.cookies))
+    async def scrape_user(self, httpx_client:httpx.AsyncClient, user_to_scrape:str, output_path:pathlib.Path,
+        tempdir:pathlib.Path, cookiefile_path:pathlib.Path, stop_event:asyncio.Event):
+        '''
+        scrape a single user, the client has to be logged in already and `self.state_database` has to be open
+        '''
+
+        # fetch the user
+        user_info = await self.get_user_info(httpx_client, user_to_scrape)
 
-                # fetch the user
-                user_info = await self.get_user_info(httpx_client, user_to_scrape)
+        real_username = user_info["useralias"]
+        real_uid = user_info["userID"]
 
-                real_username = user_info["useralias"]
-                real_uid = user_info["userID"]
+        # create initial directories
+        folder_collection:utils.ProfileFolderCollection = await self.output_writer.run(
+            utils.create_necessary_output_directories, output_path, real_username, real_uid)
+
+        # write profile json
+        await self.write_profile_json(user_info, folder_collection)
+
+        # scrape every kind of submission
+        try:
+            await self.scrape_content_types(httpx_client, real_uid, folder_collection, tempdir, cookiefile_path, stop_event)
+        finally:
+            await self.close_user_rolling_warc_writer(folder_collection)
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
 
-                # create initial directories
-                folder_collection:ProfileFolderCollection = utils.create_necessary_output_directories(output_path, real_username, real_uid)
 
-                # write profile json
-                self.write_profile_json(user_info, folder_collection)
+        # create output directory
+        output_path:pathlib.Path = parsed_args.output_path
+        user_to_scrape:str = parsed_args.username_to_scrape
+        self.configure_from_parsed_args(parsed_args)
+
+        # load credential file
+        credential_json = sofurry_session.load_credentials(parsed_args.credentials_json_file)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+
+            async with self.create_httpx_client() as httpx_client:
+
+                tempdir = pathlib.Path(tmpdirname)
+                cookiefile_path =  tempdir / "cookie.dat"
+                await self.log_in(httpx_client, credential_json, cookiefile_path)
 
-                # scrape stories
-                await self.scrape_stories(httpx_client,real_uid, folder_collection, tempdir, cookiefile_path, stop_event)
+                with self.open_output_path(output_path):
 
+                    async with self.report_metrics():
 
+                        async with self.run_pipeline_if_enabled(stop_event):
+                            await self.scrape_user(httpx_client, user_to_scrape, output_path, tempdir, cookiefile_path, stop_event)
 
+                        await self.retry_failed_submissions(stop_event)
@@ -0,0 +1,174 @@
+import logging
+import asyncio
+import concurrent.futures
+import os
+import pathlib
+import time
+
+import arrow
+
+from sofurry_scrape.argparse_utils import isFolderType, isFileType, isPositiveIntType
+from sofurry_scrape import utils
+from sofurry_scrape import scrape_state
+from sofurry_scrape import archive_verify
+
+logger = logging.getLogger(__name__)
+
+# how many submission folders a worker process checks at a time
+DEFAULT_BATCH_SIZE = 200
+
+
+class Verify:
+
+    @staticmethod
+    def create_subparser_command(argparse_subparser):
+        '''
+        populate the argparse arguments for this module
+
+        @param argparse_subparser - the object returned by ArgumentParser.add_subparsers()
+        that we call add_parser() on to add arguments and such
+
+        '''
+
+        parser = argparse_subparser.add_parser("verify")
+
+        parser.add_argument(
+            "--output-path",
+            required=True,
+            dest="output_path",
+            type=isFolderType(True),
+            help="the output path of a scrape to check")
+
+        parser.add_argument(
+            "--report-path",
+            required=False,
+            default=None,
+            dest="report_path",
+            type=isFileType(False),
+            help=f"where to write the report, defaults to `{archive_verify.VERIFY_REPORT_FILENAME}` in the output path")
+
+        parser.add_argument(
+            "--requeue-broken",
+            action="store_true",
+            dest="requeue_broken",
+            help="mark the broken parts of the broken submissions as not done in the scrape state database, so the next " +
+                "scrape of their users (or `amqp_producer` run) downloads just those again")
+
+        parser.add_argument(
+            "--workers",
+            required=False,
+            default=os.cpu_count(),
+            dest="workers",
+            type=isPositiveIntType,
+            help="how many processes check the submission folders, defaults to the number of cpus")
+
+        parser.add_argument(
+            "--batch-size",
+            required=False,
+            default=DEFAULT_BATCH_SIZE,
+            dest="batch_size",
+            type=isPositiveIntType,
+            help=f"how many submission folders each worker checks at a time, defaults to {DEFAULT_BATCH_SIZE}")
+
+        verify_obj = Verify()
+
+        # set the function that is called when this command is used
+        parser.set_defaults(func_to_run=verify_obj.run)
+
+
+    def get_submissions_to_verify(self, output_path:pathlib.Path) -> list[archive_verify.SubmissionToVerify]:
+        '''
+        list every submission folder, along with what the state database knows about its warc
+        '''
+
+        warc_locations = dict()
+        warc_submission_ids = set()
+
+        state_database_path = output_path / scrape_state.STATE_DATABASE_FILENAME
+        if state_database_path.exists():
+            with scrape_state.ScrapeStateDatabase(state_database_path) as state_database:
+                warc_locations = state_database.get_all_warc_locations()
+                warc_submission_ids = state_database.get_submission_ids_with_stage(scrape_state.STAGE_WARC)
+        else:
+            logger.warning("there is no scrape state database at `%s`, so warcs are only checked if they are in the submission folders",
+                state_database_path)
+
+        submissions = list()
+        for iter_user_dir in utils.find_user_dirs(output_path):
+            for iter_submission_dir in utils.find_submission_dirs(iter_user_dir):
+                submission_id = utils.get_submission_folder_collection_from_dir(iter_submission_dir).submission_id
+                submissions.append(archive_verify.SubmissionToVerify(
+                    submission_dir=iter_submission_dir,
+                    warc_location=warc_locations.get(submission_id),
+                    warc_expected=submission_id in warc_submission_ids))
+
+        return submissions
+
+
+    async def run(self, parsed_args, stop_event:asyncio.Event):
+
+        output_path:pathlib.Path = parsed_args.output_path
+        report_path:pathlib.Path = parsed_args.report_path or output_path / archive_verify.VERIFY_REPORT_FILENAME
+
+        state_database_path = output_path / scrape_state.STATE_DATABASE_FILENAME
+        if parsed_args.requeue_broken and not state_database_path.exists():
+            raise Exception(f"`--requeue-broken` needs the scrape state database, and there isn't one at `{state_database_path}`")
+
+        start_time = time.monotonic()
+        logger.info("finding submissions in `%s`", output_path)
+        submissions = await asyncio.to_thread(self.get_submissions_to_verify, output_path)
+        logger.info("found `%s` submission folders, checking them with `%s` workers", len(submissions), parsed_args.workers)
+
+        batches = [submissions[x:x + parsed_args.batch_size] for x in range(0, len(submissions), parsed_args.batch_size)]
+
+        checked_count = 0
+        bytes_read = 0
+        broken = list()
+
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ProcessPoolExecutor(parsed_args.workers) as executor:
+
+            futures = [loop.run_in_executor(executor, archive_verify.verify_submissions, output_path, iter_batch)
+                for iter_batch in batches]
+
+            for iter_future in asyncio.as_completed(futures):
+
+                if stop_event.is_set():
+                    for iter_other_future in futures:
+                        iter_other_future.cancel()
+                    raise Exception("stopped before every submission was checked, no report was written")
+
+                batch_result = await iter_future
+                checked_count += batch_result.checked_count
+                bytes_read += batch_result.bytes_read
+                broken.extend(batch_result.broken)
+                logger.debug("checked `%s` of `%s` submissions so far, `%s` are broken", checked_count, len(submissions), len(broken))
+
+        elapsed_seconds = time.monotonic() - start_time
+
+        problem_counts = dict()
+        for iter_result in broken:
+            for iter_part in set(x.part for x in iter_result.problems):
+                problem_counts[iter_part] = problem_counts.get(iter_part, 0) + 1
+
+        summary = {
+            "output_path": str(output_path),
+            "verified_at": arrow.utcnow().isoformat(),
+            "checked": checked_count,
+            "broken": len(broken),
+            "broken_by_part": problem_counts,
+            "bytes_read": bytes_read,
+            "seconds": round(elapsed_seconds, 1),
+        }
+        archive_verify.write_report(report_path, summary, broken)
+
+        logger.info("checked `%s` submissions (`%.1f` MB) in `%.1f` seconds, `%s` are broken, wrote the report to `%s`",
+            checked_count, bytes_read / 1024 / 1024, elapsed_seconds, len(broken), report_path)
+        for iter_part, iter_count in sorted(problem_counts.items()):
+            logger.info("`%s` submissions have a broken `%s`", iter_count, iter_part)
+
+        if parsed_args.requeue_broken and broken:
+            with scrape_state.ScrapeStateDatabase(state_database_path) as state_database:
+                for iter_result in broken:
+                    archive_verify.requeue_submission(output_path, state_database, iter_result)
+            logger.info("requeued `%s` broken submissions, the next scrape of their users will download what was broken again", len(broken))
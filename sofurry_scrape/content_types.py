@@ -0,0 +1,111 @@
+import attr
+
+# the full size file of an artwork, song or photo, the thumbnail comes from `std/thumb` with the same parameter
+SUBMISSION_CONTENT_URL = "https://www.sofurryfiles.com/std/content"
+
+
+@attr.frozen
+class ContentType:
+    '''
+    a kind of submission a user can have, every kind is listed and put in folders the same way, just with different
+    urls. This is what lets one scraper handle all of them
+    '''
+
+    # used for `--content-types`, and the name of the folder the submissions go in under the user's folder
+    name:str
+    # the `contentType` field of the submission json
+    content_type_id:str
+    listing_url:str
+    folder_listing_url:str
+    # the query parameter with the page number in it, for both the json and html listings
+    page_param:str
+    # whether there is a full size file to download from `SUBMISSION_CONTENT_URL`, stories and journals are just the page
+    has_content_file:bool
+
+
+STORIES = ContentType(
+    name="stories",
+    content_type_id="0",
+    listing_url="https://www.sofurry.com/browse/user/stories",
+    folder_listing_url="https://www.sofurry.com/browse/folder/stories",
+    page_param="stories-page",
+    has_content_file=False)
+
+ARTWORK = ContentType(
+    name="artwork",
+    content_type_id="1",
+    listing_url="https://www.sofurry.com/browse/user/art",
+    folder_listing_url="https://www.sofurry.com/browse/folder/art",
+    page_param="art-page",
+    has_content_file=True)
+
+MUSIC = ContentType(
+    name="music",
+    content_type_id="2",
+    listing_url="https://www.sofurry.com/browse/user/music",
+    folder_listing_url="https://www.sofurry.com/browse/folder/music",
+    page_param="music-page",
+    has_content_file=True)
+
+JOURNALS = ContentType(
+    name="journals",
+    content_type_id="3",
+    listing_url="https://www.sofurry.com/browse/user/journals",
+    folder_listing_url="https://www.sofurry.com/browse/folder/journals",
+    page_param="journals-page",
+    has_content_file=False)
+
+PHOTOS = ContentType(
+    name="photos",
+    content_type_id="4",
+    listing_url="https://www.sofurry.com/browse/user/photos",
+    folder_listing_url="https://www.sofurry.com/browse/folder/photos",
+    page_param="photos-page",
+    has_content_file=True)
+
+CONTENT_TYPES = {x.name: x for x in [STORIES, ARTWORK, MUSIC, PHOTOS, JOURNALS]}
+
+_CONTENT_TYPES_BY_ID = {x.content_type_id: x for x in CONTENT_TYPES.values()}
+
+# for `--content-types`, instead of listing every one
+ALL_CONTENT_TYPES = "all"
+
+
+def get_content_type_of_submission(submission_json:dict) -> ContentType:
+    '''
+    the kind of submission this is, going by its `contentType`. The amqp workers only get the submission json,
+    so this is what decides which folder it goes in. Submissions without one are stories, since that is all
+    that used to get scraped
+    '''
+
+    return _CONTENT_TYPES_BY_ID.get(str(submission_json.get("contentType", STORIES.content_type_id)), STORIES)
+
+
+def get_content_url(submission_json:dict) -> str:
+    return f"{SUBMISSION_CONTENT_URL}?page={submission_json['id']}"
+
+
+def add_content_types_argument(parser):
+    '''
+    add `--content-types` to an argparse parser, see `get_content_types()` for turning what was passed in into `ContentType`s
+    '''
+
+    parser.add_argument(
+        "--content-types",
+        required=False,
+        default=[STORIES.name],
+        nargs="+",
+        dest="content_types",
+        choices=list(CONTENT_TYPES.keys()) + [ALL_CONTENT_TYPES],
+        help="the kinds of submissions to scrape, they are all gone through at the same time and share the " +
+            f"submission and request limits. `{ALL_CONTENT_TYPES}` is every kind. defaults to `{STORIES.name}`")
+
+
+def get_content_types(names:list[str]) -> list[ContentType]:
+    '''
+    @return the content types for the names passed to `--content-types`, without duplicates
+    '''
+
+    if ALL_CONTENT_TYPES in names:
+        return list(CONTENT_TYPES.values())
+    return [CONTENT_TYPES[x] for x in dict.fromkeys(names)]
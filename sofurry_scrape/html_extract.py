@@ -0,0 +1,130 @@
+import logging
+import re
+import urllib.parse
+
+import lxml.etree
+
+logger = logging.getLogger(__name__)
+
+folder_id_regex = re.compile(".*folder=(?P<folderid>[0-9]+)")
+
+FOLDER_IMG_CLASS = "sfFolderItem"
+
+
+class FolderIdParserTarget:
+    '''
+    an lxml parser target that picks out the folder ids from a user's listing page, like `/browse/user/stories`, it only looks at
+    the start and end of `<a>` and `<img>` tags so no tree gets built
+
+    the folders are `<a href="...folder=1234"><img class="sfFolderItem"></a>`
+    '''
+
+    def __init__(self):
+
+        # the hrefs of the `<a>` tags we are inside of, innermost last
+        self.open_link_hrefs = list()
+        self.folder_ids = dict()
+
+    def start(self, tag, attrib):
+
+        if tag == "a":
+            self.open_link_hrefs.append(attrib.get("href"))
+
+        elif tag == "img" and FOLDER_IMG_CLASS in attrib.get("class", "").split():
+
+            href = self.open_link_hrefs[-1] if self.open_link_hrefs else None
+            match = folder_id_regex.search(href) if href else None
+            if not match:
+                logger.warning("found a folder image that isn't inside a link to a folder, href: `%s`", href)
+                return
+
+            folder_id = match.groupdict()["folderid"]
+            if folder_id not in self.folder_ids:
+                logger.debug("found folder id `%s` in href `%s`", folder_id, href)
+                self.folder_ids[folder_id] = None
+
+    def end(self, tag):
+
+        if tag == "a" and self.open_link_hrefs:
+            self.open_link_hrefs.pop()
+
+    def data(self, data):
+        pass
+
+    def close(self) -> list[str]:
+        return list(self.folder_ids.keys())
+
+
+def extract_folder_ids(html:bytes) -> list[str]:
+    '''
+    find the folder ids on a user's listing page, like `/browse/user/stories`, in the order they are on the page
+
+    this is cpu bound, so call it with `asyncio.to_thread()` to keep it from blocking the event loop
+    '''
+
+    parser = lxml.etree.HTMLParser(target=FolderIdParserTarget())
+    parser.feed(html)
+    return parser.close()
+
+
+# the attribute of each tag that has a link in it, these are the ones wget-at follows
+LINK_ATTRIBUTES = {
+    "a": "href",
+    "area": "href",
+    "link": "href",
+    "img": "src",
+    "script": "src",
+    "iframe": "src",
+    "frame": "src",
+    "embed": "src",
+    "source": "src",
+    "input": "src",
+    "audio": "src",
+    "video": "src"}
+
+
+class LinkParserTarget:
+    '''
+    an lxml parser target that picks out the links on a page, like `FolderIdParserTarget` it doesn't build a tree
+    '''
+
+    def __init__(self, base_url:str):
+
+        self.base_url = base_url
+        self.links = dict()
+
+    def start(self, tag, attrib):
+
+        if tag == "base" and attrib.get("href"):
+            self.base_url = urllib.parse.urljoin(self.base_url, attrib["href"].strip())
+            return
+
+        link = attrib.get(LINK_ATTRIBUTES.get(tag, ""), "").strip()
+        if not link:
+            return
+
+        # the fragment isn't sent to the server, so links that only differ by it are the same
+        absolute_link, _ = urllib.parse.urldefrag(urllib.parse.urljoin(self.base_url, link))
+        if absolute_link.startswith(("http://", "https://")):
+            self.links[absolute_link] = None
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self) -> list[str]:
+        return list(self.links.keys())
+
+
+def extract_links(html:bytes, base_url:str) -> list[str]:
+    '''
+    find the links on a page, made absolute and in the order they are on the page
+
+    @param base_url - the url of the page, relative links are relative to this
+    '''
+
+    parser = lxml.etree.HTMLParser(target=LinkParserTarget(base_url))
+    parser.feed(html)
+    return parser.close()
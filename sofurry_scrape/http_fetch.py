@@ -0,0 +1,274 @@
+import logging
+import asyncio
+import random
+import hashlib
+import mimetypes
+import pathlib
+import time
+
+import httpx
+import attr
+
+from sofurry_scrape import rate_limit
+from sofurry_scrape import utils
+from sofurry_scrape import metrics
+from sofurry_scrape import output_writer
+
+logger = logging.getLogger(__name__)
+
+# the kinds of requests we make, each one gets its own timeout
+ENDPOINT_USER_PROFILE = "user_profile"
+ENDPOINT_LISTING = "listing"
+ENDPOINT_FOLDER_HTML = "folder_html"
+ENDPOINT_THUMBNAIL = "thumbnail"
+ENDPOINT_SUBMISSION_HTML = "submission_html"
+ENDPOINT_SUBMISSION_CONTENT = "submission_content"
+ENDPOINT_WARC_ASSET = "warc_asset"
+
+# connecting should always be quick, but the listings and submission pages can take a while
+# for the site to render, and the thumbnails come from the cdn
+ENDPOINT_TIMEOUTS = {
+    ENDPOINT_USER_PROFILE: httpx.Timeout(15.0, connect=10.0),
+    ENDPOINT_LISTING: httpx.Timeout(30.0, connect=10.0),
+    ENDPOINT_FOLDER_HTML: httpx.Timeout(30.0, connect=10.0),
+    ENDPOINT_THUMBNAIL: httpx.Timeout(60.0, connect=10.0),
+    ENDPOINT_SUBMISSION_HTML: httpx.Timeout(60.0, connect=10.0),
+    # these can be big, but the timeout is for each read, not the whole download
+    ENDPOINT_SUBMISSION_CONTENT: httpx.Timeout(120.0, connect=10.0),
+    ENDPOINT_WARC_ASSET: httpx.Timeout(60.0, connect=10.0)}
+
+# how much of a response body is read at a time when streaming it to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# status codes that are worth trying again, anything else that isn't a 2xx won't get better by retrying
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class FetchFailedError(Exception):
+    '''
+    raised when a request couldn't be completed, either because it failed with something that won't
+    get better by retrying, or because it ran out of attempts
+    '''
+
+    def __init__(self, url:str, endpoint:str, attempts:int, status_code:int|None, reason:str):
+
+        super().__init__(f"fetching `{url}` ({endpoint}) failed after `{attempts}` attempts: {reason}")
+        self.url = url
+        self.endpoint = endpoint
+        self.attempts = attempts
+        self.status_code = status_code
+        self.reason = reason
+
+
+@attr.define
+class UrlFailureStats:
+    ''' how many times requests to a url have failed, kept so we can report on it at the end of a run '''
+    url:str
+    endpoint:str
+    failed_attempts:int = 0
+    gave_up:bool = False
+    last_error:str|None = None
+
+
+class HttpFetcher:
+    '''
+    makes requests with a httpx client, retrying the ones that fail with a jittered exponential
+    backoff, or for as long as the `Retry-After` header says if there is one
+    '''
+
+    def __init__(self, max_attempts:int=5, base_delay_seconds:float=1.0, max_delay_seconds:float=60.0,
+        metrics_registry:metrics.MetricsRegistry|None=None):
+
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.metrics = metrics_registry if metrics_registry is not None else metrics.MetricsRegistry()
+
+        # url -> UrlFailureStats
+        self.failure_stats = dict()
+
+    def get_retry_delay(self, attempt:int, retry_after:str|None=None) -> float:
+        '''
+        @param attempt - the attempt that just failed, starting at 1
+        @return how many seconds to wait before trying again
+        '''
+
+        retry_after_seconds = rate_limit.parse_retry_after(retry_after)
+        if retry_after_seconds is not None:
+            return min(retry_after_seconds, self.max_delay_seconds)
+
+        # "full jitter", so that a bunch of requests that failed at the same time don't all retry at the same time
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempt - 1))))
+
+    def record_failure(self, url:str, endpoint:str, error:str, gave_up:bool=False):
+
+        if url not in self.failure_stats:
+            self.failure_stats[url] = UrlFailureStats(url, endpoint)
+
+        stats = self.failure_stats[url]
+        stats.failed_attempts += 1
+        stats.gave_up = stats.gave_up or gave_up
+        stats.last_error = error
+
+    async def fetch(self, httpx_client:httpx.AsyncClient, url:str, endpoint:str, method:str="GET", **kwargs) -> httpx.Response:
+        '''
+        make a request and return the response with its body read, which always has a 2xx status code
+
+        @param endpoint - one of the `ENDPOINT_` constants, used for the timeout and the failure stats
+        @param kwargs - passed on to `httpx.AsyncClient.stream()`
+        @raises FetchFailedError if it fails in a way that won't get better by retrying, or runs out of attempts
+        '''
+
+        async def _read_response(response:httpx.Response) -> httpx.Response:
+            await response.aread()
+            return response
+
+        return await self.fetch_with_handler(httpx_client, url, endpoint, _read_response, method, **kwargs)
+
+    async def fetch_to_file(self, httpx_client:httpx.AsyncClient, url:str, endpoint:str, destination_path:pathlib.Path,
+        writer:output_writer.OutputWriter, method:str="GET", **kwargs) -> str:
+        '''
+        stream the response body to a temporary file next to `destination_path` a chunk at a time, and rename it
+        once it is all there, so the whole thing is never in memory and an interrupted download never looks complete
+
+        @param writer - what writes the file, so the event loop doesn't wait on the disk
+        @return the sha256 hex digest of the body, computed as it is written
+        '''
+
+        return await self.fetch_with_handler(httpx_client, url, endpoint,
+            lambda response: stream_response_to_file(response, destination_path, writer), method, **kwargs)
+
+    async def fetch_to_directory(self, httpx_client:httpx.AsyncClient, url:str, endpoint:str, destination_dir:pathlib.Path,
+        fallback_stem:str, writer:output_writer.OutputWriter, method:str="GET", **kwargs) -> tuple[pathlib.Path, str]:
+        '''
+        like `fetch_to_file()`, but the file is named after what the response says it is, see `get_response_filename()`
+
+        @return a tuple of (the path it was written to, the sha256 hex digest of the body)
+        '''
+
+        async def _stream_to_named_file(response:httpx.Response) -> tuple[pathlib.Path, str]:
+            destination_path = destination_dir / get_response_filename(response, fallback_stem)
+            return (destination_path, await stream_response_to_file(response, destination_path, writer))
+
+        return await self.fetch_with_handler(httpx_client, url, endpoint, _stream_to_named_file, method, **kwargs)
+
+    async def fetch_with_handler(self, httpx_client:httpx.AsyncClient, url:str, endpoint:str, response_handler,
+        method:str="GET", handle_redirects:bool=False, **kwargs):
+        '''
+        make a streaming request, and once there is a response with a 2xx status code, return what
+        `await response_handler(response)` returns. If reading the body fails it gets retried too
+
+        @param response_handler - an async function that reads the body of the response it is given
+        @param handle_redirects - if True, redirects aren't followed and are given to the response handler instead
+        '''
+
+        kwargs.setdefault("timeout", ENDPOINT_TIMEOUTS[endpoint])
+        kwargs["extensions"] = dict(kwargs.get("extensions") or dict(), **{rate_limit.ENDPOINT_EXTENSION: endpoint})
+        if handle_redirects:
+            kwargs["follow_redirects"] = False
+
+        for attempt in range(1, self.max_attempts + 1):
+
+            retry_after = None
+            status_code = None
+            start_time = time.monotonic()
+            try:
+                async with httpx_client.stream(method, url, **kwargs) as response:
+                    status_code = response.status_code
+
+                    if response.is_success or (handle_redirects and response.is_redirect):
+                        result = await response_handler(response)
+                        self.record_response_metrics(endpoint, status_code, start_time, response.num_bytes_downloaded)
+                        if url in self.failure_stats:
+                            # it worked in the end, so it only counts as given up on if it fails again
+                            self.failure_stats[url].gave_up = False
+                        return result
+
+                self.record_response_metrics(endpoint, status_code, start_time, response.num_bytes_downloaded)
+                error = f"status code `{status_code}`"
+                retry_after = response.headers.get("Retry-After")
+
+                if status_code not in RETRYABLE_STATUS_CODES:
+                    self.record_failure(url, endpoint, error, gave_up=True)
+                    raise FetchFailedError(url, endpoint, attempt, status_code, error)
+
+            except httpx.TransportError as e:
+                self.record_response_metrics(endpoint, type(e).__name__, start_time, 0)
+                error = f"{type(e).__name__}: {e}"
+
+            if attempt == self.max_attempts:
+                self.record_failure(url, endpoint, error, gave_up=True)
+                raise FetchFailedError(url, endpoint, attempt, status_code, error)
+
+            self.record_failure(url, endpoint, error)
+            self.metrics.increment(metrics.HTTP_RETRIES, endpoint=endpoint)
+            delay = self.get_retry_delay(attempt, retry_after)
+            logger.warning("fetching `%s` failed on attempt `%s` of `%s` with %s, retrying in `%.1f` seconds",
+                url, attempt, self.max_attempts, error, delay)
+            await asyncio.sleep(delay)
+
+    def record_response_metrics(self, endpoint:str, status:int|str, start_time:float, downloaded_bytes:int):
+        '''
+        @param status - the status code, or the name of the exception if there wasn't a response
+        '''
+
+        self.metrics.observe(metrics.HTTP_REQUEST_SECONDS, time.monotonic() - start_time, endpoint=endpoint)
+        self.metrics.increment(metrics.HTTP_RESPONSES, endpoint=endpoint, status=status)
+        if downloaded_bytes:
+            self.metrics.increment(metrics.HTTP_DOWNLOADED_BYTES, downloaded_bytes, endpoint=endpoint)
+
+    def log_failure_summary(self, max_urls:int=20):
+        '''
+        log the urls that had the most failed attempts
+        '''
+
+        if not self.failure_stats:
+            return
+
+        gave_up_count = sum(1 for iter_stats in self.failure_stats.values() if iter_stats.gave_up)
+        logger.info("`%s` urls had failed requests, `%s` of them were given up on", len(self.failure_stats), gave_up_count)
+
+        worst_stats = sorted(self.failure_stats.values(), key=lambda x: x.failed_attempts, reverse=True)
+        for iter_stats in worst_stats[:max_urls]:
+            logger.info("`%s` (%s): `%s` failed attempts, gave up: `%s`, last error: %s",
+                iter_stats.url, iter_stats.endpoint, iter_stats.failed_attempts, iter_stats.gave_up, iter_stats.last_error)
+
+
+def get_response_filename(response:httpx.Response, fallback_stem:str) -> str:
+    '''
+    a safe file name for the body of a response, from the `filename` in its `Content-Disposition`, or `fallback_stem`
+    with an extension that goes with its `Content-Type`
+    '''
+
+    filename = None
+    for iter_param in response.headers.get("content-disposition", "").split(";")[1:]:
+        name, _, value = iter_param.strip().partition("=")
+        if name.lower() == "filename" and value.strip('" '):
+            filename = pathlib.PurePosixPath(value.strip('" ').replace("\\", "/")).name
+
+    if filename:
+        stem, _, extension = filename.rpartition(".")
+        safe_extension = utils.make_safe_filename(extension).lower()
+        if stem and safe_extension:
+            return f"{utils.make_safe_filename(stem) or fallback_stem}.{safe_extension}"
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    return fallback_stem + (mimetypes.guess_extension(content_type) or ".bin")
+
+
+async def stream_response_to_file(response:httpx.Response, destination_path:pathlib.Path, writer:output_writer.OutputWriter) -> str:
+    '''
+    write the body of a streamed response to `destination_path` atomically, see `HttpFetcher.fetch_to_file()`
+
+    @return the sha256 hex digest of the body
+    '''
+
+    body_hash = hashlib.sha256()
+
+    async def _hashed_chunks():
+        async for iter_chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+            body_hash.update(iter_chunk)
+            yield iter_chunk
+
+    await writer.write_stream(destination_path, _hashed_chunks())
+    return body_hash.hexdigest()
@@ -1,13 +1,71 @@
 import logging
 import logging.config
 import argparse
+import importlib
 import sys
 import asyncio
-import logging_tree
-import actorio
 
-from sofurry_scrape import utils
-from sofurry_scrape.commands import single_user_scrape
+# subcommand name -> (module, class, help), the module is only imported when its subcommand is used, since
+# the commands import httpx, lxml, aio_pika and so on, which takes a while and isn't needed for `--help`
+SUBCOMMANDS = {
+    "single_user_scrape": ("sofurry_scrape.commands.single_user_scrape", "SingleUserScrape",
+        "scrape a single user"),
+    "multi_user_scrape": ("sofurry_scrape.commands.multi_user_scrape", "MultiUserScrape",
+        "scrape a list of users in one process"),
+    "amqp_producer": ("sofurry_scrape.commands.amqp_producer", "AmqpProducer",
+        "publish the submissions of a list of users to an amqp queue"),
+    "amqp_worker": ("sofurry_scrape.commands.amqp_worker", "AmqpWorker",
+        "download the submissions published to an amqp queue"),
+    "rebuild_catalog": ("sofurry_scrape.commands.rebuild_catalog", "RebuildCatalog",
+        "rebuild the catalog of an output path from the files in it"),
+    "search_catalog": ("sofurry_scrape.commands.search_catalog", "SearchCatalog",
+        "look up submissions and users in the catalog of an output path"),
+    "verify": ("sofurry_scrape.commands.verify", "Verify",
+        "check that every submission in an output path was downloaded completely"),
+}
+
+
+class _ExistingParserSubparsers:
+    '''
+    passed to a command's `create_subparser_command()` instead of the object from `add_subparsers()`,
+    so it adds its arguments to the parser that is already there for it
+    '''
+
+    def __init__(self, parser:argparse.ArgumentParser):
+        self.parser = parser
+
+    def add_parser(self, name:str, **kwargs) -> argparse.ArgumentParser:
+        return self.parser
+
+
+def create_argument_parser(subcommand_to_load:str|None=None) -> argparse.ArgumentParser:
+    '''
+    create the parser, every subcommand gets an empty parser except `subcommand_to_load`, whose module
+    is imported and gets to add its arguments
+
+    the empty ones don't have `--help` so that `parse_known_args()` leaves everything after the subcommand alone
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="utilities for scraping sofurry.com",
+        epilog="Copyright 2025-02-17 - Mark Grandi",
+        fromfile_prefix_chars='@')
+
+    parser.add_argument("--verbose",
+        action="store_true",
+        help="increase logging verbosity")
+
+    subparsers = parser.add_subparsers(dest="subcommand_name")
+    for iter_name, (iter_module_name, iter_class_name, iter_help) in SUBCOMMANDS.items():
+
+        is_loaded = iter_name == subcommand_to_load
+        subparser = subparsers.add_parser(iter_name, help=iter_help, add_help=is_loaded)
+        if is_loaded:
+            command_class = getattr(importlib.import_module(iter_module_name), iter_class_name)
+            command_class.create_subparser_command(_ExistingParserSubparsers(subparser))
+
+    return parser
+
 
 def start():
     '''
@@ -32,26 +90,18 @@ class Main():
 
         self.stop_event = asyncio.Event()
 
-        parser = argparse.ArgumentParser(
-            description="utilities for scraping sofurry.com",
-            epilog="Copyright 2025-02-17 - Mark Grandi",
-            fromfile_prefix_chars='@')
-
-        parser.add_argument("--verbose",
-            action="store_true",
-            help="increase logging verbosity")
-
-        # ScrapeUsers command
-        subparsers = parser.add_subparsers()
-        single_user_scrape.SingleUserScrape.create_subparser_command(subparsers)
-
-
+        # find out which subcommand it is first, so only that one gets imported
+        known_args, _ = create_argument_parser().parse_known_args()
+        parser = create_argument_parser(known_args.subcommand_name)
 
         try:
 
 
             parsed_args = parser.parse_args()
 
+            # imported here since it pulls in arrow and yarl, which `--help` doesn't need
+            from sofurry_scrape import utils
+
             lg_handler = logging.StreamHandler(sys.stdout)
             lg_formatter = utils.ArrowLoggingFormatter("%(asctime)s %(name)-40s %(levelname)-8s: %(message)s")
             lg_handler.setFormatter(lg_formatter)
@@ -76,7 +126,10 @@ class Main():
             root_logger.info("starting")
 
             root_logger.debug("Parsed arguments: %s", parsed_args)
-            root_logger.debug("Logger hierarchy:\n%s", logging_tree.format.build_description(node=None))
+            if root_logger.isEnabledFor(logging.DEBUG):
+                # this goes through every logger, so only do it if it is going to be logged
+                import logging_tree
+                root_logger.debug("Logger hierarchy:\n%s", logging_tree.format.build_description(node=None))
 
             # register Ctrl+C/D/whatever signal
             def _please_stop_loop_func():
@@ -0,0 +1,341 @@
+import logging
+import asyncio
+import bisect
+import datetime
+import json
+import pathlib
+import time
+
+import arrow
+
+logger = logging.getLogger(__name__)
+
+# prepended to every metric name on the prometheus endpoint
+PROMETHEUS_PREFIX = "sofurry_scrape_"
+
+# histograms
+HTTP_REQUEST_SECONDS = "http_request_seconds"
+WGET_SECONDS = "wget_seconds"
+SUBMISSION_STAGE_SECONDS = "submission_stage_seconds"
+OUTPUT_WRITE_SECONDS = "output_write_seconds"
+
+# counters
+HTTP_RESPONSES = "http_responses_total"
+HTTP_RETRIES = "http_retries_total"
+HTTP_DOWNLOADED_BYTES = "http_downloaded_bytes_total"
+WGET_EXITS = "wget_exits_total"
+WGET_RETRIES = "wget_retries_total"
+WARC_BYTES = "warc_bytes_total"
+LISTING_PAGES = "listing_pages_total"
+SUBMISSIONS_DISCOVERED = "submissions_discovered_total"
+# how many of the submissions found so far have to go through a stage, not every kind of submission goes through all of them
+SUBMISSION_STAGE_EXPECTED = "submission_stage_expected_total"
+SUBMISSION_STAGE_COMPLETIONS = "submission_stage_completed_total"
+SUBMISSION_STAGE_FAILURES = "submission_stage_failed_total"
+
+# gauges
+SUBMISSIONS_WAITING = "submissions_waiting"
+SUBMISSIONS_IN_PROGRESS = "submissions_in_progress"
+SUBMISSIONS_DEFERRED = "submissions_deferred"
+WGET_PROCESSES_WAITING = "wget_processes_waiting"
+WGET_PROCESSES_RUNNING = "wget_processes_running"
+PIPELINE_QUEUE_DEPTH = "pipeline_queue_depth"
+OUTPUT_WRITES_PENDING = "output_writes_pending"
+
+# in seconds, requests are usually well under a second but wget-at can take minutes
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _get_labels_key(labels:dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_prometheus_labels(labels_key:tuple, extra_labels:tuple=()) -> str:
+
+    all_labels = labels_key + extra_labels
+    if not all_labels:
+        return ""
+
+    # prometheus label values are quoted, with backslashes, quotes and newlines escaped
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in all_labels)
+    return "{" + ",".join(f"{k}=\"{v}\"" for (k, _), v in zip(all_labels, escaped)) + "}"
+
+
+def _format_labels_for_json(name:str, labels_key:tuple) -> str:
+
+    if not labels_key:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels_key) + "}"
+
+
+class Histogram:
+    '''
+    counts observations into fixed buckets, like a prometheus histogram, so it takes the same amount of
+    memory no matter how many observations there are
+    '''
+
+    def __init__(self, buckets:tuple=DEFAULT_BUCKETS):
+
+        self.buckets = buckets
+        # the last one is for everything bigger than the biggest bucket
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value:float):
+
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, quantile:float) -> float:
+        '''
+        @return the upper bound of the bucket the quantile falls in, or the biggest bucket if it is past that
+        '''
+
+        target = quantile * self.count
+        running_count = 0
+        for iter_bound, iter_count in zip(self.buckets, self.bucket_counts):
+            running_count += iter_count
+            if running_count >= target:
+                return iter_bound
+        return self.buckets[-1]
+
+    def get_cumulative_counts(self) -> list[int]:
+
+        cumulative_counts = list()
+        running_count = 0
+        for iter_count in self.bucket_counts:
+            running_count += iter_count
+            cumulative_counts.append(running_count)
+        return cumulative_counts
+
+    def to_dict(self) -> dict:
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.get_quantile(0.5) if self.count else None,
+            "p95": self.get_quantile(0.95) if self.count else None,
+            "buckets": dict(zip([str(x) for x in self.buckets] + ["+Inf"], self.get_cumulative_counts()))}
+
+
+class MetricsRegistry:
+    '''
+    holds the counters, gauges and histograms for a run, each one is identified by its name and its labels,
+    like `http_responses_total` with `endpoint=listing, status=200`
+
+    everything that uses it runs on the event loop, so there is no locking
+    '''
+
+    def __init__(self):
+
+        self.start_time = time.monotonic()
+
+        # name -> labels key -> value
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+
+        # name -> labels key -> function that returns the value, for things like queue sizes that
+        # are easier to look at when we need them than to keep up to date
+        self.gauge_functions = dict()
+
+    def increment(self, name:str, amount:float=1, **labels):
+
+        values = self.counters.setdefault(name, dict())
+        labels_key = _get_labels_key(labels)
+        values[labels_key] = values.get(labels_key, 0) + amount
+
+    def add_to_gauge(self, name:str, amount:float, **labels):
+
+        values = self.gauges.setdefault(name, dict())
+        labels_key = _get_labels_key(labels)
+        values[labels_key] = values.get(labels_key, 0) + amount
+
+    def set_gauge_function(self, name:str, function, **labels):
+
+        self.gauge_functions.setdefault(name, dict())[_get_labels_key(labels)] = function
+
+    def observe(self, name:str, value:float, **labels):
+
+        values = self.histograms.setdefault(name, dict())
+        labels_key = _get_labels_key(labels)
+        if labels_key not in values:
+            values[labels_key] = Histogram()
+        values[labels_key].observe(value)
+
+    def get_counter(self, name:str, **labels) -> float:
+        '''
+        @return the sum of the counter for every set of labels that has the given labels in it
+        '''
+
+        wanted_labels = set(labels.items())
+        return sum(v for k, v in self.counters.get(name, dict()).items() if wanted_labels.issubset(k))
+
+    def get_elapsed_seconds(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def _get_gauge_values(self) -> dict:
+
+        gauge_values = {k: dict(v) for k, v in self.gauges.items()}
+        for iter_name, iter_functions in self.gauge_functions.items():
+            for iter_labels_key, iter_function in iter_functions.items():
+                gauge_values.setdefault(iter_name, dict())[iter_labels_key] = iter_function()
+        return gauge_values
+
+    def get_snapshot(self) -> dict:
+        '''
+        @return every metric as something that can be turned into json, the keys look like `name{label=value}`
+        '''
+
+        return {
+            "time": arrow.utcnow().isoformat(),
+            "elapsed_seconds": self.get_elapsed_seconds(),
+            "counters": {_format_labels_for_json(name, k): v
+                for name, values in self.counters.items() for k, v in values.items()},
+            "gauges": {_format_labels_for_json(name, k): v
+                for name, values in self._get_gauge_values().items() for k, v in values.items()},
+            "histograms": {_format_labels_for_json(name, k): v.to_dict()
+                for name, values in self.histograms.items() for k, v in values.items()}}
+
+    def format_prometheus(self) -> str:
+        '''
+        @return every metric in the prometheus text exposition format
+        '''
+
+        lines = list()
+
+        for iter_name, iter_values in self.counters.items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{iter_name} counter")
+            for iter_labels_key, iter_value in iter_values.items():
+                lines.append(f"{PROMETHEUS_PREFIX}{iter_name}{_format_prometheus_labels(iter_labels_key)} {iter_value}")
+
+        for iter_name, iter_values in self._get_gauge_values().items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{iter_name} gauge")
+            for iter_labels_key, iter_value in iter_values.items():
+                lines.append(f"{PROMETHEUS_PREFIX}{iter_name}{_format_prometheus_labels(iter_labels_key)} {iter_value}")
+
+        for iter_name, iter_values in self.histograms.items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{iter_name} histogram")
+            for iter_labels_key, iter_histogram in iter_values.items():
+                bounds = [str(x) for x in iter_histogram.buckets] + ["+Inf"]
+                for iter_bound, iter_count in zip(bounds, iter_histogram.get_cumulative_counts()):
+                    labels = _format_prometheus_labels(iter_labels_key, (("le", iter_bound),))
+                    lines.append(f"{PROMETHEUS_PREFIX}{iter_name}_bucket{labels} {iter_count}")
+                labels = _format_prometheus_labels(iter_labels_key)
+                lines.append(f"{PROMETHEUS_PREFIX}{iter_name}_sum{labels} {iter_histogram.sum}")
+                lines.append(f"{PROMETHEUS_PREFIX}{iter_name}_count{labels} {iter_histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def get_progress(metrics_registry:MetricsRegistry, stage_names:list[str]) -> dict:
+    '''
+    figure out how far along the scrape is. A submission is only done once it has been through every stage it
+    goes through, so the progress is that of the stage with the most submissions left. Each stage is counted
+    against the submissions that go through it (`SUBMISSION_STAGE_EXPECTED`), stories and journals never go
+    through the content stage for example
+
+    the listings are gone through while the submissions are downloaded, so the total only counts the
+    submissions found so far, and the eta is for those
+    '''
+
+    elapsed_seconds = metrics_registry.get_elapsed_seconds()
+    stage_completions = {iter_stage: metrics_registry.get_counter(SUBMISSION_STAGE_COMPLETIONS, stage=iter_stage)
+        for iter_stage in stage_names}
+    stages_left = [max(0, metrics_registry.get_counter(SUBMISSION_STAGE_EXPECTED, stage=iter_stage) - stage_completions[iter_stage])
+        for iter_stage in stage_names]
+
+    discovered_count = metrics_registry.get_counter(SUBMISSIONS_DISCOVERED)
+    done_count = max(0, discovered_count - max(stages_left, default=0))
+    submissions_per_second = done_count / elapsed_seconds if elapsed_seconds else 0.0
+
+    eta_seconds = None
+    if submissions_per_second and discovered_count >= done_count:
+        eta_seconds = (discovered_count - done_count) / submissions_per_second
+
+    return {
+        "discovered": discovered_count,
+        "done": done_count,
+        "submissions_per_second": submissions_per_second,
+        "eta_seconds": eta_seconds,
+        "stage_completions": stage_completions}
+
+
+def format_progress(progress:dict) -> str:
+
+    eta = str(datetime.timedelta(seconds=int(progress["eta_seconds"]))) if progress["eta_seconds"] is not None else "unknown"
+    stages = ", ".join(f"{k} {v:.0f}" for k, v in progress["stage_completions"].items())
+    return (f"progress: `{progress['done']:.0f}` of the `{progress['discovered']:.0f}` submissions found so far are done, " +
+        f"`{progress['submissions_per_second']:.2f}`/s, eta `{eta}`, stages done: {stages}")
+
+
+class MetricsReporter:
+    '''
+    while it is entered, logs the progress every `interval_seconds`, and optionally appends a snapshot of
+    every metric to a json lines file at the same time, and serves them in the prometheus text format
+    on a port on localhost
+    '''
+
+    def __init__(self, metrics_registry:MetricsRegistry, stage_names:list[str], interval_seconds:float,
+        metrics_file:pathlib.Path|None=None, prometheus_port:int|None=None):
+
+        self.metrics_registry = metrics_registry
+        self.stage_names = stage_names
+        self.interval_seconds = interval_seconds
+        self.metrics_file = metrics_file
+        self.prometheus_port = prometheus_port
+
+        self.report_task = None
+        self.prometheus_server = None
+
+    def report(self):
+
+        progress = get_progress(self.metrics_registry, self.stage_names)
+        logger.info("%s", format_progress(progress))
+
+        if self.metrics_file:
+            snapshot = self.metrics_registry.get_snapshot()
+            snapshot["progress"] = progress
+            with open(self.metrics_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+    async def _report_periodically(self):
+
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            self.report()
+
+    async def _handle_prometheus_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+
+        # whatever the path is, the metrics are what you get
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.metrics_registry.format_prometheus().encode("utf-8")
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n" +
+                f"Content-Length: {len(body)}\r\n\r\n".encode("utf-8") + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+            logger.debug("metrics request failed: `%s`", e)
+        finally:
+            writer.close()
+
+    async def __aenter__(self):
+
+        if self.prometheus_port is not None:
+            self.prometheus_server = await asyncio.start_server(self._handle_prometheus_connection, "127.0.0.1", self.prometheus_port)
+            logger.info("serving metrics on `http://127.0.0.1:%s/metrics`", self.prometheus_port)
+
+        self.report_task = asyncio.create_task(self._report_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+
+        self.report_task.cancel()
+        if self.prometheus_server:
+            self.prometheus_server.close()
+            await self.prometheus_server.wait_closed()
+
+        # so the file always ends with how the run ended
+        self.report()
@@ -0,0 +1,224 @@
+import logging
+import asyncio
+import concurrent.futures
+import os
+import pathlib
+import time
+
+import attr
+
+from sofurry_scrape import utils
+from sofurry_scrape import metrics
+
+logger = logging.getLogger(__name__)
+
+# `--fsync` choices: every file is synced before it is renamed into place, nothing is synced until the writer
+# is closed and then everything is at once, or it is left to the operating system
+FSYNC_ALWAYS = "always"
+FSYNC_ON_CLOSE = "on-close"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = [FSYNC_ALWAYS, FSYNC_ON_CLOSE, FSYNC_NEVER]
+
+DEFAULT_WRITER_THREADS = 4
+
+# a streamed download is written once this much of it has come in, instead of for every chunk
+STREAM_WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+@attr.define
+class ChecksumBatch:
+    ''' the changes to one `sha256sums.txt` that are waiting to be written together, see `OutputWriter.record_checksum()` '''
+    # file path -> sha256 hex digest, or None to take its line out
+    updates:dict
+    # done when the changes are on disk
+    written:asyncio.Future
+
+
+class OutputWriter:
+    '''
+    everything a scrape writes to the output path goes through here, so a slow disk (like a network mount) only
+    slows down the writes and not every request that is in flight on the event loop. The writes run on a thread pool
+    of their own, so they can't take up the threads `asyncio.to_thread()` uses for parsing
+
+    some writes don't go through this:
+    - the state database and the catalog, sqlite connections stay on the thread that opened them. Each write is one
+      small transaction appended to the write ahead log, so they still block the event loop for a moment each
+    - wget-at, which writes its warc itself in another process
+    - the temporary folders, which go in the system's temporary folder and not the output path
+    - the session cookie files, see `sofurry_session.SessionCookieManager`, which write them with `asyncio.to_thread()`
+    '''
+
+    def __init__(self, max_workers:int=DEFAULT_WRITER_THREADS, fsync_policy:str=FSYNC_ALWAYS,
+        metrics_registry:metrics.MetricsRegistry|None=None):
+
+        if fsync_policy not in FSYNC_POLICIES:
+            raise Exception(f"unknown fsync policy `{fsync_policy}`, it has to be one of `{FSYNC_POLICIES}`")
+
+        self.max_workers = max_workers
+        self.fsync_policy = fsync_policy
+        self.metrics = metrics_registry if metrics_registry is not None else metrics.MetricsRegistry()
+        self.executor = None
+
+        self.pending_count = 0
+        self.metrics.set_gauge_function(metrics.OUTPUT_WRITES_PENDING, lambda: self.pending_count)
+
+        # checksums path -> ChecksumBatch that hasn't started being written yet
+        self.checksum_batches = dict()
+        # checksums path -> lock, so two batches for the same file are never written at the same time
+        self.checksum_locks = dict()
+        # the tasks writing the batches, kept so they don't get garbage collected
+        self.checksum_tasks = set()
+
+    @property
+    def fsync_each_file(self) -> bool:
+        return self.fsync_policy == FSYNC_ALWAYS
+
+    def open(self):
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="output_writer")
+
+    def close(self):
+        '''
+        wait for every write that was started to finish
+        '''
+
+        if self.executor is None:
+            return
+
+        self.executor.shutdown(wait=True)
+        self.executor = None
+
+        if self.fsync_policy == FSYNC_ON_CLOSE:
+            logger.info("syncing everything that was written to disk")
+            os.sync()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def run(self, function, *args, operation:str|None=None):
+        '''
+        call `function(*args)` on one of the writer threads
+
+        @param operation - what to call it in the `output_write_seconds` metric, defaults to the name of the function
+        '''
+
+        start_time = time.monotonic()
+        self.pending_count += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending_count -= 1
+            self.metrics.observe(metrics.OUTPUT_WRITE_SECONDS, time.monotonic() - start_time,
+                operation=operation or function.__name__)
+
+    async def mkdir(self, path:pathlib.Path):
+        ''' create a folder and the ones it is in, if they aren't there already '''
+        await self.run(lambda: path.mkdir(parents=True, exist_ok=True), operation="mkdir")
+
+    async def unlink(self, path:pathlib.Path):
+        await self.run(lambda: path.unlink(missing_ok=True), operation="unlink")
+
+    async def write_file(self, path:pathlib.Path, data:bytes):
+        ''' write a whole file atomically, see `utils.write_file_atomically()` '''
+        await self.run(lambda: utils.write_file_atomically(path, data, fsync=self.fsync_each_file), operation="write_file")
+
+    async def write_stream(self, path:pathlib.Path, chunks) -> int:
+        '''
+        write the chunks from an async iterator to `path` atomically, a `STREAM_WRITE_BUFFER_SIZE` at a time, so a
+        big download is never all in memory and the writer threads aren't asked to write every little chunk
+
+        @return how many bytes were written
+        '''
+
+        partial_path = utils.get_partial_file_path(path)
+        f = await self.run(open, partial_path, "wb", operation="open")
+        size = 0
+        try:
+            buffered_chunks = list()
+            buffered_size = 0
+            async for iter_chunk in chunks:
+                buffered_chunks.append(iter_chunk)
+                buffered_size += len(iter_chunk)
+                if buffered_size >= STREAM_WRITE_BUFFER_SIZE:
+                    await self.run(f.writelines, buffered_chunks, operation="write_stream")
+                    size += buffered_size
+                    buffered_chunks = list()
+                    buffered_size = 0
+
+            if buffered_chunks:
+                await self.run(f.writelines, buffered_chunks, operation="write_stream")
+                size += buffered_size
+
+            await self.run(self._finish_stream, f, partial_path, path, operation="finish_stream")
+
+        except BaseException:
+            # done right here instead of on a writer thread, since we might be getting cancelled
+            f.close()
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        return size
+
+    def _finish_stream(self, f, partial_path:pathlib.Path, path:pathlib.Path):
+
+        f.flush()
+        if self.fsync_each_file:
+            os.fsync(f.fileno())
+        f.close()
+        os.replace(partial_path, path)
+
+    async def record_checksum(self, checksums_path:pathlib.Path, file_path:pathlib.Path, sha256_hex:str,
+        removed_paths:list[pathlib.Path]|None=None):
+        '''
+        add or replace the line for `file_path` in a `sha256sum` style file, see `utils.update_checksums()`. The stages
+        of a submission all write to the same `sha256sums.txt`, so the changes that come in while it is being written
+        are saved up and written together after, instead of each one reading and writing the whole file
+
+        @param removed_paths - files that aren't there anymore, their lines are taken out
+        '''
+
+        batch = self.checksum_batches.get(checksums_path)
+        if batch is None:
+            batch = ChecksumBatch(updates=dict(), written=asyncio.get_running_loop().create_future())
+            self.checksum_batches[checksums_path] = batch
+            task = asyncio.create_task(self._write_checksum_batch(checksums_path, batch))
+            self.checksum_tasks.add(task)
+            task.add_done_callback(self.checksum_tasks.discard)
+
+        for iter_path in removed_paths or list():
+            batch.updates[iter_path] = None
+        batch.updates[file_path] = sha256_hex
+
+        # shielded so one of the callers waiting on it being cancelled doesn't cancel it for the others
+        await asyncio.shield(batch.written)
+
+    async def _write_checksum_batch(self, checksums_path:pathlib.Path, batch:ChecksumBatch):
+
+        lock = self.checksum_locks.setdefault(checksums_path, asyncio.Lock())
+        try:
+            async with lock:
+                # anything recorded after this goes in the next batch
+                self.checksum_batches.pop(checksums_path, None)
+                await self.run(utils.update_checksums, checksums_path, batch.updates, self.fsync_each_file,
+                    operation="record_checksum")
+            batch.written.set_result(None)
+
+        except asyncio.CancelledError:
+            batch.written.cancel()
+            raise
+
+        except Exception as e:
+            batch.written.set_exception(e)
+            # the callers get it, so it doesn't need to be logged as never retrieved
+            batch.written.exception()
+
+        finally:
+            if self.checksum_batches.get(checksums_path) is batch:
+                self.checksum_batches.pop(checksums_path)
+            # no batch is waiting for the lock, so it can go
+            if checksums_path not in self.checksum_batches and not lock.locked():
+                self.checksum_locks.pop(checksums_path, None)
@@ -0,0 +1,97 @@
+import logging
+import asyncio
+import collections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH_PAGES = 4
+
+
+async def probe_page_count(fetch_page, first_page:list, get_item_id=lambda x: x) -> tuple[int, dict[int, list]]:
+    '''
+    find the last page of a listing that doesn't say how many pages it has. Asking for a page past the last one gives
+    page 1 again, so a page is real if it has something on it that page 1 doesn't. This asks for pages 2, 4, 8 and so
+    on until one of them isn't real, then bisects between that one and the last real one, so it takes about
+    2 * log2(pages) requests instead of going through every page. A real page with less on it than page 1 is probably
+    the last one, so the page after it is asked for next, which keeps listings with just a few pages as cheap as
+    going through them one at a time
+
+    @param fetch_page - an async function that takes a page number and returns the items on that page
+    @param first_page - the items on page 1
+    @param get_item_id - gets the id of an item, to compare them with the ones on page 1
+    @return a tuple of (how many pages there are, page number -> items for the pages that were fetched along the way,
+    so they don't have to be fetched again)
+    '''
+
+    first_page_ids = set(get_item_id(x) for x in first_page)
+    fetched_pages = dict()
+
+    async def _is_real_page(page_number:int) -> bool:
+        page = await fetch_page(page_number)
+        fetched_pages[page_number] = page
+        # if something new got posted while we were probing, the wrapped around page 1 won't be exactly the same
+        # as ours, but it will still have nothing on it that ours doesn't
+        return any(get_item_id(x) not in first_page_ids for x in page)
+
+    last_real_page = 1
+    probe_page = 2
+    while await _is_real_page(probe_page):
+        last_real_page = probe_page
+        probe_page = probe_page + 1 if len(fetched_pages[probe_page]) < len(first_page) else probe_page * 2
+
+    while probe_page - last_real_page > 1:
+        middle_page = (last_real_page + probe_page) // 2
+        if await _is_real_page(middle_page):
+            last_real_page = middle_page
+        else:
+            probe_page = middle_page
+
+    logger.debug("probed `%s` pages to find that there are `%s`", len(fetched_pages), last_real_page)
+
+    # the pages past the end are just page 1 again, they aren't worth keeping
+    return (last_real_page, {k: v for k, v in fetched_pages.items() if k <= last_real_page})
+
+
+async def iter_pages(fetch_page, page_numbers, prefetch:int, fetched_pages:dict[int, list]|None=None):
+    '''
+    an async generator of (page number, items) for each of `page_numbers` in order, the next `prefetch` pages are
+    fetched at the same time in the background while the caller works on the current one. Use it with
+    `contextlib.aclosing()` so the pages being prefetched are cancelled if the caller stops early
+
+    @param fetch_page - an async function that takes a page number and returns the items on that page
+    @param fetched_pages - pages that were already fetched, like the ones from `probe_page_count()`
+    '''
+
+    fetched_pages = fetched_pages or dict()
+    page_number_iterator = iter(page_numbers)
+    # (page number, the items or the task fetching them), in order
+    pending = collections.deque()
+
+    def _fill_pending(page_count:int):
+        while len(pending) < page_count:
+            page_number = next(page_number_iterator, None)
+            if page_number is None:
+                return
+            if page_number in fetched_pages:
+                pending.append((page_number, fetched_pages[page_number]))
+            else:
+                pending.append((page_number, asyncio.create_task(fetch_page(page_number))))
+
+    try:
+        while True:
+            _fill_pending(1)
+            if not pending:
+                break
+            page_number, page = pending.popleft()
+            # the pages after this one are fetched while it is being waited for and worked on
+            _fill_pending(prefetch)
+            if isinstance(page, asyncio.Task):
+                page = await page
+            yield (page_number, page)
+
+    finally:
+        tasks = [x for _, x in pending if isinstance(x, asyncio.Task)]
+        for iter_task in tasks:
+            iter_task.cancel()
+        # so a prefetch that failed doesn't get logged as an exception that was never retrieved
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,238 @@
+import logging
+import asyncio
+import time
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.define
+class StageCounters:
+    received:int = 0
+    completed:int = 0
+    failed:int = 0
+    skipped:int = 0
+    deferred:int = 0
+    busy_seconds:float = 0.0
+
+
+class WorkTracker:
+    '''
+    counts the items that were put into a pipeline for something (like a user) and haven't been through their stage
+    yet. The items a stage's handler puts into the next stages while it is handling one are counted before that one
+    is done, so this only gets to zero once everything that came from the items is done
+
+    @param on_done - if given, it is called with the tracker every time the count gets to zero
+    '''
+
+    def __init__(self, on_done=None):
+
+        self.on_done = on_done
+        self.pending_count = 0
+        # how many items weren't handled, because the pipeline was told to stop or their stage failed and deferred them
+        self.skipped_count = 0
+        self.done_event = asyncio.Event()
+        self.done_event.set()
+
+    def add(self):
+
+        self.pending_count += 1
+        self.done_event.clear()
+
+    def finish(self, skipped:bool=False):
+
+        self.pending_count -= 1
+        if skipped:
+            self.skipped_count += 1
+
+        if self.pending_count == 0:
+            self.done_event.set()
+            if self.on_done:
+                self.on_done(self)
+
+    async def wait(self):
+        ''' wait until every item that was added is done '''
+        await self.done_event.wait()
+
+
+class PipelineStage:
+    '''
+    a single stage of a `Pipeline`, it has its own bounded mailbox and a fixed number of workers
+    that take items out of it and call the handler on them
+
+    putting an item in a full mailbox waits until there is room, so a slow stage slows down
+    the stages that feed it instead of letting the items pile up in memory
+    '''
+
+    def __init__(self, name:str, handler, concurrency:int, mailbox_size:int, on_failure=None):
+        '''
+        @param on_failure - if given, it is called with the item and the exception when the handler fails, and
+        the item is counted as deferred instead of failed, so it can be tried again later
+        '''
+
+        self.name = name
+        self.handler = handler
+        self.on_failure = on_failure
+        self.concurrency = concurrency
+        self.mailbox = asyncio.Queue(maxsize=mailbox_size)
+        self.counters = StageCounters()
+        self.worker_tasks = list()
+
+    async def put(self, item, trackers=()):
+
+        self.counters.received += 1
+        for iter_tracker in trackers:
+            iter_tracker.add()
+
+        try:
+            await self.mailbox.put((item, trackers))
+        except BaseException:
+            # it never made it into the mailbox
+            self.counters.received -= 1
+            for iter_tracker in trackers:
+                iter_tracker.finish(skipped=True)
+            raise
+
+    def start(self, stop_event:asyncio.Event):
+
+        for i in range(self.concurrency):
+            self.worker_tasks.append(asyncio.create_task(self._worker(stop_event), name=f"{self.name}-{i}"))
+
+    async def stop(self):
+
+        for iter_task in self.worker_tasks:
+            iter_task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks.clear()
+
+    async def _worker(self, stop_event:asyncio.Event):
+
+        while True:
+            item, trackers = await self.mailbox.get()
+            # still take items out once we are told to stop so anything waiting on `join()` finishes
+            skipped = stop_event.is_set()
+            try:
+                if skipped:
+                    self.counters.skipped += 1
+                else:
+                    # a deferred item only gets tried again later, so whatever counts it isn't really done with it
+                    skipped = not await self._handle(item)
+            finally:
+                self.mailbox.task_done()
+
+            # not in the `finally`, if we got cancelled the item never got handled
+            for iter_tracker in trackers:
+                iter_tracker.finish(skipped=skipped)
+
+    async def _handle(self, item) -> bool:
+        '''
+        @return False if the handler failed and the item was deferred
+        '''
+
+        start_time = time.monotonic()
+        try:
+            await self.handler(item)
+            self.counters.completed += 1
+        except Exception as e:
+            if self.on_failure:
+                logger.warning("stage `%s` failed to handle `%s`, deferring it: `%s`", self.name, item, e)
+                self.on_failure(item, e)
+                self.counters.deferred += 1
+                return False
+            else:
+                logger.exception("stage `%s` failed to handle `%s`", self.name, item)
+                self.counters.failed += 1
+        finally:
+            self.counters.busy_seconds += time.monotonic() - start_time
+        return True
+
+    def get_unfinished_count(self) -> int:
+        ''' how many items were put into the stage (or are waiting to be) that it isn't done with '''
+
+        counters = self.counters
+        return counters.received - counters.completed - counters.failed - counters.deferred - counters.skipped
+
+    def get_summary(self, elapsed_seconds:float) -> str:
+
+        throughput = self.counters.completed / elapsed_seconds if elapsed_seconds else 0.0
+        average_seconds = self.counters.busy_seconds / self.counters.completed if self.counters.completed else 0.0
+        return (f"stage `{self.name}`: {self.counters.completed} done, {self.counters.failed} failed, " +
+            f"{self.counters.deferred} deferred, {self.counters.skipped} skipped, {self.mailbox.qsize()} waiting, {throughput:.2f}/s, " +
+            f"{average_seconds:.2f}s average")
+
+
+class Pipeline:
+    '''
+    a set of stages that pass items to each other, each stage runs on its own so a cheap
+    stage never waits behind a slow one unless its mailbox fills up
+
+    stages can hand items to any other stage, including ones added before them (like the warc stage
+    handing items back to the html stage with `--html-from-warc`), `drain()` waits until all of them are idle
+    '''
+
+    def __init__(self, stop_event:asyncio.Event, report_interval_seconds:int=60):
+
+        self.stop_event = stop_event
+        self.report_interval_seconds = report_interval_seconds
+        self.stages = dict()
+        self.start_time = None
+        self.report_task = None
+
+    def add_stage(self, name:str, handler, concurrency:int, mailbox_size:int, on_failure=None) -> PipelineStage:
+
+        logger.debug("adding pipeline stage `%s` with concurrency `%s` and mailbox size `%s`", name, concurrency, mailbox_size)
+        stage = PipelineStage(name, handler, concurrency, mailbox_size, on_failure)
+        self.stages[name] = stage
+        return stage
+
+    async def put(self, stage_name:str, item, trackers=()):
+        '''
+        @param trackers - `WorkTracker`s that count the item until the stage is done with it
+        '''
+        await self.stages[stage_name].put(item, trackers)
+
+    def get_failed_count(self) -> int:
+        return sum(iter_stage.counters.failed for iter_stage in self.stages.values())
+
+    async def drain(self):
+        '''
+        wait until every item put into the pipeline has gone through every stage
+        '''
+
+        # a stage can give items to one that was already joined, so go around again until a whole pass
+        # doesn't have to wait for anything. `join()` returns right away for a stage with nothing unfinished
+        while any(iter_stage.get_unfinished_count() for iter_stage in self.stages.values()):
+            for iter_stage in self.stages.values():
+                await iter_stage.mailbox.join()
+
+    def log_counters(self):
+
+        elapsed_seconds = time.monotonic() - self.start_time
+        for iter_stage in self.stages.values():
+            logger.info("%s", iter_stage.get_summary(elapsed_seconds))
+
+    async def _report_periodically(self):
+
+        while True:
+            await asyncio.sleep(self.report_interval_seconds)
+            self.log_counters()
+
+    async def __aenter__(self):
+
+        self.start_time = time.monotonic()
+        for iter_stage in self.stages.values():
+            iter_stage.start(self.stop_event)
+        self.report_task = asyncio.create_task(self._report_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+
+        try:
+            if exc_type is None:
+                await self.drain()
+        finally:
+            self.report_task.cancel()
+            for iter_stage in self.stages.values():
+                await iter_stage.stop()
+            self.log_counters()
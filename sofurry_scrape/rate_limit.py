@@ -0,0 +1,286 @@
+import logging
+import asyncio
+import contextlib
+import email.utils
+import time
+
+import httpx
+import arrow
+
+logger = logging.getLogger(__name__)
+
+# the groups of hosts that get their own limiter
+HOST_GROUP_WWW = "www.sofurry.com"
+HOST_GROUP_API = "api2.sofurry.com"
+HOST_GROUP_FILES = "sofurryfiles.com"
+HOST_GROUP_OTHER = "other"
+
+# status codes that mean the site wants us to slow down
+_BACKOFF_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# the httpx request extension `http_fetch` puts the kind of request in, see `http_fetch.ENDPOINT_TIMEOUTS`. The hosts
+# serve very different things (a listing's json is much faster than a submission's page), so the latency of each kind
+# is only compared with itself
+ENDPOINT_EXTENSION = "sofurry_endpoint"
+
+
+def get_host_group(host:str) -> str:
+    '''
+    figure out which limiter a host uses, the cdn has a few hostnames so they all share one
+    '''
+
+    host = host.lower()
+    if host == "sofurryfiles.com" or host.endswith(".sofurryfiles.com"):
+        return HOST_GROUP_FILES
+    if host == "api2.sofurry.com":
+        return HOST_GROUP_API
+    if host == "sofurry.com" or host.endswith(".sofurry.com"):
+        return HOST_GROUP_WWW
+    return HOST_GROUP_OTHER
+
+
+def parse_retry_after(retry_after:str|None) -> float|None:
+    '''
+    @return how many seconds a `Retry-After` header value says to wait, it can either be a number
+    of seconds or an http date, or None if it is missing or can't be parsed
+    '''
+
+    if not retry_after:
+        return None
+
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+
+    try:
+        retry_at = arrow.get(email.utils.parsedate_to_datetime(retry_after))
+    except (TypeError, ValueError):
+        logger.debug("couldn't parse retry after header `%s`", retry_after)
+        return None
+
+    return max(0.0, (retry_at - arrow.utcnow()).total_seconds())
+
+
+class HostRateLimiter:
+    '''
+    limits the requests to a group of hosts with a token bucket for the request rate, plus a limit on how
+    many requests can be in flight at once
+
+    both limits adapt like tcp congestion control (AIMD): every healthy response raises them a little, and a
+    429 / 5xx / connection error, or the latency of a kind of request getting much worse than the best we've seen
+    for that kind, cuts them in half.
+    The cuts happen at most once per `backoff_cooldown_seconds` so a burst of errors from requests that were
+    already in flight doesn't collapse the limits to the minimum
+    '''
+
+    def __init__(self, name:str, max_requests_per_second:float, max_concurrency:int,
+        min_requests_per_second:float=0.2, backoff_cooldown_seconds:float=5.0, latency_backoff_factor:float=3.0):
+
+        self.name = name
+        self.max_requests_per_second = max_requests_per_second
+        self.min_requests_per_second = min(min_requests_per_second, max_requests_per_second)
+        self.max_concurrency = max_concurrency
+        self.backoff_cooldown_seconds = backoff_cooldown_seconds
+        self.latency_backoff_factor = latency_backoff_factor
+
+        # start at half speed and ramp up from there
+        self.requests_per_second = max(self.min_requests_per_second, max_requests_per_second / 2)
+        self.concurrency_limit = max(1.0, max_concurrency / 2)
+
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.token_lock = asyncio.Lock()
+
+        self.in_flight = 0
+        self.concurrency_condition = asyncio.Condition()
+
+        self.paused_until = 0.0
+        self.last_backoff = 0.0
+        # endpoint -> seconds, the endpoint is None for requests that didn't say what kind they are
+        self.best_latency = dict()
+        self.average_latency = dict()
+
+    async def acquire(self):
+        '''
+        wait until there is room for another request in both the concurrency limit and the token bucket
+        '''
+
+        async with self.concurrency_condition:
+            await self.concurrency_condition.wait_for(lambda: self.in_flight < int(self.concurrency_limit))
+            self.in_flight += 1
+
+        try:
+            await self.take_token()
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self):
+
+        async with self.concurrency_condition:
+            self.in_flight -= 1
+            self.concurrency_condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    async def take_token(self):
+        '''
+        wait for the token bucket only, for something that limits how many it runs at once by itself
+        '''
+
+        # only one waiter refills and sleeps at a time, so they get served in order
+        async with self.token_lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(max(1.0, self.requests_per_second), self.tokens + (now - self.last_refill) * self.requests_per_second)
+                self.last_refill = now
+
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                await asyncio.sleep((1.0 - self.tokens) / self.requests_per_second)
+
+    def record_result(self, status_code:int|None, latency_seconds:float|None=None, retry_after:str|None=None,
+        endpoint:str|None=None):
+        '''
+        adjust the limits based on how a request went
+
+        @param status_code - the http status code, or None if the request failed without a response
+        @param latency_seconds - how long it took to get the response headers, None if it isn't meaningful
+        @param retry_after - the `Retry-After` header of the response, if it had one
+        @param endpoint - what kind of request it was, the latency is only compared with the same kind
+        '''
+
+        now = time.monotonic()
+
+        if status_code is None or status_code in _BACKOFF_STATUS_CODES:
+
+            retry_after_seconds = parse_retry_after(retry_after)
+            if retry_after_seconds:
+                logger.warning("rate limiter `%s`: told to retry after `%s` seconds, pausing", self.name, retry_after_seconds)
+                self.paused_until = max(self.paused_until, now + retry_after_seconds)
+
+            self._back_off(now, f"status code `{status_code}`")
+            return
+
+        if latency_seconds is not None:
+            best_latency = min(self.best_latency.get(endpoint, latency_seconds), latency_seconds)
+            average_latency = (0.8 * self.average_latency.get(endpoint, latency_seconds)) + (0.2 * latency_seconds)
+            self.best_latency[endpoint] = best_latency
+            self.average_latency[endpoint] = average_latency
+
+            if average_latency > max(best_latency * self.latency_backoff_factor, 0.05):
+                self._back_off(now, f"average `{endpoint}` latency `{average_latency:.2f}s` vs best `{best_latency:.2f}s`")
+                return
+
+        # additive increase, the concurrency goes up by about 1 for every `concurrency_limit` healthy responses
+        self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + (1.0 / self.concurrency_limit))
+        self.requests_per_second = min(self.max_requests_per_second,
+            self.requests_per_second + (self.max_requests_per_second / 50))
+
+    def _back_off(self, now:float, reason:str):
+
+        if now - self.last_backoff < self.backoff_cooldown_seconds:
+            return
+
+        self.last_backoff = now
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        self.requests_per_second = max(self.min_requests_per_second, self.requests_per_second / 2)
+
+        # forget the latency history so a slower site becomes the new normal instead of backing off forever
+        self.best_latency.clear()
+        self.average_latency.clear()
+
+        logger.info("rate limiter `%s`: backing off because of %s, now at `%.2f` requests per second and `%s` concurrent",
+            self.name, reason, self.requests_per_second, int(self.concurrency_limit))
+
+
+class RateLimiterRegistry:
+    '''
+    holds one `HostRateLimiter` per host group, shared by everything that makes requests to sofurry
+    '''
+
+    def __init__(self, max_requests_per_second:float, max_concurrency:int):
+
+        self.limiters = dict()
+        for iter_group in (HOST_GROUP_WWW, HOST_GROUP_API, HOST_GROUP_FILES, HOST_GROUP_OTHER):
+            self.limiters[iter_group] = HostRateLimiter(iter_group, max_requests_per_second, max_concurrency)
+
+    def get_limiter_for_host(self, host:str) -> HostRateLimiter:
+        return self.limiters[get_host_group(host)]
+
+
+class _ReleasingByteStream(httpx.AsyncByteStream):
+    '''
+    wraps a response's stream so the concurrency slot is given back once the body is read or closed
+    '''
+
+    def __init__(self, stream:httpx.AsyncByteStream, limiter:HostRateLimiter):
+        self.stream = stream
+        self.limiter = limiter
+        self.released = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                await self.limiter.release()
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    '''
+    an httpx transport that makes every request wait for its host's `HostRateLimiter` first,
+    and reports back how the request went
+    '''
+
+    def __init__(self, registry:RateLimiterRegistry, transport:httpx.AsyncBaseTransport):
+
+        self.registry = registry
+        self.transport = transport
+
+    async def handle_async_request(self, request:httpx.Request) -> httpx.Response:
+
+        limiter = self.registry.get_limiter_for_host(request.url.host)
+        await limiter.acquire()
+
+        start_time = time.monotonic()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            limiter.record_result(None)
+            await limiter.release()
+            raise
+        except BaseException:
+            # cancelled, which says nothing about how the site is doing
+            await limiter.release()
+            raise
+
+        limiter.record_result(response.status_code, time.monotonic() - start_time, response.headers.get("Retry-After"),
+            request.extensions.get(ENDPOINT_EXTENSION))
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingByteStream(response.stream, limiter),
+            extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
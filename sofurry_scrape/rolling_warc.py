@@ -0,0 +1,244 @@
+import logging
+import asyncio
+import gzip
+import io
+import json
+import os
+import pathlib
+import urllib.parse
+
+import arrow
+import attr
+
+from sofurry_scrape import utils
+from sofurry_scrape import warc_reader
+
+logger = logging.getLogger(__name__)
+
+# where the rolling warcs go, in the user's folder or the output root
+ROLLING_WARC_DIRNAME = "warcs"
+
+ROLLING_WARCS_PER_USER = "user"
+ROLLING_WARCS_PER_RUN = "run"
+
+DEFAULT_MAX_SIZE_MB = 1024
+
+# the record types that go in the cdxj index, same as pywb's indexer
+INDEXED_RECORD_TYPES = {"response", "resource", "revisit"}
+
+
+@attr.define
+class WarcLocation:
+    ''' where a submission's records are in a rolling warc, the offset and length are of whole gzip members '''
+    warc_path:pathlib.Path
+    offset:int
+    length:int
+
+
+def get_cdxj_path(warc_path:pathlib.Path) -> pathlib.Path:
+    return warc_path.with_name(warc_path.name.removesuffix(".warc.gz") + ".cdxj")
+
+
+def get_surt(url:str) -> str:
+    '''
+    the "sort-friendly uri reordering transform" of a url, which is what cdx files are sorted by, so every
+    capture of a site ends up next to each other: `https://www.sofurry.com/view/123` -> `com,sofurry)/view/123`
+    '''
+
+    parsed_url = urllib.parse.urlsplit(url)
+    host_parts = (parsed_url.hostname or "").lower().split(".")
+    if host_parts[0] == "www":
+        host_parts = host_parts[1:]
+
+    surt = ",".join(reversed(host_parts))
+    if parsed_url.port and parsed_url.port not in (80, 443):
+        surt += f":{parsed_url.port}"
+
+    surt += ")" + (parsed_url.path or "/").lower()
+    if parsed_url.query:
+        surt += "?" + "&".join(sorted(parsed_url.query.lower().split("&")))
+    return surt
+
+
+def get_cdxj_line(record:warc_reader.WarcRecord, filename:str, offset:int, length:int, submission_id:str|None) -> str:
+    '''
+    the cdxj line of a record, in the format pywb uses: `<surt> <timestamp> <json>`
+    '''
+
+    url = record.headers["warc-target-uri"].strip("<>")
+    fields = {"url": url}
+
+    if record.headers.get("content-type", "").startswith("application/http"):
+        response = warc_reader.parse_http_response_block(record.block)
+        fields["mime"] = response.headers.get("content-type", "").split(";")[0].strip() or "unk"
+        fields["status"] = str(response.status_code)
+    else:
+        fields["mime"] = record.headers.get("content-type", "unk").split(";")[0].strip()
+
+    if "warc-payload-digest" in record.headers:
+        fields["digest"] = record.headers["warc-payload-digest"]
+    fields["length"] = str(length)
+    fields["offset"] = str(offset)
+    fields["filename"] = filename
+    if submission_id is not None:
+        fields["sofurry_submission_id"] = submission_id
+
+    timestamp = arrow.get(record.headers["warc-date"]).format("YYYYMMDDHHmmss")
+    return f"{get_surt(url)} {timestamp} {json.dumps(fields)}"
+
+
+@attr.define
+class WarcMember:
+    ''' a gzip member with a single record in it, ready to be appended to a rolling warc '''
+    compressed:bytes
+    record:warc_reader.WarcRecord
+
+
+def read_warc_members(f, description:str):
+    '''
+    read a `.warc.gz` as one gzip member per record. Members that have more than one record in them are compressed
+    again one record at a time, since the index has to be able to point at each record on its own
+
+    @return a generator of `(submission id, WarcMember)` tuples, the submission id comes from the
+        `sofurry_submission_id` field of the last warcinfo record
+    '''
+
+    submission_id = None
+    for iter_compressed, iter_decompressed in warc_reader.iter_gzip_members(f):
+
+        records = list(warc_reader.read_warc_records(io.BytesIO(iter_decompressed), description))
+        for iter_record in records:
+
+            if iter_record.headers.get("warc-type") == "warcinfo":
+                submission_id = warc_reader.get_warcinfo_fields(iter_record.block).get("sofurry_submission_id", submission_id)
+
+            compressed = iter_compressed if len(records) == 1 else gzip.compress(iter_record.get_raw_record())
+            yield (submission_id, WarcMember(compressed=compressed, record=iter_record))
+
+
+def index_warc_file(warc_path:pathlib.Path, truncate_incomplete:bool=False) -> list[str]:
+    '''
+    make the cdxj lines for a warc that has one record per gzip member, by reading all of it
+
+    @param truncate_incomplete - if the warc ends in the middle of a record, like when the scrape that was writing it
+        got killed, cut off that record instead of raising
+    @return the lines, sorted
+    '''
+
+    cdxj_lines = list()
+    offset = 0
+    with open(warc_path, "rb") as f:
+        try:
+            for iter_submission_id, iter_member in read_warc_members(f, str(warc_path)):
+                if iter_member.record.headers.get("warc-type") in INDEXED_RECORD_TYPES:
+                    cdxj_lines.append(get_cdxj_line(iter_member.record, warc_path.name, offset, len(iter_member.compressed), iter_submission_id))
+                offset += len(iter_member.compressed)
+
+        except EOFError:
+            if not truncate_incomplete:
+                raise
+            logger.warning("`%s` ends in the middle of a record, cutting it off after `%s` bytes", warc_path, offset)
+            with open(warc_path, "r+b") as truncate_f:
+                truncate_f.truncate(offset)
+
+    return sorted(cdxj_lines)
+
+
+def write_cdxj_file(cdxj_path:pathlib.Path, cdxj_lines:list[str]):
+    utils.write_file_atomically(cdxj_path, "".join(f"{x}\n" for x in sorted(cdxj_lines)).encode("utf-8"))
+
+
+class RollingWarcWriter:
+    '''
+    appends the records of each submission's warc to one big warc, starting a new one once it gets to `max_size`
+    bytes, and writes a cdxj index next to each one when it is done with it. Each record is still its own gzip member,
+    so a record or a submission can be read with just its offset and length
+
+    a submission is never split between two warcs
+    '''
+
+    def __init__(self, directory:pathlib.Path, name_prefix:str, max_size:int):
+
+        self.directory = directory
+        self.name_prefix = name_prefix
+        self.max_size = max_size
+        self.started_at = arrow.utcnow().format("YYYYMMDDHHmmss")
+
+        self.file_number = 0
+        self.warc_path = None
+        self.f = None
+        self.cdxj_lines = list()
+
+        # a submission's records have to go in one after the other
+        self.lock = asyncio.Lock()
+
+    def open(self):
+        '''
+        create the directory, and index any warc that a previous run didn't get to finish
+        '''
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        for iter_warc_path in sorted(self.directory.glob("*.warc.gz")):
+            if not get_cdxj_path(iter_warc_path).exists():
+                logger.info("rolling warc `%s` doesn't have an index, a previous run must have stopped while writing it, indexing it", iter_warc_path)
+                write_cdxj_file(get_cdxj_path(iter_warc_path), index_warc_file(iter_warc_path, truncate_incomplete=True))
+
+    def close(self):
+
+        if self.f is not None:
+            self.finish_current_warc()
+
+    def finish_current_warc(self):
+
+        self.f.close()
+        write_cdxj_file(get_cdxj_path(self.warc_path), self.cdxj_lines)
+        logger.info("finished rolling warc `%s` with `%s` indexed records", self.warc_path, len(self.cdxj_lines))
+
+        self.f = None
+        self.warc_path = None
+        self.cdxj_lines = list()
+
+    def start_new_warc(self):
+
+        while True:
+            self.warc_path = self.directory / f"{self.name_prefix}-{self.started_at}-{self.file_number:05d}.warc.gz"
+            self.file_number += 1
+            if not self.warc_path.exists():
+                break
+
+        logger.info("starting rolling warc `%s`", self.warc_path)
+        self.f = open(self.warc_path, "xb")
+
+    async def append_warc_file(self, source_path:pathlib.Path) -> WarcLocation:
+        '''
+        append every record in `source_path` to the current warc, it is flushed to disk before this returns
+        '''
+
+        async with self.lock:
+            return await asyncio.to_thread(self._append_warc_file, source_path)
+
+    def _append_warc_file(self, source_path:pathlib.Path) -> WarcLocation:
+
+        with open(source_path, "rb") as f:
+            members = list(read_warc_members(f, str(source_path)))
+        size = sum(len(iter_member.compressed) for _, iter_member in members)
+
+        if self.f is not None and self.f.tell() > 0 and self.f.tell() + size > self.max_size:
+            self.finish_current_warc()
+        if self.f is None:
+            self.start_new_warc()
+
+        start_offset = self.f.tell()
+        cdxj_lines = list()
+        for iter_submission_id, iter_member in members:
+            if iter_member.record.headers.get("warc-type") in INDEXED_RECORD_TYPES:
+                cdxj_lines.append(get_cdxj_line(
+                    iter_member.record, self.warc_path.name, self.f.tell(), len(iter_member.compressed), iter_submission_id))
+            self.f.write(iter_member.compressed)
+
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.cdxj_lines.extend(cdxj_lines)
+
+        return WarcLocation(warc_path=self.warc_path, offset=start_offset, length=self.f.tell() - start_offset)
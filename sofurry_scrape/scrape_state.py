@@ -0,0 +1,295 @@
+import logging
+import pathlib
+import sqlite3
+import urllib.parse
+
+import arrow
+
+logger = logging.getLogger(__name__)
+
+STATE_DATABASE_FILENAME = "sofurry_scrape_state.sqlite3"
+
+# the stages a submission goes through, each one is recorded separately so
+# a rerun only has to redo the ones that didn't finish
+STAGE_METADATA = "metadata"
+STAGE_THUMBNAIL = "thumbnail"
+STAGE_HTML = "html"
+STAGE_CONTENT = "content"
+STAGE_WARC = "warc"
+
+# used by `amqp_producer` to remember which submissions it already put on the queue
+STAGE_PUBLISHED = "published"
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS submission_stages (
+    submission_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    content_hash TEXT,
+    completed_at TEXT NOT NULL,
+    PRIMARY KEY (submission_id, stage)
+);
+
+CREATE TABLE IF NOT EXISTS listing_checkpoints (
+    listing_key TEXT PRIMARY KEY,
+    next_page INTEGER NOT NULL,
+    is_complete INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS listing_submissions (
+    listing_key TEXT NOT NULL,
+    submission_id TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    PRIMARY KEY (listing_key, submission_id)
+);
+
+CREATE TABLE IF NOT EXISTS warc_locations (
+    submission_id TEXT PRIMARY KEY,
+    warc_path TEXT NOT NULL,
+    warc_offset INTEGER NOT NULL,
+    warc_length INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS url_blobs (
+    url TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    fetched_at TEXT NOT NULL
+);
+'''
+
+
+def get_listing_key(url:str, params:dict) -> str:
+    '''
+    the key used to identify a paginated listing, which is the url and the params
+    minus the page number, sorted so the same listing always gets the same key
+    '''
+
+    return f"{url}?{urllib.parse.urlencode(sorted(params.items()))}"
+
+
+class ScrapeStateDatabase:
+    '''
+    a sqlite database in the output root that records what has been downloaded already,
+    so a scrape that crashed or was stopped can pick up where it left off
+
+    every write is committed right away, so nothing is lost when the stop event is set
+    '''
+
+    def __init__(self, database_path:pathlib.Path):
+
+        self.database_path = database_path
+        self.connection = None
+
+    def open(self):
+
+        logger.info("opening scrape state database at `%s`", self.database_path)
+        self.connection = sqlite3.connect(self.database_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def is_stage_complete(self, submission_id, stage:str) -> bool:
+
+        row = self.connection.execute(
+            "SELECT 1 FROM submission_stages WHERE submission_id = ? AND stage = ?",
+            (str(submission_id), stage)).fetchone()
+        return row is not None
+
+    def get_stage_hash(self, submission_id, stage:str) -> str|None:
+
+        row = self.connection.execute(
+            "SELECT content_hash FROM submission_stages WHERE submission_id = ? AND stage = ?",
+            (str(submission_id), stage)).fetchone()
+        return row[0] if row else None
+
+    def mark_stage_complete(self, submission_id, stage:str, content_hash:str|None=None):
+
+        logger.debug("submission `%s`: marking stage `%s` complete, hash: `%s`", submission_id, stage, content_hash)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO submission_stages (submission_id, stage, content_hash, completed_at) VALUES (?, ?, ?, ?)",
+                (str(submission_id), stage, content_hash, arrow.utcnow().isoformat()))
+
+    def get_submission_ids_with_stage(self, stage:str) -> set[str]:
+
+        rows = self.connection.execute("SELECT submission_id FROM submission_stages WHERE stage = ?", (stage,)).fetchall()
+        return set(iter_row[0] for iter_row in rows)
+
+    def clear_submission_stage(self, submission_id, stage:str):
+
+        with self.connection:
+            self.connection.execute("DELETE FROM submission_stages WHERE submission_id = ? AND stage = ?", (str(submission_id), stage))
+
+    def clear_submission_stages(self, submission_id):
+
+        with self.connection:
+            self.connection.execute("DELETE FROM submission_stages WHERE submission_id = ?", (str(submission_id),))
+
+
+    def get_listing_checkpoint(self, listing_key:str) -> tuple[int, bool]|None:
+        '''
+        @return a tuple of (next page to fetch, whether the listing was finished), or None
+        if we have never seen this listing before
+        '''
+
+        row = self.connection.execute(
+            "SELECT next_page, is_complete FROM listing_checkpoints WHERE listing_key = ?",
+            (listing_key,)).fetchone()
+
+        if row is None:
+            return None
+        return (row[0], bool(row[1]))
+
+    def get_listing_submission_ids(self, listing_key:str) -> set[str]:
+
+        rows = self.connection.execute(
+            "SELECT submission_id FROM listing_submissions WHERE listing_key = ?",
+            (listing_key,)).fetchall()
+        return set(iter_row[0] for iter_row in rows)
+
+    def save_listing_page(self, listing_key:str, page_number:int, submission_ids:list):
+        '''
+        record that every submission on a page was processed, so the next run can start at the page after it
+        '''
+
+        logger.debug("listing `%s`: saving checkpoint after page `%s`", listing_key, page_number)
+        now = arrow.utcnow().isoformat()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO listing_submissions (listing_key, submission_id, page_number) VALUES (?, ?, ?)",
+                [(listing_key, str(iter_id), page_number) for iter_id in submission_ids])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO listing_checkpoints (listing_key, next_page, is_complete, updated_at) VALUES (?, ?, 0, ?)",
+                (listing_key, page_number + 1, now))
+
+    def mark_listing_complete(self, listing_key:str):
+        '''
+        record that the whole listing was gone through. A listing can be finished without a page being saved (like an
+        incremental scrape stopping at page 1), so this adds the checkpoint if there isn't one
+        '''
+
+        logger.debug("listing `%s`: marking complete", listing_key)
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO listing_checkpoints (listing_key, next_page, is_complete, updated_at) VALUES (?, 1, 1, ?) " +
+                "ON CONFLICT (listing_key) DO UPDATE SET is_complete = 1, updated_at = excluded.updated_at",
+                (listing_key, arrow.utcnow().isoformat()))
+
+    def reset_listing(self, listing_key:str):
+
+        logger.debug("listing `%s`: resetting checkpoint", listing_key)
+        with self.connection:
+            self.connection.execute("DELETE FROM listing_submissions WHERE listing_key = ?", (listing_key,))
+            self.connection.execute("DELETE FROM listing_checkpoints WHERE listing_key = ?", (listing_key,))
+
+
+    def get_warc_location(self, submission_id) -> tuple[str, int, int]|None:
+        '''
+        @return a tuple of (path of the rolling warc relative to the output root, offset, length) of where the
+        submission's records are, or None if they aren't in a rolling warc
+        '''
+
+        row = self.connection.execute(
+            "SELECT warc_path, warc_offset, warc_length FROM warc_locations WHERE submission_id = ?",
+            (str(submission_id),)).fetchone()
+        return tuple(row) if row else None
+
+    def get_all_warc_locations(self) -> dict[str, tuple[str, int, int]]:
+        '''
+        @return a dict of submission id -> the same tuple `get_warc_location()` returns, for every submission in a rolling warc
+        '''
+
+        rows = self.connection.execute("SELECT submission_id, warc_path, warc_offset, warc_length FROM warc_locations").fetchall()
+        return {iter_row[0]: tuple(iter_row[1:]) for iter_row in rows}
+
+    def save_warc_location(self, submission_id, warc_path:str, offset:int, length:int):
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO warc_locations (submission_id, warc_path, warc_offset, warc_length, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (str(submission_id), warc_path, offset, length, arrow.utcnow().isoformat()))
+
+    def clear_warc_location(self, submission_id):
+
+        with self.connection:
+            self.connection.execute("DELETE FROM warc_locations WHERE submission_id = ?", (str(submission_id),))
+
+
+    def get_url_blob_hash(self, url:str) -> str|None:
+        '''
+        @return the hash of the blob that was downloaded from this url before, or None
+        '''
+
+        row = self.connection.execute("SELECT content_hash FROM url_blobs WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def clear_url_blob_hash(self, url:str):
+
+        with self.connection:
+            self.connection.execute("DELETE FROM url_blobs WHERE url = ?", (url,))
+
+    def save_url_blob_hash(self, url:str, content_hash:str):
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO url_blobs (url, content_hash, fetched_at) VALUES (?, ?, ?)",
+                (url, content_hash, arrow.utcnow().isoformat()))
+
+
+class ListingProgress:
+    '''
+    saves the checkpoint of a listing as the submissions on its pages get done. With `--use-stage-pipeline` going
+    through the listing only queues the submissions, they get done later and not in order, so a page is only saved
+    once every submission on it and on the pages before it got through its last stage. Otherwise a run that gets
+    stopped could be resumed after submissions that were queued but never downloaded
+    '''
+
+    def __init__(self, state_database:ScrapeStateDatabase, listing_key:str):
+
+        self.state_database = state_database
+        self.listing_key = listing_key
+        # page number -> [submission ids, whether it is done], for the pages that aren't saved yet, in page order
+        self.pending_pages = dict()
+        self.is_walk_finished = False
+
+    def add_page(self, page_number:int, submission_ids:list):
+        self.pending_pages[page_number] = [list(submission_ids), False]
+
+    def finish_page(self, page_number:int):
+        ''' every submission on the page is done '''
+
+        self.pending_pages[page_number][1] = True
+        self._save_done_pages()
+
+    def finish(self):
+        ''' every page of the listing was added, it gets marked complete once they are all done '''
+
+        self.is_walk_finished = True
+        self._save_done_pages()
+
+    def _save_done_pages(self):
+
+        while self.pending_pages:
+            page_number, (submission_ids, is_done) = next(iter(self.pending_pages.items()))
+            if not is_done:
+                return
+            self.state_database.save_listing_page(self.listing_key, page_number, submission_ids)
+            del self.pending_pages[page_number]
+
+        if self.is_walk_finished:
+            self.state_database.mark_listing_complete(self.listing_key)
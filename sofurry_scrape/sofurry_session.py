@@ -0,0 +1,244 @@
+import logging
+import asyncio
+import json
+import pathlib
+import stat
+
+import httpx
+import arrow
+
+from sofurry_scrape import utils
+from sofurry_scrape import rate_limit
+from sofurry_scrape import wget_utils
+
+logger = logging.getLogger(__name__)
+
+
+LOGIN_PAGE_URL = "https://www.sofurry.com/user/login"
+
+# the login page only has the login form on it if you aren't logged in
+LOGIN_FORM_FIELD = b"LoginForm[sfLoginUsername]"
+
+
+def add_session_arguments(parser):
+    '''
+    add the arguments for caching the logged in session between runs
+
+    @param parser - the argparse parser to add the arguments to
+    '''
+
+    parser.add_argument(
+        "--session-cache-file",
+        required=False,
+        dest="session_cache_file",
+        type=pathlib.Path,
+        help="where to keep the session cookies between runs so we don't have to log in every time, only the " +
+            "owner can read it. defaults to `<credentials json file name>.session.json` next to the credentials json file")
+
+    parser.add_argument(
+        "--no-session-cache",
+        action="store_true",
+        dest="no_session_cache",
+        help="always log in, and don't save the session cookies")
+
+
+def get_session_cache_path(parsed_args) -> pathlib.Path|None:
+    '''
+    @return where the session cache goes, from the arguments added by `add_session_arguments()`, or None if it is disabled
+    '''
+
+    if parsed_args.no_session_cache:
+        return None
+    if parsed_args.session_cache_file:
+        return parsed_args.session_cache_file
+
+    credentials_path:pathlib.Path = parsed_args.credentials_json_file
+    return credentials_path.with_name(f"{credentials_path.stem}.session.json")
+
+
+def load_credentials(credentials_json_file:pathlib.Path) -> dict:
+
+    credential_json = None
+    with open(credentials_json_file, "r", encoding="utf-8") as f:
+        credential_json = json.load(f)
+
+    logger.info("loaded credential file from `%s`", credentials_json_file)
+    return credential_json
+
+
+def create_httpx_client(rate_limiter_registry:rate_limit.RateLimiterRegistry|None=None,
+    transport:httpx.AsyncBaseTransport|None=None) -> httpx.AsyncClient:
+    '''
+    @param rate_limiter_registry - if given, every request the client makes waits for the limiter of its host
+    @param transport - the transport to send the requests with, the benchmarks use this to send them somewhere else
+    '''
+
+    logger.info("creating httpx client")
+
+    headers = utils.get_headers()
+
+    # it HAS to be http2=True and http1=False or else the sofurry api refuses to work LOL
+    if transport is None:
+        transport = httpx.AsyncHTTPTransport(http1=False, http2=True)
+    if rate_limiter_registry:
+        transport = rate_limit.RateLimitedTransport(rate_limiter_registry, transport)
+
+    return httpx.AsyncClient(headers=headers, follow_redirects=True, transport=transport)
+
+
+async def login_to_sofurry(httpx_client:httpx.AsyncClient, credential_json:dict):
+    '''
+    makes the calls needed to log in, after this the client's cookie jar has the session cookies
+    '''
+
+    login_post_data = utils.get_login_post_data(credential_json["username"], credential_json["password"])
+
+    logger.info("making initial calls to sofurry...")
+
+    # hit the main page to get some headers and cookies
+    homepage_resp = await httpx_client.get("https://www.sofurry.com", timeout=10.0)
+    logger.debug("homepage response: `%s`", homepage_resp)
+    homepage_resp.raise_for_status()
+
+    login_pg_resp = await httpx_client.get("https://www.sofurry.com/user/login", timeout=10.0)
+    logger.debug("login page get response: `%s`", login_pg_resp)
+    login_pg_resp.raise_for_status()
+
+    logger.info("logging in to sofurry...")
+    login_post_resp = await httpx_client.post("https://www.sofurry.com/user/login", data=login_post_data, timeout=10.0)
+    logger.debug("login page post response: `%s`", login_post_resp)
+    login_post_resp.raise_for_status()
+    logger.info("login successful")
+
+
+async def is_logged_in(httpx_client:httpx.AsyncClient) -> bool:
+    '''
+    check whether the cookies in the client's cookie jar are for a session that is still logged in. If the site
+    doesn't give us the login page (or the request fails) we can't tell, so that counts as not logged in and we log in again
+    '''
+
+    try:
+        login_pg_resp = await httpx_client.get(LOGIN_PAGE_URL, timeout=10.0)
+    except httpx.TransportError as e:
+        logger.warning("couldn't check if the saved session is still logged in, getting the login page failed with `%s: %s`, logging in again",
+            type(e).__name__, e)
+        return False
+
+    logger.debug("login page get response: `%s`", login_pg_resp)
+
+    if not login_pg_resp.is_success:
+        logger.warning("couldn't check if the saved session is still logged in, the login page gave us `%s`, logging in again",
+            login_pg_resp.status_code)
+        return False
+
+    return LOGIN_FORM_FIELD not in login_pg_resp.content
+
+
+class SessionCookieManager:
+    '''
+    logs in, reusing the session cookies from a previous run if they still work, and keeps the cookie file
+    that wget-at uses and the session cache up to date whenever the site gives us new cookies during the run
+    '''
+
+    def __init__(self, httpx_client:httpx.AsyncClient, session_cache_path:pathlib.Path|None, cookiefile_path:pathlib.Path|None):
+        '''
+        @param session_cache_path - where to save the cookies between runs, or None to always log in
+        @param cookiefile_path - where to write the cookie file for wget-at, or None if there isn't one
+        '''
+
+        self.httpx_client = httpx_client
+        self.session_cache_path = session_cache_path
+        self.cookiefile_path = cookiefile_path
+        self.username = None
+
+        # what the cookies were when they were last written out, to tell when they change
+        self.saved_cookies = None
+        # so the files are written in the order the cookies changed in
+        self.save_lock = asyncio.Lock()
+
+    def get_cookies(self) -> list[dict]:
+
+        return sorted(({"name": x.name, "value": x.value, "domain": x.domain, "path": x.path}
+            for x in self.httpx_client.cookies.jar), key=lambda x: (x["domain"], x["path"], x["name"]))
+
+    def load_session_cache(self) -> bool:
+        '''
+        put the cookies from the session cache in the client's cookie jar
+
+        @return whether there were any cookies for the user we are logging in as
+        '''
+
+        if not self.session_cache_path or not self.session_cache_path.exists():
+            return False
+
+        try:
+            with open(self.session_cache_path, "r", encoding="utf-8") as f:
+                session_cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("couldn't read the session cache `%s`, logging in instead: `%s`", self.session_cache_path, e)
+            return False
+
+        if session_cache.get("username") != self.username or not session_cache.get("cookies"):
+            logger.info("the session cache `%s` isn't for user `%s`, logging in instead", self.session_cache_path, self.username)
+            return False
+
+        for iter_cookie in session_cache["cookies"]:
+            self.httpx_client.cookies.set(iter_cookie["name"], iter_cookie["value"], iter_cookie["domain"], iter_cookie["path"])
+
+        logger.info("loaded the session cookies saved at `%s` from `%s`", session_cache.get("saved_at"), self.session_cache_path)
+        return True
+
+    async def save_cookies(self):
+        '''
+        write the cookie file for wget-at and the session cache, they are written atomically so a
+        wget-at process starting at the same time never sees half of the file. This happens during the scrape, so
+        the files are written on another thread to not hold up the requests in flight
+        '''
+
+        cookies = self.get_cookies()
+        self.saved_cookies = cookies
+        # taken now, the cookie jar can change while the files are being written
+        cookie_dict = dict(self.httpx_client.cookies)
+
+        async with self.save_lock:
+            await asyncio.to_thread(self._write_cookies, cookies, cookie_dict)
+
+    def _write_cookies(self, cookies:list[dict], cookie_dict:dict):
+
+        if self.cookiefile_path:
+            wget_utils.write_cookie_file(self.cookiefile_path, cookie_dict)
+
+        if self.session_cache_path:
+            session_cache = {"username": self.username, "saved_at": arrow.utcnow().isoformat(), "cookies": cookies}
+            try:
+                # the cookies are as good as the password, so only we can read them
+                utils.write_file_atomically(self.session_cache_path, json.dumps(session_cache, indent=4).encode("utf-8"),
+                    mode=stat.S_IRUSR | stat.S_IWUSR)
+            except OSError as e:
+                logger.warning("couldn't save the session cache `%s`: `%s`", self.session_cache_path, e)
+
+    async def on_response(self, response:httpx.Response):
+        '''
+        a httpx response event hook, it runs after the client has put the response's cookies in its cookie jar
+        '''
+
+        if self.saved_cookies is not None and "set-cookie" in response.headers and self.get_cookies() != self.saved_cookies:
+            logger.info("the session cookies changed, updating the cookie file and session cache")
+            await self.save_cookies()
+
+    async def log_in(self, credential_json:dict):
+        '''
+        if the session cache has cookies that are still logged in, use them, otherwise log in. Afterwards the
+        cookies are saved, and saved again whenever they change
+        '''
+
+        self.username = credential_json["username"]
+
+        if await asyncio.to_thread(self.load_session_cache) and await is_logged_in(self.httpx_client):
+            logger.info("the saved session is still logged in, not logging in again")
+        else:
+            self.httpx_client.cookies.clear()
+            await login_to_sofurry(self.httpx_client, credential_json)
+
+        await self.save_cookies()
+        self.httpx_client.event_hooks["response"].append(self.on_response)
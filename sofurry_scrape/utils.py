@@ -2,11 +2,18 @@ import signal
 import logging
 import pathlib
 import json
+import os
 
 import yarl
 import arrow
 import attr
 
+# optional, it is a lot faster at parsing json but is strict about control characters
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -41,6 +48,148 @@ class ProfileFolderCollection:
     # journals_dir:pathlib.Path
     # characters_dir:pathlib.Path
 
+    def get_content_dir(self, content_type_name:str) -> pathlib.Path:
+        ''' the folder for one of the `content_types.CONTENT_TYPES`, it isn't created until something goes in it '''
+        return self.root_dir / content_type_name
+
+@attr.define
+class SubmissionFolderCollection:
+    submission_id:str
+    safe_submission_name:str
+    root_dir:pathlib.Path
+    info_json:pathlib.Path
+    # the sha256 of each file we write, in the same format `sha256sum` uses, so `sha256sum -c` can check them
+    checksums:pathlib.Path
+    thumbnail:pathlib.Path
+    html:pathlib.Path
+    warc:pathlib.Path
+    # the full size file of artwork, music and photos goes in here, named whatever the server calls it
+    content_dir:pathlib.Path
+
+def get_submission_folder_collection(content_dir:pathlib.Path, submission_json:dict) -> SubmissionFolderCollection:
+    '''
+    the paths of everything that gets written for a submission, this doesn't create anything
+
+    @param content_dir - the folder of the user's submissions of this kind, see `ProfileFolderCollection.get_content_dir()`
+    '''
+
+    safe_submission_name = make_safe_filename(submission_json["title"])
+    submission_id = submission_json["id"]
+
+    submission_dir = content_dir / f"{safe_submission_name} [{submission_id}]"
+
+    return SubmissionFolderCollection(
+        submission_id=submission_id,
+        safe_submission_name=safe_submission_name,
+        root_dir=submission_dir,
+        info_json=submission_dir / "info.json",
+        checksums=submission_dir / "sha256sums.txt",
+        thumbnail=submission_dir / "thumbnail.png",
+        html=submission_dir / f"{safe_submission_name} [{submission_id}].html",
+        warc=submission_dir / f"{safe_submission_name} [{submission_id}].warc.gz",
+        content_dir=submission_dir / "content")
+
+def get_submission_folder_collection_from_dir(submission_dir:pathlib.Path) -> SubmissionFolderCollection:
+    ''' the same as `get_submission_folder_collection()`, for a submission folder that is already there '''
+
+    safe_submission_name, _, submission_id = submission_dir.name.rpartition(" [")
+
+    return SubmissionFolderCollection(
+        submission_id=submission_id.removesuffix("]"),
+        safe_submission_name=safe_submission_name,
+        root_dir=submission_dir,
+        info_json=submission_dir / "info.json",
+        checksums=submission_dir / "sha256sums.txt",
+        thumbnail=submission_dir / "thumbnail.png",
+        html=submission_dir / f"{submission_dir.name}.html",
+        warc=submission_dir / f"{submission_dir.name}.warc.gz",
+        content_dir=submission_dir / "content")
+
+def get_partial_file_path(path:pathlib.Path) -> pathlib.Path:
+    ''' the temporary file that gets written to before it is renamed to `path` '''
+
+    return path.with_name(f".{path.name}.part")
+
+def write_file_atomically(path:pathlib.Path, data:bytes, mode:int|None=None, fsync:bool=True):
+    '''
+    write to a temporary file next to `path` and then rename it, so if we get interrupted there is
+    either the old file or the new one, never a half written one
+
+    @param mode - if given, the permissions of the file, they are set before anything is written to it
+    @param fsync - whether to make sure it is on disk before it is renamed, without it a crash of the whole
+    machine can leave an empty file behind
+    '''
+
+    partial_path = get_partial_file_path(path)
+    try:
+        with open(partial_path, "wb") as f:
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(partial_path, path)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+
+def update_checksums(checksums_path:pathlib.Path, updates:dict[pathlib.Path, str|None], fsync:bool=True):
+    '''
+    add, replace or take out lines of a `sha256sum` style file, the paths are relative to the folder the checksum
+    file is in
+
+    @param updates - file path -> its sha256 hex digest, or None to take its line out
+    '''
+
+    checksums = read_checksums(checksums_path)
+    for iter_path, iter_hash in updates.items():
+        name = iter_path.relative_to(checksums_path.parent).as_posix()
+        if iter_hash is None:
+            checksums.pop(name, None)
+        else:
+            checksums[name] = iter_hash
+
+    lines = "".join(f"{iter_hash}  {iter_name}\n" for iter_name, iter_hash in sorted(checksums.items()))
+    write_file_atomically(checksums_path, lines.encode("utf-8"), fsync=fsync)
+
+def read_checksums(checksums_path:pathlib.Path) -> dict[str, str]:
+    '''
+    @return a dict of file name -> sha256 hex digest from a `sha256sum` style file, empty if there isn't one
+    '''
+
+    checksums = dict()
+    if checksums_path.exists():
+        with open(checksums_path, "r", encoding="utf-8") as f:
+            for iter_line in f:
+                iter_hash, sep, iter_name = iter_line.rstrip("\n").partition("  ")
+                if sep:
+                    checksums[iter_name] = iter_hash
+    return checksums
+
+def find_user_dirs(output_path:pathlib.Path) -> list[pathlib.Path]:
+    ''' the user folders in an output root, which are the ones with a `profile.json` '''
+
+    with os.scandir(output_path) as user_entries:
+        return sorted(pathlib.Path(x.path) for x in user_entries
+            if x.is_dir() and os.path.exists(os.path.join(x.path, "profile.json")))
+
+def find_submission_dirs(user_dir:pathlib.Path) -> list[pathlib.Path]:
+    '''
+    the submission folders of a user, the ones named like `title [id]` in `stories` and whatever other kinds of
+    submissions there are. This only lists folders, so it is quick even for users with a lot of submissions
+    '''
+
+    submission_dirs = list()
+    with os.scandir(user_dir) as content_entries:
+        for iter_content_entry in content_entries:
+            if not iter_content_entry.is_dir():
+                continue
+            with os.scandir(iter_content_entry.path) as submission_entries:
+                submission_dirs.extend(pathlib.Path(x.path) for x in submission_entries
+                    if x.is_dir() and x.name.endswith("]") and " [" in x.name)
+    return submission_dirs
+
 def ensure_link_is_https(maybe_bad_link) -> str:
     '''toumal why do you do this to me
     the links returned in the api responses are http which doesn't work with http/2 which for some reason is required
@@ -60,16 +209,23 @@ def make_safe_filename(s):
             return "_"
     return "".join(safe_char(c) for c in s).rstrip("_")
 
-def escape_and_parse_json_omg(maybe_naughty_json_str:str) -> dict:
+def escape_and_parse_json_omg(maybe_naughty_json_str:str|bytes) -> dict:
     '''i swear toumal i will slap you with a fish
 
     newlines are not escaped in json responses, from what i've seen in user profile json
+
+    `strict=False` lets the json module accept control characters inside strings (and only there), so
+    it is parsed in one pass without making an escaped copy first. If orjson is installed it is tried first,
+    and when it fails because of the control characters the json module is used instead
     '''
 
-    escaped_json = maybe_naughty_json_str.replace("\n", "\\n")
+    if orjson:
+        try:
+            return orjson.loads(maybe_naughty_json_str)
+        except orjson.JSONDecodeError:
+            pass
 
-    json_dict = json.loads(escaped_json)
-    return json_dict
+    return json.loads(maybe_naughty_json_str, strict=False)
 
 def create_necessary_output_directories(root_path, username:str, uid:str ) -> ProfileFolderCollection:
 
@@ -0,0 +1,195 @@
+import base64
+import gzip
+import hashlib
+import io
+import pathlib
+import zlib
+
+import attr
+
+# reading warcs back is kept apart from `warc_writer`, since `verify` only needs this part and
+# `warc_writer` pulls in httpx and lxml
+
+
+def get_warc_digest(data:bytes) -> str:
+    ''' the `sha1:<base32>` digest format that everything else that writes warcs uses '''
+    return "sha1:" + base64.b32encode(hashlib.sha1(data).digest()).decode("ascii")
+
+
+def decode_content(payload:bytes, content_encoding:str|None) -> bytes:
+    '''
+    undo the `Content-Encoding` of a body, we only ask for gzip and deflate so those are the only ones handled
+
+    @raises ValueError if it uses some other encoding
+    '''
+
+    if not content_encoding:
+        return payload
+
+    for iter_encoding in reversed([x.strip().lower() for x in content_encoding.split(",")]):
+        if iter_encoding in ("gzip", "x-gzip"):
+            payload = gzip.decompress(payload)
+        elif iter_encoding == "deflate":
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error:
+                # some servers send it without the zlib header
+                payload = zlib.decompress(payload, -zlib.MAX_WBITS)
+        elif iter_encoding not in ("identity", ""):
+            raise ValueError(f"unsupported content encoding `{iter_encoding}`")
+
+    return payload
+
+
+def decode_chunked(payload:bytes) -> bytes:
+    '''
+    undo `Transfer-Encoding: chunked`, which HTTP/1.1 responses recorded by wget-at can have
+    '''
+
+    chunks = list()
+    position = 0
+    while True:
+        line_end = payload.index(b"\r\n", position)
+        # the size can be followed by `;extensions`
+        chunk_size = int(payload[position:line_end].split(b";")[0].strip(), 16)
+        if chunk_size == 0:
+            return b"".join(chunks)
+        chunks.append(payload[line_end + 2:line_end + 2 + chunk_size])
+        position = line_end + 2 + chunk_size + 2
+
+
+@attr.define
+class WarcRecord:
+    ''' a record read back from a warc '''
+    # the version line and the header lines, as they were in the file
+    head:bytes
+    # the names are lowercase
+    headers:dict[str, str]
+    block:bytes
+
+    def get_raw_record(self) -> bytes:
+        return self.head + self.block + b"\r\n\r\n"
+
+
+def read_warc_records(f, description:str):
+    '''
+    read the records of an uncompressed warc
+
+    @param f - a binary file object positioned at the start of a record
+    @param description - what `f` is, for the error messages
+    @return a generator of `WarcRecord`s
+    '''
+
+    while True:
+        version_line = f.readline()
+        if not version_line:
+            return
+        if not version_line.strip():
+            # the blank lines between records
+            continue
+        if not version_line.startswith(b"WARC/"):
+            raise Exception(f"`{description}` has `{version_line[:50]!r}` where a record should start")
+
+        head_lines = [version_line]
+        headers = dict()
+        for iter_line in iter(f.readline, b"\r\n"):
+            if not iter_line:
+                raise Exception(f"`{description}` ends in the middle of a record's headers")
+            head_lines.append(iter_line)
+            name, _, value = iter_line.decode("utf-8").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        head_lines.append(b"\r\n")
+
+        block = f.read(int(headers["content-length"]))
+        yield WarcRecord(head=b"".join(head_lines), headers=headers, block=block)
+
+
+def iter_warc_records(warc_path:pathlib.Path, offset:int=0, length:int|None=None):
+    '''
+    read the records of a `.warc.gz`, ours or one made by wget-at. gzip reads every member one after the other, so
+    it doesn't matter if each record is its own member
+
+    @param offset, length - only read the records in this part of the file, which has to start and end at a gzip member
+    @return a generator of `WarcRecord`s
+    '''
+
+    with open(warc_path, "rb") as f:
+        if length is not None:
+            f.seek(offset)
+            with gzip.GzipFile(fileobj=io.BytesIO(f.read(length)), mode="rb") as gzip_file:
+                yield from read_warc_records(gzip_file, str(warc_path))
+            return
+
+        f.seek(offset)
+        with gzip.GzipFile(fileobj=f, mode="rb") as gzip_file:
+            yield from read_warc_records(gzip_file, str(warc_path))
+
+
+def iter_gzip_members(f, chunk_size:int=1024 * 1024):
+    '''
+    split a gzip file into its members without reading all of it at once
+
+    @param f - a binary file object
+    @return a generator of `(compressed member, decompressed member)` tuples
+    @raises EOFError if the last member is cut off, after yielding the complete ones
+    '''
+
+    pending = b""
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        compressed_chunks = list()
+        decompressed_chunks = list()
+
+        while not decompressor.eof:
+            chunk = pending or f.read(chunk_size)
+            pending = b""
+            if not chunk:
+                if not compressed_chunks:
+                    return
+                raise EOFError("the last gzip member is cut off")
+            compressed_chunks.append(chunk)
+            decompressed_chunks.append(decompressor.decompress(chunk))
+
+        pending = decompressor.unused_data
+        compressed = b"".join(compressed_chunks)
+        yield (compressed[:len(compressed) - len(pending)], b"".join(decompressed_chunks))
+
+
+@attr.define
+class HttpResponseBlock:
+    ''' the block of a `response` record, split up '''
+    status_code:int
+    # the names are lowercase
+    headers:dict[str, str]
+    # the body as it was sent, still chunked and compressed if it was
+    payload:bytes
+
+    def get_decoded_content(self) -> bytes:
+        ''' the body with its transfer and content encodings undone '''
+
+        payload = self.payload
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            payload = decode_chunked(payload)
+        return decode_content(payload, self.headers.get("content-encoding"))
+
+
+def parse_http_response_block(block:bytes) -> HttpResponseBlock:
+
+    head, _, payload = block.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("iso-8859-1").split("\r\n")
+
+    headers = dict()
+    for iter_line in header_lines:
+        name, _, value = iter_line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    return HttpResponseBlock(status_code=int(status_line.split(" ")[1]), headers=headers, payload=payload)
+
+
+def get_warcinfo_fields(block:bytes) -> dict[str, str]:
+
+    fields = dict()
+    for iter_line in block.decode("utf-8", errors="replace").splitlines():
+        name, _, value = iter_line.partition(":")
+        fields[name.strip()] = value.strip()
+    return fields
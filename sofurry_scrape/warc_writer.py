@@ -0,0 +1,333 @@
+import logging
+import asyncio
+import gzip
+import http
+import os
+import pathlib
+import re
+import uuid
+
+import arrow
+import attr
+import httpx
+
+from sofurry_scrape import http_fetch
+from sofurry_scrape import html_extract
+from sofurry_scrape import utils
+from sofurry_scrape import warc_reader
+
+logger = logging.getLogger(__name__)
+
+WARC_VERSION = "WARC/1.1"
+
+SOFTWARE_NAME = "sofurry_scrape"
+
+# how many redirects in a row we follow before giving up, same as wget
+MAX_REDIRECTS = 20
+
+# how many linked assets of a page get downloaded at the same time, the rate limiter still has the final say
+MAX_CONCURRENT_ASSETS = 4
+
+
+def get_submission_warcinfo_fields(submission_json:dict) -> list[str]:
+    '''
+    the fields that go in the warcinfo record of a submission's warc, for both wget-at (as `--warc-header`s)
+    and `NativeWarcCapture`
+    '''
+
+    return [
+        f"sofurry_submission_id: {submission_json['id']}",
+        f"sofurry_author_id: {submission_json['authorID']}",
+        f"sofurry_author: {submission_json['author']}",
+        f"date: {arrow.utcnow().isoformat()}"]
+
+
+def get_warc_date() -> str:
+    return arrow.utcnow().format("YYYY-MM-DDTHH:mm:ss.SSSSSS") + "Z"
+
+
+def create_record_id() -> str:
+    return f"<urn:uuid:{uuid.uuid4()}>"
+
+
+def create_warc_record(record_type:str, block:bytes, headers:list[tuple[str, str]], record_id:str|None=None) -> bytes:
+    '''
+    @param headers - any headers besides the ones every record has
+    @return the record, not compressed
+    '''
+
+    all_headers = [
+        ("WARC-Type", record_type),
+        ("WARC-Record-ID", record_id or create_record_id()),
+        ("WARC-Date", get_warc_date())] + headers + [
+        ("WARC-Block-Digest", warc_reader.get_warc_digest(block)),
+        ("Content-Length", str(len(block)))]
+
+    header_bytes = "".join(f"{k}: {v}\r\n" for k, v in all_headers).encode("utf-8")
+    return WARC_VERSION.encode("utf-8") + b"\r\n" + header_bytes + b"\r\n" + block + b"\r\n\r\n"
+
+
+def get_http_request_block(request:httpx.Request) -> bytes:
+    '''
+    the request as an HTTP/1.1 message, since that is what warcs have in them even if it was sent over HTTP/2
+    '''
+
+    request_line = f"{request.method} {request.url.raw_path.decode('ascii')} HTTP/1.1\r\n".encode("ascii")
+    header_bytes = b"".join(k + b": " + v + b"\r\n" for k, v in request.headers.raw)
+    return request_line + header_bytes + b"\r\n" + request.content
+
+
+def get_http_response_block(response:httpx.Response, payload:bytes) -> bytes:
+    '''
+    the response as an HTTP/1.1 message, see `get_http_request_block()`
+
+    @param payload - the body as it was sent, so still compressed if it has a `Content-Encoding`
+    '''
+
+    reason_phrase = response.reason_phrase
+    if not reason_phrase:
+        # HTTP/2 doesn't have them
+        try:
+            reason_phrase = http.HTTPStatus(response.status_code).phrase
+        except ValueError:
+            reason_phrase = ""
+
+    status_line = f"HTTP/1.1 {response.status_code} {reason_phrase}\r\n".encode("ascii")
+    header_bytes = b"".join(k + b": " + v + b"\r\n" for k, v in response.headers.raw)
+    return status_line + header_bytes + b"\r\n" + payload
+
+
+def get_page_content_from_warc(warc_path:pathlib.Path, url:str, offset:int=0, length:int|None=None) -> bytes:
+    '''
+    get the body of a page that was captured in a warc, following any redirects it went through
+
+    @param offset, length - see `warc_reader.iter_warc_records()`
+
+    @raises Exception if the warc doesn't have a successful response for it
+    '''
+
+    # target uri -> the last response record for it, since a url that was retried can have more than one
+    response_blocks = dict()
+    for iter_record in warc_reader.iter_warc_records(warc_path, offset, length):
+        if iter_record.headers.get("warc-type") == "response":
+            response_blocks[iter_record.headers.get("warc-target-uri", "").strip("<>")] = iter_record.block
+
+    for _ in range(MAX_REDIRECTS + 1):
+
+        if url not in response_blocks:
+            raise Exception(f"`{warc_path}` has no response for `{url}`")
+
+        response = warc_reader.parse_http_response_block(response_blocks[url])
+        if 300 <= response.status_code < 400 and "location" in response.headers:
+            url = str(httpx.URL(url).join(response.headers["location"]))
+            continue
+
+        if not 200 <= response.status_code < 300:
+            raise Exception(f"`{warc_path}` has a `{response.status_code}` response for `{url}`")
+
+        return response.get_decoded_content()
+
+    raise Exception(f"`{warc_path}` has too many redirects for `{url}`")
+
+
+class WarcWriter:
+    '''
+    writes records to a `.warc.gz` file, each record is its own gzip member so they can be read on their own
+    '''
+
+    def __init__(self, f):
+        '''
+        @param f - a file opened for writing in binary mode
+        '''
+
+        self.f = f
+        self.bytes_written = 0
+
+    def write_record(self, record_type:str, block:bytes, headers:list[tuple[str, str]], record_id:str|None=None) -> str:
+        '''
+        @return the record id
+        '''
+
+        record_id = record_id or create_record_id()
+        compressed_record = gzip.compress(create_warc_record(record_type, block, headers, record_id))
+        self.f.write(compressed_record)
+        self.bytes_written += len(compressed_record)
+        return record_id
+
+    def write_warcinfo(self, filename:str, fields:list[str]) -> str:
+
+        block = "".join(f"{x}\r\n" for x in [f"software: {SOFTWARE_NAME}", "format: WARC File Format 1.1"] + fields)
+        return self.write_record("warcinfo", block.encode("utf-8"),
+            [("WARC-Filename", filename), ("Content-Type", "application/warc-fields")])
+
+    def write_exchange(self, exchange:"HttpExchange", warcinfo_id:str):
+        '''
+        write the response record of a request and response, and then the request record
+        '''
+
+        response_id = create_record_id()
+        target_headers = [("WARC-Target-URI", str(exchange.request.url)), ("WARC-Warcinfo-ID", warcinfo_id)]
+        protocol_headers = [("WARC-Protocol", "h2")] if exchange.http_version == "HTTP/2" else []
+
+        self.write_record("response", exchange.response_block,
+            target_headers + protocol_headers + [
+                ("Content-Type", "application/http; msgtype=response"),
+                ("WARC-Payload-Digest", warc_reader.get_warc_digest(exchange.payload))],
+            record_id=response_id)
+
+        self.write_record("request", exchange.request_block,
+            target_headers + protocol_headers + [
+                ("Content-Type", "application/http; msgtype=request"),
+                ("WARC-Concurrent-To", response_id)])
+
+
+@attr.define
+class HttpExchange:
+    ''' a request and its response, the way they get written to a warc '''
+    request:httpx.Request
+    status_code:int
+    http_version:str
+    content_type:str|None
+    content_encoding:str|None
+    location:str|None
+    # the body as it was sent, before undoing the `Content-Encoding`
+    payload:bytes
+    request_block:bytes
+    response_block:bytes
+
+    def get_decoded_content(self) -> bytes:
+        return warc_reader.decode_content(self.payload, self.content_encoding)
+
+
+async def read_exchange(response:httpx.Response) -> HttpExchange:
+    '''
+    a response handler for `HttpFetcher.fetch_with_handler()` that reads the body without decoding it
+    '''
+
+    payload = b"".join([x async for x in response.aiter_raw()])
+
+    return HttpExchange(
+        request=response.request,
+        status_code=response.status_code,
+        http_version=response.http_version,
+        content_type=response.headers.get("Content-Type"),
+        content_encoding=response.headers.get("Content-Encoding"),
+        location=response.headers.get("Location"),
+        payload=payload,
+        request_block=get_http_request_block(response.request),
+        response_block=get_http_response_block(response, payload))
+
+
+@attr.define
+class CaptureResult:
+    ''' what `NativeWarcCapture.capture()` got '''
+    # the decoded body of the page, after any redirects
+    page_content:bytes
+    page_url:str
+    asset_count:int
+    failed_asset_count:int
+    warc_size:int
+
+
+class NativeWarcCapture:
+    '''
+    captures a page and the assets it links to into a warc with the httpx client, the same way
+    wget-at is run by `wget_utils.get_wget_args()`: the page, plus everything it links to that matches
+    the accept regex, but not what those link to
+    '''
+
+    def __init__(self, http_fetcher:http_fetch.HttpFetcher, accept_regex:str):
+
+        self.http_fetcher = http_fetcher
+        self.accept_regex = re.compile(accept_regex)
+
+    async def fetch_following_redirects(self, httpx_client:httpx.AsyncClient, url:str, endpoint:str) -> list[HttpExchange]:
+        '''
+        @return every exchange it took to get to the final response, the final one is last
+        '''
+
+        exchanges = list()
+        while True:
+
+            exchange = await self.http_fetcher.fetch_with_handler(httpx_client, url, endpoint, read_exchange, handle_redirects=True)
+            exchanges.append(exchange)
+
+            if exchange.location is None or not 300 <= exchange.status_code < 400:
+                return exchanges
+
+            if len(exchanges) > MAX_REDIRECTS:
+                raise http_fetch.FetchFailedError(url, endpoint, 1, exchange.status_code, "too many redirects")
+
+            url = str(exchange.request.url.join(exchange.location))
+            logger.debug("following redirect to `%s`", url)
+
+    async def capture(self, httpx_client:httpx.AsyncClient, url:str, warc_path:pathlib.Path, warcinfo_fields:list[str],
+        page_endpoint:str=http_fetch.ENDPOINT_SUBMISSION_HTML) -> CaptureResult:
+        '''
+        capture `url` and its linked assets to `warc_path`, it is written to a temporary file first and renamed when it
+        is complete. A linked asset that fails is left out, like it is with wget-at, but the page failing raises
+
+        @return the page's body and some counts
+        '''
+
+        page_exchanges = await self.fetch_following_redirects(httpx_client, url, page_endpoint)
+        final_page_exchange = page_exchanges[-1]
+        page_url = str(final_page_exchange.request.url)
+
+        page_content = final_page_exchange.get_decoded_content()
+
+        asset_exchanges = list()
+        failed_asset_count = 0
+        asset_urls = list()
+        if final_page_exchange.content_type and "html" in final_page_exchange.content_type:
+            links = await asyncio.to_thread(html_extract.extract_links, page_content, page_url)
+            asset_urls = [x for x in links if self.accept_regex.search(x) and x != page_url]
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_ASSETS)
+
+        async def _fetch_asset(asset_url:str):
+            nonlocal failed_asset_count
+            async with semaphore:
+                try:
+                    asset_exchanges.extend(await self.fetch_following_redirects(httpx_client, asset_url, http_fetch.ENDPOINT_WARC_ASSET))
+                except http_fetch.FetchFailedError as e:
+                    logger.debug("linked asset `%s` of `%s` failed, leaving it out: `%s`", asset_url, page_url, e)
+                    failed_asset_count += 1
+
+        async with asyncio.TaskGroup() as task_group:
+            for iter_asset_url in asset_urls:
+                task_group.create_task(_fetch_asset(iter_asset_url))
+
+        # compressing the records takes a bit, so don't do it on the event loop
+        warc_size = await asyncio.to_thread(write_warc_file, warc_path, warcinfo_fields, page_exchanges + asset_exchanges)
+
+        return CaptureResult(
+            page_content=page_content,
+            page_url=page_url,
+            asset_count=len(asset_urls),
+            failed_asset_count=failed_asset_count,
+            warc_size=warc_size)
+
+
+def write_warc_file(warc_path:pathlib.Path, warcinfo_fields:list[str], exchanges:list[HttpExchange]) -> int:
+    '''
+    write a warc with a warcinfo record and then the exchanges, to a temporary file that is renamed once it is complete
+
+    @return the size of the warc
+    '''
+
+    partial_path = utils.get_partial_file_path(warc_path)
+    try:
+        with open(partial_path, "wb") as f:
+            warc_writer = WarcWriter(f)
+            warcinfo_id = warc_writer.write_warcinfo(warc_path.name, warcinfo_fields)
+            for iter_exchange in exchanges:
+                warc_writer.write_exchange(iter_exchange, warcinfo_id)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, warc_path)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+
+    return warc_writer.bytes_written
@@ -1,27 +1,95 @@
 import subprocess
+import collections
 import pathlib
 import asyncio
 import logging
+import time
 
-import arrow
+from sofurry_scrape import metrics
+from sofurry_scrape import utils
+from sofurry_scrape import warc_writer
 
 # seems to be a good compromise between what is actually needed and viewing pleasure
 # i had to disable --page-requistes for this to work i guess? maybe the site is just weird or
 # wget's algorithm kinda sucks for choosing what to download / isn't clear
 WGET_ACCEPT_REGEX = "//www\\.sofurryfiles\\.com/std/.*|www\\.sofurryfiles\\.com/assets/.*|www\\.sofurry\\.com/static/.*|www\\.sofurry\\.com/std/.*"
 
+# 1 is a generic error and 8 is a server error response, both happen when a linked asset 404s
+WGET_ACCEPTABLE_RETURN_CODES = [0, 1, 8]
+
 logger = logging.getLogger(__name__)
 
 def write_cookie_file(output_file:pathlib.Path, cookiejar_dict:dict):
+    '''
+    write the cookies in the format wget-at reads, it gets rewritten when the cookies change during a run,
+    so it is written atomically so a wget-at process starting at the same time doesn't read half of it
+    '''
 
     logger.debug("writing cookie file to `%s`", output_file)
-    with open(output_file, "w", encoding="utf-8") as f:
-        #f.write("# Netscape HTTP Cookie File\n")
 
-        for k,v in cookiejar_dict.items():
+    #lines = ["# Netscape HTTP Cookie File\n"]
+    lines = list()
+    for k,v in cookiejar_dict.items():
+
+        lines.append(f".sofurry.com\tTRUE\t/\tTRUE\t2147483646\t{k}\t{v}\n")
+
+    utils.write_file_atomically(output_file, "".join(lines).encode("utf-8"))
+
+
+
+class CommandTimedOutError(Exception):
+    ''' raised when a command doesn't exit before its timeout and had to be killed '''
+    pass
+
+
+class CommandFailedError(Exception):
+    ''' raised when a command exits with a return code that isn't one of the acceptable ones '''
+
+    def __init__(self, message:str, returncode:int):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class BoundedLogBuffer:
+    ''' keeps the last `max_lines` lines of a process's output
+
+    the output is fed in as chunks of bytes as it is read from the pipe, so a chatty process
+    never fills up the pipe buffer, and we don't keep an unbounded amount of output in memory
+    '''
 
-            f.write(f".sofurry.com\tTRUE\t/\tTRUE\t2147483646\t{k}\t{v}\n")
+    def __init__(self, max_lines:int):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.partial_line = b""
+        self.total_bytes = 0
 
+    def feed(self, data:bytes):
+
+        self.total_bytes += len(data)
+
+        # carriage returns are used by progress bars, treat them as line breaks
+        split_lines = (self.partial_line + data).replace(b"\r", b"\n").split(b"\n")
+
+        # the last item is whatever came after the final newline, which might be incomplete
+        self.partial_line = split_lines.pop()
+        for iter_line in split_lines:
+            if iter_line:
+                self.lines.append(iter_line.decode("utf-8", errors="replace"))
+
+    def get_text(self) -> str:
+
+        lines = list(self.lines)
+        if self.partial_line:
+            lines.append(self.partial_line.decode("utf-8", errors="replace"))
+        return "\n".join(lines)
+
+
+async def _drain_stream_into_buffer(stream:asyncio.StreamReader, log_buffer:BoundedLogBuffer):
+
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        log_buffer.feed(chunk)
 
 
 async def run_command_and_wait(
@@ -29,7 +97,16 @@ async def run_command_and_wait(
     argument_list:list[str],
     timeout:int,
     acceptable_return_codes:list[int],
-    cwd=None) -> str:
+    cwd=None,
+    max_log_lines:int=200) -> tuple[int, str]:
+    '''
+    run a command, reading its output as it is produced
+
+    @param timeout - how many seconds the command has to exit before it is killed and
+    `CommandTimedOutError` is raised
+    @param max_log_lines - how many lines of the combined stdout / stderr to keep
+    @return the return code, and the last `max_log_lines` lines of output
+    '''
 
     logger.debug("running `%s` process with arguments `%s` and cwd `%s`",
         binary_to_run.name,
@@ -42,37 +119,132 @@ async def run_command_and_wait(
         stderr=subprocess.STDOUT,
         cwd=cwd)
 
-    while True:
-        try:
-            logger.debug("Waiting for `%s` process to exit...", binary_to_run.name)
+    log_buffer = BoundedLogBuffer(max_log_lines)
+    drain_task = asyncio.create_task(_drain_stream_into_buffer(process_obj.stdout, log_buffer))
 
-            await asyncio.wait_for(
-                # wait_for will cancel the task if it times out
-                # so wrap the `asyncio.subprocess.Process` object
-                # in `shield()` so it doesn't get cancelled
-                asyncio.shield(process_obj.wait()),
-                timeout=timeout)
+    try:
+        logger.debug("Waiting for `%s` process to exit...", binary_to_run.name)
+        await asyncio.wait_for(process_obj.wait(), timeout=timeout)
 
-            break
+    except (TimeoutError, asyncio.CancelledError) as e:
+
+        # kill it so we don't leave it running if we timed out or got cancelled
+        if process_obj.returncode is None:
+            logger.debug("killing `%s` process `%s`", binary_to_run.name, process_obj)
+            process_obj.kill()
+            await process_obj.wait()
+        await drain_task
 
-        except Exception as e:
-            logger.debug("command `%s` timed out, trying again", binary_to_run.name)
+        if isinstance(e, asyncio.CancelledError):
+            raise
 
-    stdout_result = await process_obj.stdout.read()
-    stdout_output = stdout_result.decode("utf-8")
+        logger.error("command `%s` with arguments `%s` didn't exit within `%s` seconds and was killed, output: `%s`",
+            binary_to_run, argument_list, timeout, log_buffer.get_text())
+        raise CommandTimedOutError(f"Command `{binary_to_run}` with arguments `{argument_list}` " +
+            f"didn't exit within `{timeout}` seconds") from e
+
+    # the pipe gets closed when the process exits so this finishes once the rest of the output is read
+    await drain_task
+
+    stdout_output = log_buffer.get_text()
     logger.debug("the `%s` process exited: `%s`", binary_to_run.name, process_obj)
-    logger.debug("stdout: `%s`", stdout_output)
+    logger.debug("stdout (%s bytes total): `%s`", log_buffer.total_bytes, stdout_output)
 
     if process_obj.returncode not in acceptable_return_codes:
 
         logger.error("command `%s` with arguments `%s` 's return code of `%s` wasn't in the list of " +
                 "acceptable return codes `%s`, stdout: `%s`",
                 binary_to_run, argument_list, process_obj.returncode, acceptable_return_codes, stdout_output)
-        raise Exception(f"Command `{binary_to_run}` with arguments `{argument_list}` 's return code " +
-            f"`{process_obj.returncode}` was not in the list of acceptable return codes: `{acceptable_return_codes}`")
+        raise CommandFailedError(f"Command `{binary_to_run}` with arguments `{argument_list}` 's return code " +
+            f"`{process_obj.returncode}` was not in the list of acceptable return codes: `{acceptable_return_codes}`",
+            process_obj.returncode)
+
+    return (process_obj.returncode, stdout_output)
+
+
+class WgetProcessPool:
+    '''
+    limits how many wget-at processes run at the same time, and retries a capture
+    if wget-at has to be killed because it went over the timeout
+    '''
+
+    def __init__(self, wget_path:pathlib.Path, max_concurrent_processes:int, timeout:int, max_attempts:int,
+        metrics_registry:metrics.MetricsRegistry|None=None):
+
+        self.wget_path = wget_path
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.semaphore = asyncio.Semaphore(max_concurrent_processes)
+        self.metrics = metrics_registry if metrics_registry is not None else metrics.MetricsRegistry()
+
+    async def run_capture(self, argument_list:list[str], cwd:pathlib.Path, rate_limiter=None) -> str:
+        '''
+        @param rate_limiter - a `rate_limit.HostRateLimiter` that each attempt takes a token from, it is only
+        waited on once there is room in the pool so we don't hold up other requests while waiting. It doesn't
+        take up one of its concurrency slots, a capture can run for minutes and the pool already limits how many
+        run at once, holding a slot that long would starve the page and listing requests to the same host
+        '''
+
+        # not `async with` so the gauge is right even if we get cancelled while waiting
+        self.metrics.add_to_gauge(metrics.WGET_PROCESSES_WAITING, 1)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.metrics.add_to_gauge(metrics.WGET_PROCESSES_WAITING, -1)
+
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    if rate_limiter:
+                        await rate_limiter.take_token()
+
+                    try:
+                        result = await self._run_wget_and_record_metrics(argument_list, cwd)
+                    except Exception:
+                        if rate_limiter:
+                            rate_limiter.record_result(None)
+                        raise
+
+                    # the time wget-at takes includes the linked assets, so it isn't a useful latency
+                    if rate_limiter:
+                        rate_limiter.record_result(200)
+                    return result
+
+                except CommandTimedOutError:
+                    if attempt == self.max_attempts:
+                        raise
+                    self.metrics.increment(metrics.WGET_RETRIES)
+                    logger.warning("wget-at timed out on attempt `%s` of `%s`, retrying", attempt, self.max_attempts)
+        finally:
+            self.semaphore.release()
 
-    return stdout_output
+    async def _run_wget_and_record_metrics(self, argument_list:list[str], cwd:pathlib.Path) -> str:
 
+        start_time = time.monotonic()
+        exit_code = None
+        self.metrics.add_to_gauge(metrics.WGET_PROCESSES_RUNNING, 1)
+        try:
+            exit_code, result = await run_command_and_wait(
+                binary_to_run=self.wget_path,
+                argument_list=argument_list,
+                timeout=self.timeout,
+                acceptable_return_codes=WGET_ACCEPTABLE_RETURN_CODES,
+                cwd=cwd)
+            return result
+
+        except CommandFailedError as e:
+            exit_code = e.returncode
+            raise
+        except CommandTimedOutError:
+            exit_code = "timeout"
+            raise
+
+        finally:
+            self.metrics.add_to_gauge(metrics.WGET_PROCESSES_RUNNING, -1)
+            # nothing gets recorded if we were cancelled
+            if exit_code is not None:
+                self.metrics.observe(metrics.WGET_SECONDS, time.monotonic() - start_time)
+                self.metrics.increment(metrics.WGET_EXITS, exit_code=exit_code)
 
 
 def get_wget_args(
@@ -82,12 +254,10 @@ def get_wget_args(
     submission_json:dict,
     url:str) ->list[str]:
 
-    cur_date = arrow.utcnow()
-
-    submission_id = submission_json["id"]
-    author_id = submission_json["authorID"]
-    author_str = submission_json["author"]
-
+    # the same fields `warc_writer.NativeWarcCapture` puts in its warcinfo record
+    warc_header_args = list()
+    for iter_field in warc_writer.get_submission_warcinfo_fields(submission_json):
+        warc_header_args.extend(["--warc-header", iter_field])
 
     wget_args =  [
         #"--no-verbose",
@@ -106,14 +276,7 @@ def get_wget_args(
         "5",
         "--warc-tempdir",
         tempdir,
-        "--warc-header",
-        f"sofurry_submission_id: {submission_id}",
-        "--warc-header",
-        f"sofurry_author_id: {author_id}",
-        "--warc-header",
-        f"sofurry_author: {author_str}",
-        "--warc-header",
-        f"date: {cur_date.isoformat()}",
+        *warc_header_args,
         "--warc-file",
         warc_path,
         "--recursive",
@@ -123,4 +286,5 @@ def get_wget_args(
         WGET_ACCEPT_REGEX,
         url
     ]
+
     return wget_args
\ No newline at end of file
@@ -0,0 +1,27 @@
+import pytest
+
+from sofurry_scrape import scrape_state
+from sofurry_scrape import utils
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+
+
+@pytest.fixture
+def state_database(tmp_path):
+
+    with scrape_state.ScrapeStateDatabase(tmp_path / scrape_state.STATE_DATABASE_FILENAME) as state_database:
+        yield state_database
+
+
+@pytest.fixture
+def single_user_scrape(tmp_path, state_database):
+    ''' a `SingleUserScrape` with its output path and state database open in a temporary folder '''
+
+    single_user_scrape = SingleUserScrape()
+    single_user_scrape.output_path = tmp_path
+    single_user_scrape.state_database = state_database
+    return single_user_scrape
+
+
+@pytest.fixture
+def folder_collection(tmp_path) -> utils.ProfileFolderCollection:
+    return utils.create_necessary_output_directories(tmp_path, "someone", "1")
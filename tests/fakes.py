@@ -0,0 +1,149 @@
+'''
+stand-ins for the site and the download stages, so a scrape's listing handling can be run without the network
+'''
+
+import asyncio
+import collections
+import hashlib
+
+import httpx
+
+from sofurry_scrape import scrape_state
+from sofurry_scrape import content_types
+from sofurry_scrape import warc_writer
+from sofurry_scrape.commands import single_user_scrape as single_user_scrape_module
+
+
+def make_submission_json(submission_id:int, content_type:content_types.ContentType=content_types.STORIES) -> dict:
+
+    return {
+        "id": str(submission_id),
+        "title": f"submission {submission_id}",
+        "authorID": "1",
+        "author": "someone",
+        "date": str(1600000000 + submission_id),
+        "tags": "fox, Story",
+        "contentType": content_type.content_type_id,
+        "link": f"https://www.sofurry.com/view/{submission_id}",
+        "thumbnail": f"https://www.sofurryfiles.com/std/thumb?page={submission_id}",
+    }
+
+
+class FakeListing:
+    '''
+    a json listing that acts like the site's: newest first, `page_size` submissions a page, and asking for a page
+    past the last one gives page 1 again. It doesn't say how many pages it has
+    '''
+
+    def __init__(self, submission_count:int, page_size:int=10, first_id:int=1000):
+
+        self.page_size = page_size
+        self.next_id = first_id + submission_count
+        # newest first
+        self.submissions = [make_submission_json(first_id + x) for x in reversed(range(submission_count))]
+        self.requested_pages = list()
+
+    def post_new_submission(self) -> dict:
+
+        submission_json = make_submission_json(self.next_id)
+        self.next_id += 1
+        self.submissions.insert(0, submission_json)
+        return submission_json
+
+    def get_page(self, page_number:int) -> list[dict]:
+
+        self.requested_pages.append(page_number)
+        page_count = max(1, -(-len(self.submissions) // self.page_size))
+        if page_number > page_count:
+            page_number = 1
+        return self.submissions[(page_number - 1) * self.page_size:page_number * self.page_size]
+
+    async def fetch_listing_page(self, content_type, url, params, page_number, httpx_client) -> dict:
+        ''' replaces `SingleUserScrape.fetch_listing_page` '''
+
+        await asyncio.sleep(0)
+        return {"items": self.get_page(page_number)}
+
+    async def discover_folder_ids(self, httpx_client, uid, content_type) -> list[str]:
+        ''' replaces `SingleUserScrape.discover_folder_ids`, there are no folders '''
+        return list()
+
+
+def use_stage_pipeline(single_user_scrape, mailbox_size:int=100):
+    ''' set up a `SingleUserScrape` the way `--use-stage-pipeline` does, `create_pipeline()` still has to be called '''
+
+    single_user_scrape.use_stage_pipeline = True
+    single_user_scrape.stage_mailbox_size = mailbox_size
+    single_user_scrape.stage_concurrency = dict(single_user_scrape_module.DEFAULT_PIPELINE_STAGE_CONCURRENCY)
+    single_user_scrape.stage_concurrency[single_user_scrape_module.PIPELINE_STAGE_WARC] = 1
+
+
+class FakeStages:
+    '''
+    replaces the stages of a `SingleUserScrape` that download a submission, each one just records the submission
+    as done in the state database like the real one would
+
+    @param stop_event - if given, it is set once `stop_after` submissions got through the metadata stage
+    '''
+
+    def __init__(self, single_user_scrape, stop_event:asyncio.Event|None=None, stop_after:int|None=None):
+
+        self.single_user_scrape = single_user_scrape
+        self.stop_event = stop_event
+        self.stop_after = stop_after
+        # stage -> submission ids, in the order they were done
+        self.done = collections.defaultdict(list)
+        # an async function the html stage calls with the work item before it does anything, to hold it up
+        self.html_gate = None
+
+        single_user_scrape.write_submission_metadata = self.write_submission_metadata
+        single_user_scrape.download_submission_thumbnail = self._make_stage(scrape_state.STAGE_THUMBNAIL)
+        single_user_scrape.download_submission_content = self._make_stage(scrape_state.STAGE_CONTENT)
+        single_user_scrape.capture_submission_warc = self._make_stage(scrape_state.STAGE_WARC)
+        single_user_scrape.download_submission_html = self.download_submission_html
+
+    async def write_submission_metadata(self, work_item):
+
+        submission_id = work_item.submission_folders.submission_id
+        profile_json_hash = hashlib.sha256(self.single_user_scrape.get_submission_json_bytes(work_item.submission_json)).hexdigest()
+        self.single_user_scrape.state_database.mark_stage_complete(submission_id, scrape_state.STAGE_METADATA, profile_json_hash)
+        self.done[scrape_state.STAGE_METADATA].append(submission_id)
+
+        if self.stop_event and self.stop_after is not None and len(self.done[scrape_state.STAGE_METADATA]) >= self.stop_after:
+            self.stop_event.set()
+
+    async def download_submission_html(self, work_item):
+
+        if self.html_gate is not None:
+            await self.html_gate(work_item)
+        await self._make_stage(scrape_state.STAGE_HTML)(work_item)
+
+    def _make_stage(self, stage:str):
+
+        async def _stage(work_item):
+            await asyncio.sleep(0)
+            submission_id = work_item.submission_folders.submission_id
+            self.single_user_scrape.state_database.mark_stage_complete(submission_id, stage)
+            self.done[stage].append(submission_id)
+
+        return _stage
+
+
+def write_submission_warc(warc_path, submission_json:dict, html:bytes) -> int:
+    ''' write a warc of a submission's page the way `NativeWarcCapture` would, @return its size '''
+
+    request = httpx.Request("GET", submission_json["link"])
+    response = httpx.Response(200, headers={"Content-Type": "text/html; charset=utf-8"}, content=html, request=request)
+
+    exchange = warc_writer.HttpExchange(
+        request=request,
+        status_code=200,
+        http_version="HTTP/1.1",
+        content_type=response.headers["Content-Type"],
+        content_encoding=None,
+        location=None,
+        payload=html,
+        request_block=warc_writer.get_http_request_block(request),
+        response_block=warc_writer.get_http_response_block(response, html))
+
+    return warc_writer.write_warc_file(warc_path, warc_writer.get_submission_warcinfo_fields(submission_json), [exchange])
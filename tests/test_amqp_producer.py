@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+
+from sofurry_scrape import content_types
+from sofurry_scrape.commands.amqp_producer import AmqpProducer, PublishingUserScrape
+
+from tests import fakes
+
+
+def test_content_types_argument(tmp_path):
+
+    credentials_path = tmp_path / "credentials.json"
+    credentials_path.write_text("{}")
+
+    parser = argparse.ArgumentParser()
+    AmqpProducer.create_subparser_command(parser.add_subparsers())
+
+    base_args = ["amqp_producer", "--usernames-to-scrape", "someone", "--output-path", str(tmp_path),
+        "--credentials-json-file", str(credentials_path), "--amqp-url", "amqp://localhost/"]
+
+    parsed_args = parser.parse_args(base_args)
+    assert content_types.get_content_types(parsed_args.content_types) == [content_types.STORIES]
+
+    parsed_args = parser.parse_args(base_args + ["--content-types", "artwork", "journals", "artwork"])
+    assert content_types.get_content_types(parsed_args.content_types) == [content_types.ARTWORK, content_types.JOURNALS]
+
+    parsed_args = parser.parse_args(base_args + ["--content-types", content_types.ALL_CONTENT_TYPES])
+    assert content_types.get_content_types(parsed_args.content_types) == list(content_types.CONTENT_TYPES.values())
+
+
+def test_requests_are_rate_limited(tmp_path):
+
+    credentials_path = tmp_path / "credentials.json"
+    credentials_path.write_text("{}")
+
+    parser = argparse.ArgumentParser()
+    AmqpProducer.create_subparser_command(parser.add_subparsers())
+    parsed_args = parser.parse_args(["amqp_producer", "--usernames-to-scrape", "someone", "--output-path", str(tmp_path),
+        "--credentials-json-file", str(credentials_path), "--amqp-url", "amqp://localhost/",
+        "--max-requests-per-second", "2", "--http-attempts", "7"])
+
+    publishing_user_scrape = PublishingUserScrape()
+    publishing_user_scrape.configure_http_from_parsed_args(parsed_args)
+
+    assert publishing_user_scrape.http_fetcher.max_attempts == 7
+    assert publishing_user_scrape.get_rate_limiter_for_url("https://api2.sofurry.com/browse/user/stories") is not None
+
+
+def test_every_content_type_is_published(tmp_path, state_database, folder_collection):
+
+    publishing_user_scrape = PublishingUserScrape()
+    publishing_user_scrape.output_path = tmp_path
+    publishing_user_scrape.state_database = state_database
+    publishing_user_scrape.submission_semaphore = asyncio.Semaphore(1)
+    publishing_user_scrape.content_types = content_types.get_content_types([content_types.ALL_CONTENT_TYPES])
+
+    # one listing per kind, each with submissions of that kind
+    listings = dict()
+    for iter_index, iter_content_type in enumerate(publishing_user_scrape.content_types):
+        listing = fakes.FakeListing(0)
+        listing.submissions = [fakes.make_submission_json(10000 * (iter_index + 1) + x, iter_content_type) for x in range(3)]
+        listings[iter_content_type.listing_url] = listing
+
+    async def _fetch_listing_page(content_type, url, params, page_number, httpx_client):
+        return await listings[url].fetch_listing_page(content_type, url, params, page_number, httpx_client)
+
+    published = list()
+
+    async def _publish(submission_json, *args):
+        published.append(submission_json["contentType"])
+
+    publishing_user_scrape.fetch_listing_page = _fetch_listing_page
+    publishing_user_scrape.discover_folder_ids = fakes.FakeListing(0).discover_folder_ids
+    publishing_user_scrape.handle_submission_json = _publish
+
+    asyncio.run(publishing_user_scrape.scrape_content_types(None, "1", folder_collection, tmp_path, None, asyncio.Event()))
+
+    assert sorted(published) == sorted(x.content_type_id for x in content_types.CONTENT_TYPES.values() for _ in range(3))
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+from sofurry_scrape import amqp_utils
+from sofurry_scrape import content_types
+from sofurry_scrape import rolling_warc
+from sofurry_scrape.commands import amqp_worker as amqp_worker_module
+
+from tests import fakes
+
+
+class _FakeMessage:
+
+    def __init__(self, username:str, submission_json:dict):
+
+        message = amqp_utils.create_work_item_message({"useralias": username, "userID": username}, submission_json)
+        self.body = message.body
+        self.headers = message.headers
+        self.acked = False
+
+    async def ack(self):
+        self.acked = True
+
+
+def test_idle_users_rolling_warcs_are_closed(tmp_path, monkeypatch):
+    '''
+    a long running worker sees a lot of users, with `--rolling-warcs user` it can't keep every one of their warcs open.
+    One whose submission is still being captured keeps theirs
+    '''
+
+    monkeypatch.setattr(amqp_worker_module, "MAX_IDLE_USER_ROLLING_WARCS", 2)
+
+    amqp_worker = amqp_worker_module.AmqpWorker()
+    amqp_worker.output_path = tmp_path / "output"
+    amqp_worker.tempdir = tmp_path
+    amqp_worker.stop_event = asyncio.Event()
+    single_user_scrape = amqp_worker.single_user_scrape
+    single_user_scrape.rolling_warcs = rolling_warc.ROLLING_WARCS_PER_USER
+    single_user_scrape.rolling_warc_max_size = 1
+
+    release_first_user = asyncio.Event()
+
+    async def _handle_submission_json(submission_json, httpx_client, folder_collection, temporary_dir, cookiefile, stop_event):
+        rolling_warc_writer = await single_user_scrape.get_rolling_warc_writer(folder_collection)
+        if folder_collection.username == "1000":
+            await release_first_user.wait()
+        capture_path = tmp_path / f"{submission_json['id']}.warc.gz"
+        fakes.write_submission_warc(capture_path, submission_json, b"<html>hi</html>")
+        await rolling_warc_writer.append_warc_file(capture_path)
+        return True
+
+    single_user_scrape.handle_submission_json_limited = _handle_submission_json
+
+    async def _run():
+        with single_user_scrape.open_output_path(amqp_worker.output_path):
+
+            first_user = asyncio.create_task(amqp_worker.handle_work_item(_FakeMessage("1000", fakes.make_submission_json(1000))))
+            await asyncio.sleep(0.01)
+
+            for iter_uid in range(2000, 2005):
+                message = _FakeMessage(str(iter_uid), fakes.make_submission_json(iter_uid))
+                await amqp_worker.handle_work_item(message)
+                assert message.acked
+
+            # the two most recent idle users, and the one still in progress
+            assert len(single_user_scrape.rolling_warc_writers) == 3
+            release_first_user.set()
+            await first_user
+
+    asyncio.run(_run())
+
+    # every warc got closed and indexed, including the one that was in progress while the others were being closed
+    indexed_ids = set()
+    for iter_cdxj_path in (tmp_path / "output").glob(f"*/{rolling_warc.ROLLING_WARC_DIRNAME}/*.cdxj"):
+        indexed_ids.update(json.loads(x.split(" ", 2)[2])["sofurry_submission_id"] for x in iter_cdxj_path.read_text().splitlines())
+    assert indexed_ids == {"1000", "2000", "2001", "2002", "2003", "2004"}
+
+
+def test_only_the_arguments_the_worker_uses_are_taken(tmp_path):
+
+    credentials_path = tmp_path / "credentials.json"
+    credentials_path.write_text("{}")
+
+    parser = argparse.ArgumentParser()
+    amqp_worker_module.AmqpWorker.create_subparser_command(parser.add_subparsers())
+    base_args = ["amqp_worker", "--output-path", str(tmp_path), "--credentials-json-file", str(credentials_path),
+        "--amqp-url", "amqp://localhost/"]
+
+    # going through the listings is the producer's job
+    for iter_listing_args in (["--incremental"], ["--use-stage-pipeline"], ["--content-types", "artwork"]):
+        with pytest.raises(SystemExit):
+            parser.parse_args(base_args + iter_listing_args)
+
+    amqp_worker = amqp_worker_module.AmqpWorker()
+    amqp_worker.single_user_scrape.configure_from_parsed_args(parser.parse_args(base_args), listing_arguments=False)
+    assert amqp_worker.single_user_scrape.content_types == list(content_types.CONTENT_TYPES.values())
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from sofurry_scrape import archive_verify
+from sofurry_scrape import blob_store
+from sofurry_scrape import scrape_state
+from sofurry_scrape import utils
+
+from tests import fakes
+
+THUMBNAIL = b"\xff\xd8\xff\xe0 a jpeg \xff\xd9"
+HTML = b"<html><body>a story</body></html>\n"
+
+
+def archive_submission(tmp_path, folder_collection, state_database, submission_json:dict) -> utils.SubmissionFolderCollection:
+    ''' write a submission folder the way a scrape would, with its thumbnail linked to a blob, and mark it done '''
+
+    folders = utils.get_submission_folder_collection(folder_collection.get_content_dir("stories"), submission_json)
+    folders.root_dir.mkdir(parents=True)
+
+    folders.info_json.write_text(json.dumps(submission_json))
+    folders.html.write_bytes(HTML)
+    fakes.write_submission_warc(folders.warc, submission_json, HTML)
+
+    thumbnail_hash = hashlib.sha256(THUMBNAIL).hexdigest()
+    blob_path = blob_store.BlobStore(tmp_path / blob_store.BLOB_STORE_DIRNAME, state_database).get_blob_path(thumbnail_hash)
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    blob_path.write_bytes(THUMBNAIL)
+    os.link(blob_path, folders.thumbnail)
+    state_database.save_url_blob_hash(submission_json["thumbnail"], thumbnail_hash)
+
+    utils.update_checksums(folders.checksums,
+        {x: hashlib.sha256(x.read_bytes()).hexdigest() for x in (folders.info_json, folders.thumbnail, folders.html, folders.warc)})
+
+    for iter_stage in archive_verify.PART_STAGES.values():
+        state_database.mark_stage_complete(submission_json["id"], iter_stage)
+    state_database.mark_stage_complete(submission_json["id"], scrape_state.STAGE_PUBLISHED)
+    return folders
+
+
+def _verify(tmp_path, folders) -> archive_verify.SubmissionResult:
+    return archive_verify.verify_submission(tmp_path, archive_verify.SubmissionToVerify(folders.root_dir, None, True))[1]
+
+
+def test_intact_submission_has_no_problems(tmp_path, folder_collection, state_database):
+
+    folders = archive_submission(tmp_path, folder_collection, state_database, fakes.make_submission_json(1000))
+
+    submission_result = _verify(tmp_path, folders)
+
+    assert submission_result.problems == []
+    assert submission_result.submission_dir == str(folders.root_dir.relative_to(tmp_path))
+
+
+def test_cut_off_files_are_found(tmp_path, folder_collection, state_database):
+
+    folders = archive_submission(tmp_path, folder_collection, state_database, fakes.make_submission_json(1000))
+    # the same size, so only the hash and the end marker can tell
+    folders.thumbnail.unlink()
+    folders.thumbnail.write_bytes(THUMBNAIL[:-2] + b"\x00\x00")
+    folders.html.write_bytes(HTML[:len(HTML) // 2])
+    warc = folders.warc.read_bytes()
+    folders.warc.write_bytes(warc[:len(warc) // 2])
+
+    submission_result = _verify(tmp_path, folders)
+
+    assert set(x.part for x in submission_result.problems) == {
+        archive_verify.PART_THUMBNAIL, archive_verify.PART_HTML, archive_verify.PART_WARC}
+    assert "the thumbnail is cut off" in [x.message for x in submission_result.problems]
+
+
+def test_warc_of_another_submission_is_found(tmp_path, folder_collection, state_database):
+
+    folders = archive_submission(tmp_path, folder_collection, state_database, fakes.make_submission_json(1000))
+    fakes.write_submission_warc(folders.warc, fakes.make_submission_json(1001), HTML)
+
+    submission_result = _verify(tmp_path, folders)
+
+    # the checksum is off too, both are about the warc
+    assert set(x.part for x in submission_result.problems) == {archive_verify.PART_WARC}
+    assert any("not `1000`" in x.message for x in submission_result.problems)
+
+
+def test_verify_submissions_only_reports_broken_ones(tmp_path, folder_collection, state_database):
+
+    folders = [archive_submission(tmp_path, folder_collection, state_database, fakes.make_submission_json(x)) for x in range(1000, 1003)]
+    folders[1].html.unlink()
+
+    batch_result = archive_verify.verify_submissions(tmp_path,
+        [archive_verify.SubmissionToVerify(x.root_dir, None, True) for x in folders])
+
+    assert batch_result.checked_count == 3
+    assert [x.submission_id for x in batch_result.broken] == ["1001"]
+    assert batch_result.broken[0].problems == [archive_verify.Problem(archive_verify.PART_HTML, f"`{folders[1].html.name}` is missing")]
+
+    report_path = tmp_path / archive_verify.VERIFY_REPORT_FILENAME
+    archive_verify.write_report(report_path, {"checked": batch_result.checked_count}, batch_result.broken)
+    report_lines = [json.loads(x) for x in report_path.read_text().splitlines()]
+    assert report_lines[0] == {"checked": 3}
+    assert [x["submission_id"] for x in report_lines[1:]] == ["1001"]
+
+
+def test_requeue_only_forgets_the_broken_parts(tmp_path, folder_collection, state_database):
+
+    submission_json = fakes.make_submission_json(1000)
+    folders = archive_submission(tmp_path, folder_collection, state_database, submission_json)
+    state_database.save_warc_location("1000", "warcs/sofurry-00000.warc.gz", 0, 100)
+    thumbnail_hash = state_database.get_url_blob_hash(submission_json["thumbnail"])
+    blob_path = blob_store.BlobStore(tmp_path / blob_store.BLOB_STORE_DIRNAME, state_database).get_blob_path(thumbnail_hash)
+    # a bad blob breaks the thumbnail, since that is just a link to it
+    blob_path.write_bytes(b"\xff\xd8 cut off")
+
+    submission_result = archive_verify.SubmissionResult("1000", str(folders.root_dir.relative_to(tmp_path)), [
+        archive_verify.Problem(archive_verify.PART_THUMBNAIL, "the thumbnail is cut off"),
+        archive_verify.Problem(archive_verify.PART_WARC, "the warc can't be read")])
+    archive_verify.requeue_submission(tmp_path, state_database, submission_result)
+
+    for iter_stage in (scrape_state.STAGE_THUMBNAIL, scrape_state.STAGE_WARC, scrape_state.STAGE_PUBLISHED):
+        assert not state_database.is_stage_complete("1000", iter_stage)
+    for iter_stage in (scrape_state.STAGE_METADATA, scrape_state.STAGE_HTML):
+        assert state_database.is_stage_complete("1000", iter_stage)
+
+    assert state_database.get_warc_location("1000") is None
+    # otherwise the blob store would link the thumbnail to the broken blob again instead of downloading it
+    assert state_database.get_url_blob_hash(submission_json["thumbnail"]) is None
+    assert not blob_path.exists()
+
+
+def test_verify_doesnt_import_the_http_stack():
+
+    # in a new interpreter, since other tests have imported httpx already
+    imported_modules = subprocess.run([sys.executable, "-c",
+        "import sys; from sofurry_scrape.commands import verify; print(' '.join(sys.modules))"],
+        capture_output=True, check=True, text=True).stdout.split()
+
+    assert "sofurry_scrape.archive_verify" in imported_modules
+    assert "httpx" not in imported_modules
@@ -0,0 +1,96 @@
+import pytest
+
+from sofurry_scrape import catalog
+
+from tests import fakes
+
+USER_INFO = {"userID": "1", "useralias": "someone"}
+
+
+@pytest.fixture
+def catalog_database(tmp_path, monkeypatch):
+    ''' a catalog whose clock only moves when `catalog_database.now` is changed '''
+
+    with catalog.CatalogDatabase(tmp_path / catalog.CATALOG_DATABASE_FILENAME) as catalog_database:
+        catalog_database.now = "2026-01-01T00:00:00.000000+00:00"
+        monkeypatch.setattr(catalog, "get_timestamp", lambda when=None: catalog_database.now)
+        yield catalog_database
+
+
+def test_unchanged_submission_keeps_when_it_changed(catalog_database):
+
+    submission_json = fakes.make_submission_json(1000)
+    catalog_database.update_user(USER_INFO, "someone (1)", "profile hash")
+    catalog_database.update_submission(submission_json, "someone (1)/stories/1000", "hash 1")
+
+    catalog_database.now = "2026-02-01T00:00:00.000000+00:00"
+    catalog_database.update_user(USER_INFO, "someone (1)", "profile hash")
+    catalog_database.update_submission(submission_json, "someone (1)/stories/1000", "hash 1")
+
+    submission = catalog_database.get_submission(1000)
+    assert submission["captured_at"] == "2026-02-01T00:00:00.000000+00:00"
+    assert submission["changed_at"] == "2026-01-01T00:00:00.000000+00:00"
+    assert catalog_database.get_users_changed_since("2026-01-15") == []
+    assert catalog_database.get_counts() == (1, 1)
+
+
+def test_changed_submission_is_updated_everywhere(catalog_database):
+
+    submission_json = fakes.make_submission_json(1000)
+    catalog_database.update_user(USER_INFO, "someone (1)", "profile hash")
+    catalog_database.update_submission(submission_json, "someone (1)/stories/1000", "hash 1")
+
+    catalog_database.now = "2026-02-01T00:00:00.000000+00:00"
+    changed_submission_json = dict(submission_json, title="a brand new title", tags="wolf")
+    catalog_database.update_submission(changed_submission_json, "someone (1)/stories/1000", "hash 2")
+
+    submission = catalog_database.get_submission(1000)
+    assert submission["title"] == "a brand new title"
+    assert submission["changed_at"] == "2026-02-01T00:00:00.000000+00:00"
+    # the author counts as changed when one of their submissions does
+    assert [x["uid"] for x in catalog_database.get_users_changed_since("2026-01-15")] == ["1"]
+
+    # the tags and the full text index got the new ones, not both
+    assert [x["submission_id"] for x in catalog_database.find_submissions(tag="wolf")] == ["1000"]
+    assert catalog_database.find_submissions(tag="fox") == []
+    assert [x["submission_id"] for x in catalog_database.find_submissions(title="brand new")] == ["1000"]
+    assert catalog_database.find_submissions(title="submission") == []
+    assert catalog_database.get_counts() == (1, 1)
+
+
+def test_find_submissions_filters(catalog_database):
+
+    for iter_submission_id in range(1000, 1005):
+        catalog_database.now = f"2026-01-0{iter_submission_id - 999}T00:00:00.000000+00:00"
+        catalog_database.update_submission(fakes.make_submission_json(iter_submission_id),
+            f"someone (1)/stories/{iter_submission_id}", f"hash {iter_submission_id}")
+
+    # newest capture first
+    assert [x["submission_id"] for x in catalog_database.find_submissions(author_id="1", limit=2)] == ["1004", "1003"]
+    assert [x["submission_id"] for x in catalog_database.find_submissions(text="1002")] == ["1002"]
+    assert [x["submission_id"] for x in catalog_database.find_submissions(tag=" Story ",
+        captured_since="2026-01-02", captured_before="2026-01-04")] == ["1002", "1001"]
+    # quotes and the like aren't full text search syntax
+    assert catalog_database.find_submissions(text="\"unbalanced") == []
+
+
+def test_bulk_load_keeps_the_first_of_a_duplicate_and_indexes_everything(catalog_database):
+
+    catalog_database.start_bulk_load()
+    submission_rows = [catalog.get_submission_row(fakes.make_submission_json(x), f"someone (1)/stories/{x}", f"hash {x}", "2026-01-01")
+        for x in range(1000, 1003)]
+    duplicate_row = catalog.get_submission_row(dict(fakes.make_submission_json(1000), title="the copy"),
+        "someone (1)/old/1000", "other hash", "2026-01-02")
+    catalog_database.insert_rows([catalog.get_user_row(USER_INFO, "someone (1)", "profile hash", "2025-12-01")],
+        submission_rows + [duplicate_row])
+    catalog_database.finish_bulk_load()
+
+    assert catalog_database.get_counts() == (1, 3)
+    assert catalog_database.get_submission(1000)["title"] == "submission 1000"
+    assert [x["submission_id"] for x in catalog_database.find_submissions(title="1001")] == ["1001"]
+    # the user's last change is that of their newest submission
+    assert catalog_database.get_users_changed_since("2026-01-01")[0]["last_changed_at"] == "2026-01-01"
+
+    # the full text index is kept up to date again afterwards
+    catalog_database.update_submission(fakes.make_submission_json(1003), "someone (1)/stories/1003", "hash 1003")
+    assert [x["submission_id"] for x in catalog_database.find_submissions(title="1003")] == ["1003"]
@@ -0,0 +1,41 @@
+import asyncio
+
+from sofurry_scrape import metrics
+from sofurry_scrape import scrape_state
+from sofurry_scrape import content_types
+
+from tests import fakes
+from tests.test_single_user_scrape import walk_listing
+
+
+def test_progress_is_that_of_the_stage_with_the_most_left():
+
+    metrics_registry = metrics.MetricsRegistry()
+    metrics_registry.increment(metrics.SUBMISSIONS_DISCOVERED, 10)
+    for iter_stage, iter_expected, iter_completed in [("metadata", 10, 10), ("thumbnail", 10, 9), ("content", 4, 1)]:
+        metrics_registry.increment(metrics.SUBMISSION_STAGE_EXPECTED, iter_expected, stage=iter_stage)
+        metrics_registry.increment(metrics.SUBMISSION_STAGE_COMPLETIONS, iter_completed, stage=iter_stage)
+
+    progress = metrics.get_progress(metrics_registry, ["metadata", "thumbnail", "content"])
+
+    assert progress["discovered"] == 10
+    assert progress["done"] == 7
+    assert progress["stage_completions"] == {"metadata": 10, "thumbnail": 9, "content": 1}
+
+
+def test_stories_dont_hold_up_the_progress_on_the_content_stage(single_user_scrape, folder_collection, tmp_path):
+    '''
+    stories never go through the content stage, so a scrape of stories and artwork can still get to 100%
+    '''
+
+    single_user_scrape.content_types = [content_types.STORIES, content_types.ARTWORK]
+    single_user_scrape.fetch_listing_page = fakes.FakeListing(25).fetch_listing_page
+    fakes.FakeStages(single_user_scrape)
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    stage_names = single_user_scrape.report_metrics().stage_names
+    assert scrape_state.STAGE_CONTENT in stage_names
+
+    progress = metrics.get_progress(single_user_scrape.metrics, stage_names)
+    assert progress["discovered"] == 25
+    assert progress["done"] == 25
@@ -0,0 +1,64 @@
+import asyncio
+
+from sofurry_scrape import utils
+from sofurry_scrape import scrape_state
+from sofurry_scrape.commands.multi_user_scrape import MultiUserScrape
+
+from tests import fakes
+
+
+def test_max_concurrent_users_holds_with_the_stage_pipeline(tmp_path, state_database):
+    '''
+    with `--use-stage-pipeline`, a user's submissions are downloaded by the pipeline after its listings are queued,
+    so a user is only done once they are, and the next user can't start before that
+    '''
+
+    multi_user_scrape = MultiUserScrape()
+    single_user_scrape = multi_user_scrape.single_user_scrape
+    single_user_scrape.output_path = tmp_path
+    single_user_scrape.state_database = state_database
+    fakes.use_stage_pipeline(single_user_scrape)
+
+    listings = {"1": fakes.FakeListing(30, first_id=1000), "2": fakes.FakeListing(30, first_id=5000)}
+
+    async def _fetch_listing_page(content_type, url, params, page_number, httpx_client):
+        return await listings[params["by"]].fetch_listing_page(content_type, url, params, page_number, httpx_client)
+
+    single_user_scrape.fetch_listing_page = _fetch_listing_page
+    single_user_scrape.discover_folder_ids = listings["1"].discover_folder_ids
+    stages = fakes.FakeStages(single_user_scrape)
+
+    # the uid of the user each submission being downloaded belongs to
+    active_uids = set()
+    most_active_uids = 0
+
+    async def _html_gate(work_item):
+        nonlocal most_active_uids
+        active_uids.add(work_item.folder_collection.uid)
+        most_active_uids = max(most_active_uids, len(active_uids))
+        await asyncio.sleep(0.001)
+
+    stages.html_gate = _html_gate
+
+    async def _scrape_user(httpx_client, username, output_path, tempdir, cookiefile_path, stop_event):
+        folder_collection = utils.create_necessary_output_directories(output_path, username, username)
+        await single_user_scrape.scrape_content_types(httpx_client, username, folder_collection, tempdir, cookiefile_path, stop_event)
+        active_uids.discard(username)
+
+    single_user_scrape.scrape_user = _scrape_user
+
+    async def _run():
+        stop_event = asyncio.Event()
+        single_user_scrape.submission_semaphore = asyncio.Semaphore(4)
+        user_semaphore = asyncio.Semaphore(1)
+        async with single_user_scrape.create_pipeline(stop_event):
+            async with asyncio.TaskGroup() as task_group:
+                for iter_username in listings.keys():
+                    task_group.create_task(multi_user_scrape.scrape_user_limited(
+                        user_semaphore, None, iter_username, tmp_path, tmp_path, None, stop_event))
+
+    asyncio.run(_run())
+
+    assert not multi_user_scrape.failed_usernames
+    assert len(stages.done[scrape_state.STAGE_HTML]) == 60
+    assert most_active_uids == 1
@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from sofurry_scrape import pagination
+
+from tests import fakes
+
+
+@pytest.mark.parametrize("submission_count", [1, 10, 11, 35, 100, 1000, 1001])
+def test_probe_page_count_finds_the_last_page(submission_count):
+
+    listing = fakes.FakeListing(submission_count)
+    first_page = listing.get_page(1)
+    listing.requested_pages.clear()
+
+    async def _fetch_page(page_number:int) -> list[dict]:
+        return listing.get_page(page_number)
+
+    page_count, fetched_pages = asyncio.run(pagination.probe_page_count(_fetch_page, first_page, lambda x: x["id"]))
+
+    assert page_count == -(-submission_count // 10)
+    # bisecting, not going through every page
+    assert len(listing.requested_pages) <= 2 * max(1, page_count).bit_length() + 1
+    assert all(fetched_pages[x] == listing.get_page(x) for x in fetched_pages)
+    assert max(fetched_pages, default=1) <= page_count
+
+
+def test_iter_pages_prefetches_and_cancels_when_stopped_early():
+
+    listing = fakes.FakeListing(100)
+    fetched_pages = {1: listing.get_page(1)}
+    listing.requested_pages.clear()
+    never_set = asyncio.Event()
+
+    def _fetch_page(page_number:int):
+        # counted when `iter_pages()` asks for it, a prefetch can be cancelled before its coroutine ever starts
+        page = listing.get_page(page_number)
+
+        async def _fetch() -> list[dict]:
+            # the pages past the one we stop at never come back, so they are still being prefetched when we stop
+            if page_number > 3:
+                await never_set.wait()
+            return page
+
+        return _fetch()
+
+    async def _run() -> list[int]:
+
+        seen_pages = list()
+        async with contextlib.aclosing(pagination.iter_pages(_fetch_page, range(1, 11), 2, fetched_pages)) as pages:
+            async for iter_page_number, iter_page in pages:
+                assert iter_page == listing.submissions[(iter_page_number - 1) * 10:iter_page_number * 10]
+                seen_pages.append(iter_page_number)
+                if iter_page_number == 3:
+                    break
+
+        # the prefetches got cancelled and waited for, so nothing is left running
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        return seen_pages
+
+    assert asyncio.run(_run()) == [1, 2, 3]
+    # page 1 was already fetched, and the two after page 3 were being prefetched when we stopped
+    assert listing.requested_pages == [2, 3, 4, 5]
+
+
+def test_iter_pages_without_prefetching_asks_for_one_page_at_a_time():
+
+    listing = fakes.FakeListing(100)
+    requested_before_yield = list()
+
+    async def _fetch_page(page_number:int) -> list[dict]:
+        return listing.get_page(page_number)
+
+    async def _run():
+        async with contextlib.aclosing(pagination.iter_pages(_fetch_page, range(1, 11), 0)) as pages:
+            async for iter_page_number, _ in pages:
+                # let anything that was started run
+                await asyncio.sleep(0)
+                requested_before_yield.append(list(listing.requested_pages))
+                if iter_page_number == 2:
+                    break
+
+    asyncio.run(_run())
+
+    assert requested_before_yield == [[1], [1, 2]]
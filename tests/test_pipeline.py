@@ -0,0 +1,120 @@
+import asyncio
+
+from sofurry_scrape import pipeline
+
+
+def test_tracker_counts_the_items_handed_to_later_stages():
+
+    async def _run():
+
+        stop_event = asyncio.Event()
+        handled = list()
+        the_pipeline = pipeline.Pipeline(stop_event)
+        tracker = pipeline.WorkTracker()
+
+        async def _first(item):
+            await asyncio.sleep(0.01)
+            await the_pipeline.put("second", item, (tracker,))
+
+        async def _second(item):
+            await asyncio.sleep(0.02)
+            handled.append(item)
+
+        the_pipeline.add_stage("first", _first, 2, 10)
+        the_pipeline.add_stage("second", _second, 1, 10)
+
+        async with the_pipeline:
+            for iter_item in range(5):
+                await the_pipeline.put("first", iter_item, (tracker,))
+            await tracker.wait()
+            # every item has been through both stages by the time the tracker is done
+            assert sorted(handled) == list(range(5))
+            assert tracker.pending_count == 0
+            assert tracker.skipped_count == 0
+
+    asyncio.run(_run())
+
+
+def test_tracker_counts_skipped_items_once_stopped():
+
+    async def _run():
+
+        stop_event = asyncio.Event()
+        done_trackers = list()
+        the_pipeline = pipeline.Pipeline(stop_event)
+        tracker = pipeline.WorkTracker(on_done=done_trackers.append)
+
+        async def _handler(item):
+            if item == 0:
+                stop_event.set()
+
+        # one worker, so the items after the first are all taken out after the stop event is set
+        the_pipeline.add_stage("only", _handler, 1, 10)
+
+        async with the_pipeline:
+            for iter_item in range(4):
+                await the_pipeline.put("only", iter_item, (tracker,))
+            await tracker.wait()
+
+        assert tracker.skipped_count == 3
+        assert done_trackers == [tracker]
+
+    asyncio.run(_run())
+
+
+def test_drain_waits_for_items_handed_back_to_an_earlier_stage():
+    '''
+    like `--html-from-warc`, where the warc stage gives each item to the html stage that was added before it
+    '''
+
+    async def _run():
+
+        the_pipeline = pipeline.Pipeline(asyncio.Event())
+        handled = list()
+
+        async def _html(item):
+            await asyncio.sleep(0.01)
+            handled.append(item)
+
+        async def _warc(item):
+            # the html stage is long done with everything it had by now
+            await asyncio.sleep(0.02)
+            await the_pipeline.put("html", item)
+
+        the_pipeline.add_stage("html", _html, 1, 10)
+        the_pipeline.add_stage("warc", _warc, 1, 10)
+
+        async with the_pipeline:
+            for iter_item in range(3):
+                await the_pipeline.put("warc", iter_item)
+
+        return handled
+
+    assert sorted(asyncio.run(_run())) == [0, 1, 2]
+
+
+def test_tracker_counts_deferred_items_as_skipped():
+
+    async def _run():
+
+        the_pipeline = pipeline.Pipeline(asyncio.Event())
+        deferred = list()
+        tracker = pipeline.WorkTracker()
+
+        async def _handler(item):
+            if item == 1:
+                raise Exception("the site is down")
+
+        the_pipeline.add_stage("only", _handler, 1, 10, on_failure=lambda item, e: deferred.append(item))
+
+        async with the_pipeline:
+            for iter_item in range(3):
+                await the_pipeline.put("only", iter_item, (tracker,))
+            await tracker.wait()
+
+        assert deferred == [1]
+        # it only gets tried again later, so it isn't done yet
+        assert tracker.skipped_count == 1
+        assert the_pipeline.stages["only"].counters.deferred == 1
+
+    asyncio.run(_run())
@@ -0,0 +1,147 @@
+import asyncio
+import pathlib
+import shutil
+
+import httpx
+import pytest
+
+from sofurry_scrape import http_fetch
+from sofurry_scrape import rate_limit
+from sofurry_scrape import wget_utils
+
+
+def test_get_host_group():
+
+    assert rate_limit.get_host_group("www.sofurry.com") == rate_limit.HOST_GROUP_WWW
+    assert rate_limit.get_host_group("api2.sofurry.com") == rate_limit.HOST_GROUP_API
+    assert rate_limit.get_host_group("www.sofurryfiles.com") == rate_limit.HOST_GROUP_FILES
+    assert rate_limit.get_host_group("example.com") == rate_limit.HOST_GROUP_OTHER
+
+
+def test_backs_off_by_half_once_per_cooldown():
+
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=10, max_concurrency=8)
+    assert (limiter.requests_per_second, limiter.concurrency_limit) == (5, 4)
+
+    limiter.record_result(429)
+    assert (limiter.requests_per_second, limiter.concurrency_limit) == (2.5, 2)
+
+    # the rest of a burst of errors from requests that were already in flight doesn't cut it again
+    limiter.record_result(503)
+    limiter.record_result(None)
+    assert (limiter.requests_per_second, limiter.concurrency_limit) == (2.5, 2)
+
+    limiter.last_backoff -= limiter.backoff_cooldown_seconds
+    limiter.record_result(None)
+    assert (limiter.requests_per_second, limiter.concurrency_limit) == (1.25, 1)
+
+
+def test_ramps_up_on_healthy_responses_without_going_over_the_max():
+
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=10, max_concurrency=8)
+
+    for _ in range(200):
+        limiter.record_result(200, latency_seconds=0.01)
+
+    assert limiter.requests_per_second == 10
+    assert limiter.concurrency_limit == 8
+
+
+def test_backs_off_when_latency_gets_much_worse():
+
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=10, max_concurrency=8)
+    limiter.record_result(200, latency_seconds=0.1, endpoint="listing")
+    concurrency_limit = limiter.concurrency_limit
+
+    limiter.record_result(200, latency_seconds=2.0, endpoint="listing")
+    assert limiter.concurrency_limit == concurrency_limit / 2
+    # the slower site is the new normal, so it doesn't keep backing off
+    assert limiter.best_latency == dict()
+
+
+def test_latency_is_only_compared_with_the_same_kind_of_request():
+    '''
+    the listing json and the submission pages share a host, the pages being slower doesn't mean the site is struggling
+    '''
+
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=10, max_concurrency=8)
+
+    for _ in range(50):
+        limiter.record_result(200, latency_seconds=0.05, endpoint="listing")
+        limiter.record_result(200, latency_seconds=1.0, endpoint="submission_html")
+
+    assert limiter.last_backoff == 0.0
+    assert (limiter.requests_per_second, limiter.concurrency_limit) == (10, 8)
+
+
+def test_transport_reports_the_endpoint_of_each_request():
+
+    recorded_results = list()
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=1000, max_concurrency=2)
+    limiter.record_result = lambda *args: recorded_results.append(args)
+
+    class _Registry:
+        def get_limiter_for_host(self, host):
+            return limiter
+
+    async def _run():
+
+        transport = rate_limit.RateLimitedTransport(_Registry(), httpx.MockTransport(lambda request: httpx.Response(200)))
+        async with httpx.AsyncClient(transport=transport) as httpx_client:
+            await http_fetch.HttpFetcher(max_attempts=1).fetch(httpx_client, "https://www.sofurry.com/", http_fetch.ENDPOINT_LISTING)
+            await httpx_client.get("https://www.sofurry.com/")
+
+    asyncio.run(_run())
+
+    assert [x[3] for x in recorded_results] == [http_fetch.ENDPOINT_LISTING, None]
+
+
+def test_retry_after_pauses_the_limiter():
+
+    limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=10, max_concurrency=8)
+    limiter.record_result(429, retry_after="30")
+
+    assert limiter.paused_until - limiter.last_backoff == pytest.approx(30)
+    assert rate_limit.parse_retry_after("not a date") is None
+
+
+def test_concurrency_limit_holds_requests_until_one_is_released():
+
+    async def _run():
+
+        limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=1000, max_concurrency=2)
+        await limiter.acquire()
+
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        await limiter.release()
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(_run())
+
+
+@pytest.mark.skipif(shutil.which("sleep") is None, reason="needs `sleep` to stand in for wget-at")
+def test_wget_capture_only_takes_a_token():
+    '''
+    a capture can run for a long time, it shouldn't keep the requests to the same host from getting a slot
+    '''
+
+    async def _run():
+
+        # room for one request at a time
+        limiter = rate_limit.HostRateLimiter("test", max_requests_per_second=1000, max_concurrency=2)
+        process_pool = wget_utils.WgetProcessPool(pathlib.Path(shutil.which("sleep")), 1, timeout=10, max_attempts=1)
+
+        capture = asyncio.create_task(process_pool.run_capture(["0.5"], pathlib.Path("."), limiter))
+        await asyncio.sleep(0.1)
+
+        await asyncio.wait_for(limiter.acquire(), 0.2)
+        assert not capture.done()
+        await limiter.release()
+
+        await capture
+        assert limiter.in_flight == 0
+
+    asyncio.run(_run())
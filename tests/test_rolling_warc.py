@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from sofurry_scrape import rolling_warc
+from sofurry_scrape import warc_reader
+from sofurry_scrape import warc_writer
+from sofurry_scrape.commands.single_user_scrape import SingleUserScrape
+
+from tests import fakes
+
+
+def _read_cdxj(cdxj_path) -> list[dict]:
+    return [json.loads(x.split(" ", 2)[2]) for x in cdxj_path.read_text().splitlines()]
+
+
+def test_cdxj_offsets_point_at_each_submissions_records(tmp_path):
+
+    rolling_warc_writer = rolling_warc.RollingWarcWriter(tmp_path / "warcs", "sofurry_test", max_size=2048)
+    rolling_warc_writer.open()
+
+    submissions = [fakes.make_submission_json(x) for x in range(1000, 1004)]
+    warc_locations = dict()
+
+    async def _append_all():
+        for iter_submission_json in submissions:
+            capture_path = tmp_path / f"{iter_submission_json['id']}.warc.gz"
+            fakes.write_submission_warc(capture_path, iter_submission_json, f"<html>{iter_submission_json['id']}</html>".encode() * 50)
+            warc_locations[iter_submission_json["id"]] = await rolling_warc_writer.append_warc_file(capture_path)
+
+    asyncio.run(_append_all())
+    rolling_warc_writer.close()
+
+    # small enough that it rolled over, and a submission is never split between two warcs
+    warc_paths = sorted((tmp_path / "warcs").glob("*.warc.gz"))
+    assert len(warc_paths) > 1
+
+    for iter_submission_json in submissions:
+        warc_location = warc_locations[iter_submission_json["id"]]
+        content = warc_writer.get_page_content_from_warc(
+            warc_location.warc_path, iter_submission_json["link"], warc_location.offset, warc_location.length)
+        assert content == f"<html>{iter_submission_json['id']}</html>".encode() * 50
+
+    indexed = dict()
+    for iter_warc_path in warc_paths:
+        cdxj_path = rolling_warc.get_cdxj_path(iter_warc_path)
+        # the index written as the warc was appended to is the same as the one made by reading it back
+        assert cdxj_path.read_text().splitlines() == rolling_warc.index_warc_file(iter_warc_path)
+
+        for iter_fields in _read_cdxj(cdxj_path):
+            record = next(warc_reader.iter_warc_records(iter_warc_path, int(iter_fields["offset"]), int(iter_fields["length"])))
+            assert record.headers["warc-target-uri"].strip("<>") == iter_fields["url"]
+            indexed[iter_fields["sofurry_submission_id"]] = iter_fields
+
+    assert set(indexed.keys()) == set(x["id"] for x in submissions)
+    assert all(x["status"] == "200" and x["mime"] == "text/html" for x in indexed.values())
+
+
+def test_unfinished_warc_is_indexed_when_opened_again(tmp_path):
+    ''' a run that stopped while writing a rolling warc leaves it without an index, and maybe with half a record '''
+
+    rolling_warc_writer = rolling_warc.RollingWarcWriter(tmp_path, "sofurry_test", max_size=1024 * 1024)
+    rolling_warc_writer.open()
+
+    submission_json = fakes.make_submission_json(1000)
+    fakes.write_submission_warc(tmp_path / "capture.warc.gz", submission_json, b"<html>hi</html>")
+    asyncio.run(rolling_warc_writer.append_warc_file(tmp_path / "capture.warc.gz"))
+    warc_path = rolling_warc_writer.warc_path
+    # like the run stopping halfway through appending the next submission
+    fakes.write_submission_warc(tmp_path / "next.warc.gz", fakes.make_submission_json(1001), b"<html>hi</html>" * 100)
+    next_warc = (tmp_path / "next.warc.gz").read_bytes()
+    rolling_warc_writer.f.write(next_warc[:len(next_warc) // 2])
+    rolling_warc_writer.f.close()
+
+    rolling_warc.RollingWarcWriter(tmp_path, "sofurry_test", max_size=1024 * 1024).open()
+
+    assert [x["sofurry_submission_id"] for x in _read_cdxj(rolling_warc.get_cdxj_path(warc_path))] == ["1000"]
+
+
+def test_per_user_rolling_warc_is_closed_once_the_user_is_done(tmp_path):
+    '''
+    with `--rolling-warcs user`, keeping every user's warc open until the end of the run runs out of open files
+    '''
+
+    single_user_scrape = SingleUserScrape()
+    single_user_scrape.rolling_warcs = rolling_warc.ROLLING_WARCS_PER_USER
+    single_user_scrape.rolling_warc_max_size = 1
+
+    async def _get_user_info(httpx_client, username):
+        return {"useralias": username, "userID": username}
+
+    async def _scrape_content_types(httpx_client, uid, folder_collection, temporary_dir, cookiefile, stop_event):
+        submission_json = fakes.make_submission_json(int(uid))
+        fakes.write_submission_warc(tmp_path / f"{uid}.warc.gz", submission_json, b"<html>hi</html>")
+        rolling_warc_writer = await single_user_scrape.get_rolling_warc_writer(folder_collection)
+        await rolling_warc_writer.append_warc_file(tmp_path / f"{uid}.warc.gz")
+
+    single_user_scrape.get_user_info = _get_user_info
+    single_user_scrape.scrape_content_types = _scrape_content_types
+
+    async def _run():
+        with single_user_scrape.open_output_path(tmp_path / "output"):
+            for iter_username in ("1000", "2000"):
+                await single_user_scrape.scrape_user(None, iter_username, tmp_path / "output", tmp_path, None, asyncio.Event())
+                assert single_user_scrape.rolling_warc_writers == dict()
+
+    asyncio.run(_run())
+
+    cdxj_paths = sorted((tmp_path / "output").glob(f"*/{rolling_warc.ROLLING_WARC_DIRNAME}/*.cdxj"))
+    assert len(cdxj_paths) == 2
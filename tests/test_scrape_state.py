@@ -0,0 +1,57 @@
+from sofurry_scrape import scrape_state
+
+LISTING_KEY = "listing"
+
+
+def test_stages_are_kept_per_submission(state_database):
+
+    state_database.mark_stage_complete(1000, scrape_state.STAGE_METADATA, "hash 1")
+    state_database.mark_stage_complete(1000, scrape_state.STAGE_HTML)
+    state_database.mark_stage_complete(1001, scrape_state.STAGE_METADATA, "hash 2")
+
+    assert state_database.is_stage_complete("1000", scrape_state.STAGE_HTML)
+    assert not state_database.is_stage_complete("1001", scrape_state.STAGE_HTML)
+    assert state_database.get_stage_hash(1000, scrape_state.STAGE_METADATA) == "hash 1"
+    assert state_database.get_submission_ids_with_stage(scrape_state.STAGE_METADATA) == {"1000", "1001"}
+
+    state_database.clear_submission_stages(1000)
+    assert state_database.get_submission_ids_with_stage(scrape_state.STAGE_METADATA) == {"1001"}
+
+
+def test_listing_checkpoint_survives_reopening(tmp_path):
+
+    database_path = tmp_path / scrape_state.STATE_DATABASE_FILENAME
+    with scrape_state.ScrapeStateDatabase(database_path) as state_database:
+        assert state_database.get_listing_checkpoint(LISTING_KEY) is None
+        state_database.save_listing_page(LISTING_KEY, 1, [1000, 1001])
+        state_database.save_listing_page(LISTING_KEY, 2, [1002])
+
+    with scrape_state.ScrapeStateDatabase(database_path) as state_database:
+        assert state_database.get_listing_checkpoint(LISTING_KEY) == (3, False)
+        assert state_database.get_listing_submission_ids(LISTING_KEY) == {"1000", "1001", "1002"}
+
+        state_database.mark_listing_complete(LISTING_KEY)
+        # marking it complete keeps where it got to
+        assert state_database.get_listing_checkpoint(LISTING_KEY) == (3, True)
+
+        state_database.reset_listing(LISTING_KEY)
+        assert state_database.get_listing_checkpoint(LISTING_KEY) is None
+        assert state_database.get_listing_submission_ids(LISTING_KEY) == set()
+
+
+def test_listing_progress_saves_pages_in_order(state_database):
+
+    listing_progress = scrape_state.ListingProgress(state_database, LISTING_KEY)
+    for iter_page_number in (1, 2, 3):
+        listing_progress.add_page(iter_page_number, [iter_page_number * 1000])
+    listing_progress.finish()
+
+    # page 2 being done first doesn't save anything, a run stopped now has to start over at page 1
+    listing_progress.finish_page(2)
+    assert state_database.get_listing_checkpoint(LISTING_KEY) is None
+
+    listing_progress.finish_page(1)
+    assert state_database.get_listing_checkpoint(LISTING_KEY) == (3, False)
+
+    listing_progress.finish_page(3)
+    assert state_database.get_listing_checkpoint(LISTING_KEY) == (4, True)
@@ -0,0 +1,355 @@
+import asyncio
+
+import httpx
+import pytest
+
+from sofurry_scrape import utils
+from sofurry_scrape import scrape_state
+from sofurry_scrape import content_types
+from sofurry_scrape.commands import single_user_scrape as single_user_scrape_module
+
+from tests import fakes
+
+LISTING_PARAMS = {"by": "1", "format": "json"}
+LISTING_KEY = scrape_state.get_listing_key(content_types.STORIES.listing_url, LISTING_PARAMS)
+
+
+async def walk_listing(single_user_scrape, folder_collection, tmp_path, stop_event:asyncio.Event|None=None):
+    ''' go through the user's story listing once, like `scrape_content_type` does '''
+
+    single_user_scrape.submission_semaphore = asyncio.Semaphore(4)
+    await single_user_scrape.scrape_listing_handle_paginated_api(
+        content_type=content_types.STORIES,
+        url=content_types.STORIES.listing_url,
+        params=LISTING_PARAMS,
+        httpx_client=None,
+        uid="1",
+        folder_collection=folder_collection,
+        temporary_dir=tmp_path,
+        cookiefile=None,
+        stop_event=stop_event or asyncio.Event())
+
+
+def test_listing_is_gone_through_once(single_user_scrape, folder_collection, tmp_path):
+
+    listing = fakes.FakeListing(95)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    stages = fakes.FakeStages(single_user_scrape)
+
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    assert stages.done[scrape_state.STAGE_METADATA] == [x["id"] for x in listing.submissions]
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (11, True)
+
+
+def test_incremental_resumes_an_interrupted_listing(single_user_scrape, folder_collection, tmp_path):
+    '''
+    a run that was stopped partway through a listing leaves the pages after it unseen, so the next `--incremental`
+    run has to finish the listing instead of stopping at page 1 because everything on it is archived
+    '''
+
+    listing = fakes.FakeListing(100)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+
+    stop_event = asyncio.Event()
+    stages = fakes.FakeStages(single_user_scrape, stop_event, stop_after=45)
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path, stop_event))
+
+    next_page, is_complete = single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY)
+    assert not is_complete
+    assert 1 < next_page <= 5
+
+    single_user_scrape.incremental = True
+    stages.stop_event = None
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    assert set(stages.done[scrape_state.STAGE_METADATA]) == set(x["id"] for x in listing.submissions)
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY)[1]
+
+
+def test_incremental_stops_once_a_finished_listing_is_archived(single_user_scrape, folder_collection, tmp_path):
+
+    listing = fakes.FakeListing(100)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    stages = fakes.FakeStages(single_user_scrape)
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    single_user_scrape.incremental = True
+    # the second incremental run can stop early too, the first one stopping at page 1 still counts as finishing it
+    for _ in range(2):
+        listing.requested_pages.clear()
+        stages.done.clear()
+        asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+        assert listing.requested_pages == [1]
+        assert stages.done[scrape_state.STAGE_METADATA] == []
+
+
+def test_stage_pipeline_only_saves_pages_once_their_submissions_are_done(single_user_scrape, folder_collection, tmp_path):
+    '''
+    with `--use-stage-pipeline` the submissions on a page are only queued when the listing gets to it, so a run that
+    is stopped while they are still going through the stages has to resume at the first page that isn't done
+    '''
+
+    listing = fakes.FakeListing(35)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    single_user_scrape.discover_folder_ids = listing.discover_folder_ids
+    fakes.use_stage_pipeline(single_user_scrape)
+    # enough workers that a stuck submission never keeps one from page 1 waiting
+    single_user_scrape.stage_concurrency[single_user_scrape_module.PIPELINE_STAGE_HTML] = len(listing.submissions)
+    stages = fakes.FakeStages(single_user_scrape)
+
+    page_one_ids = set(x["id"] for x in listing.submissions[:10])
+    never_set = asyncio.Event()
+
+    async def _html_gate(work_item):
+        if work_item.submission_folders.submission_id not in page_one_ids:
+            await never_set.wait()
+
+    stages.html_gate = _html_gate
+
+    class _Interrupted(Exception):
+        pass
+
+    async def _run_until_stuck():
+        stop_event = asyncio.Event()
+        single_user_scrape.submission_semaphore = asyncio.Semaphore(4)
+        async with single_user_scrape.create_pipeline(stop_event):
+            asyncio.create_task(single_user_scrape.scrape_content_types(None, "1", folder_collection, tmp_path, None, stop_event))
+            while len(stages.done[scrape_state.STAGE_HTML]) < 10 or len(stages.done[scrape_state.STAGE_THUMBNAIL]) < 35:
+                await asyncio.sleep(0.001)
+            # like the scrape crashing, the pipeline gets stopped without waiting for the stuck submissions
+            raise _Interrupted()
+
+    with pytest.raises(_Interrupted):
+        asyncio.run(_run_until_stuck())
+
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (2, False)
+
+    stages.html_gate = None
+
+    async def _run():
+        stop_event = asyncio.Event()
+        async with single_user_scrape.create_pipeline(stop_event):
+            await single_user_scrape.scrape_content_types(None, "1", folder_collection, tmp_path, None, stop_event)
+
+    asyncio.run(_run())
+
+    assert set(stages.done[scrape_state.STAGE_HTML]) == set(x["id"] for x in listing.submissions)
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (5, True)
+
+
+def test_submissions_of_later_pages_start_before_a_page_is_done(single_user_scrape, folder_collection, tmp_path):
+    '''
+    without the pipeline, how many submissions run at once is only limited by the semaphore, a page with fewer
+    submissions than that doesn't hold up the next one
+    '''
+
+    listing = fakes.FakeListing(9, page_size=2)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    stages = fakes.FakeStages(single_user_scrape)
+    in_html_stage = set()
+    all_started = asyncio.Event()
+
+    async def _html_gate(work_item):
+        # held until as many submissions as the semaphore lets in are here, which takes more than one page
+        in_html_stage.add(work_item.submission_folders.submission_id)
+        if len(in_html_stage) == 4:
+            all_started.set()
+        await all_started.wait()
+
+    stages.html_gate = _html_gate
+
+    async def _run():
+        await asyncio.wait_for(walk_listing(single_user_scrape, folder_collection, tmp_path), 5)
+
+    asyncio.run(_run())
+
+    assert sorted(stages.done[scrape_state.STAGE_HTML]) == sorted(x["id"] for x in listing.submissions)
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (6, True)
+
+
+@pytest.mark.parametrize("use_stage_pipeline", [False, True])
+def test_page_with_a_deferred_submission_is_not_saved(single_user_scrape, folder_collection, tmp_path, use_stage_pipeline):
+    '''
+    a submission that failed is only tried again at the end of the run, if the run is stopped before then its page
+    has to be gone through again by the next one
+    '''
+
+    listing = fakes.FakeListing(25)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    if use_stage_pipeline:
+        fakes.use_stage_pipeline(single_user_scrape)
+    stages = fakes.FakeStages(single_user_scrape)
+    failing_id = listing.submissions[15]["id"]
+
+    async def _html_gate(work_item):
+        if work_item.submission_folders.submission_id == failing_id:
+            raise Exception("the site is down")
+
+    stages.html_gate = _html_gate
+
+    async def _run():
+        if use_stage_pipeline:
+            async with single_user_scrape.create_pipeline(asyncio.Event()):
+                await walk_listing(single_user_scrape, folder_collection, tmp_path)
+            single_user_scrape.pipeline = None
+        else:
+            await walk_listing(single_user_scrape, folder_collection, tmp_path)
+
+    # like the run being stopped before `retry_failed_submissions()`
+    asyncio.run(_run())
+
+    assert list(single_user_scrape.failed_submissions.keys()) == [failing_id]
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (2, False)
+
+    stages.html_gate = None
+    asyncio.run(_run())
+
+    assert failing_id in stages.done[scrape_state.STAGE_HTML]
+    assert single_user_scrape.state_database.get_listing_checkpoint(LISTING_KEY) == (4, True)
+
+
+def test_incremental_downloads_the_thumbnail_of_a_changed_submission_again(tmp_path):
+    '''
+    the thumbnail url stays the same when a submission's thumbnail is changed, so the blob that was downloaded from
+    it before can't be used once we know the submission changed
+    '''
+
+    single_user_scrape = single_user_scrape_module.SingleUserScrape()
+    single_user_scrape.incremental = True
+    thumbnail = b"old thumbnail"
+
+    def _handler(request):
+        return httpx.Response(200, content=thumbnail)
+
+    async def _archive(submission_json:dict) -> bytes:
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as httpx_client:
+            folder_collection = utils.create_necessary_output_directories(tmp_path / "output", "someone", "1")
+            work_item = single_user_scrape.create_submission_work_item(submission_json, httpx_client, folder_collection, tmp_path, None)
+            await single_user_scrape.run_submission_stage(scrape_state.STAGE_METADATA, single_user_scrape.write_submission_metadata, work_item)
+            await single_user_scrape.run_submission_stage(scrape_state.STAGE_THUMBNAIL, single_user_scrape.download_submission_thumbnail, work_item)
+            return work_item.submission_folders.thumbnail.read_bytes()
+
+    async def _run():
+        with single_user_scrape.open_output_path(tmp_path / "output"):
+            submission_json = fakes.make_submission_json(1000)
+            assert await _archive(submission_json) == b"old thumbnail"
+
+            nonlocal thumbnail
+            thumbnail = b"new thumbnail"
+            # unchanged, so nothing is downloaded again
+            assert await _archive(submission_json) == b"old thumbnail"
+            assert await _archive(dict(submission_json, title="a new title")) == b"new thumbnail"
+
+    asyncio.run(_run())
+
+
+def test_stage_pipeline_with_html_from_warc_writes_every_html(single_user_scrape, folder_collection, tmp_path):
+    '''
+    the warc stage hands submissions back to the html stage, the pipeline has to wait for them when it is closed
+    '''
+
+    listing = fakes.FakeListing(12)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    fakes.use_stage_pipeline(single_user_scrape)
+    single_user_scrape.html_from_warc = True
+    stages = fakes.FakeStages(single_user_scrape)
+
+    capture_submission_warc = single_user_scrape.capture_submission_warc
+
+    async def _slow_capture_submission_warc(work_item):
+        # so the html stage is done with everything it had before the warc stage gives it more
+        await asyncio.sleep(0.01)
+        await capture_submission_warc(work_item)
+
+    single_user_scrape.capture_submission_warc = _slow_capture_submission_warc
+
+    async def _html_gate(work_item):
+        await asyncio.sleep(0.005)
+
+    stages.html_gate = _html_gate
+
+    async def _run():
+        async with single_user_scrape.create_pipeline(asyncio.Event()):
+            await walk_listing(single_user_scrape, folder_collection, tmp_path)
+
+    asyncio.run(_run())
+
+    assert set(stages.done[scrape_state.STAGE_HTML]) == set(x["id"] for x in listing.submissions)
+
+
+def test_incremental_goes_a_page_at_a_time(single_user_scrape, folder_collection, tmp_path):
+    '''
+    a new submission pushes the rest down a page, so page 2 has to be looked at too, but finding the page count
+    or prefetching pages would cost more than that
+    '''
+
+    listing = fakes.FakeListing(100)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    stages = fakes.FakeStages(single_user_scrape)
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    single_user_scrape.incremental = True
+    new_submission_json = listing.post_new_submission()
+    listing.requested_pages.clear()
+    stages.done.clear()
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    assert listing.requested_pages == [1, 2]
+    assert new_submission_json["id"] in stages.done[scrape_state.STAGE_METADATA]
+
+
+def test_incremental_stops_once_the_listing_wraps_around(single_user_scrape, folder_collection, tmp_path):
+    '''
+    the pages past the last one are page 1 again, if the new submissions on it didn't get archived (like when they
+    failed and got deferred) that is the only way to tell the listing is over
+    '''
+
+    listing = fakes.FakeListing(5)
+    single_user_scrape.fetch_listing_page = listing.fetch_listing_page
+    fakes.FakeStages(single_user_scrape)
+    asyncio.run(walk_listing(single_user_scrape, folder_collection, tmp_path))
+
+    async def _failing_write_submission_metadata(work_item):
+        raise Exception("the site is down")
+
+    single_user_scrape.write_submission_metadata = _failing_write_submission_metadata
+    single_user_scrape.incremental = True
+    for _ in range(3):
+        listing.post_new_submission()
+    listing.requested_pages.clear()
+
+    asyncio.run(asyncio.wait_for(walk_listing(single_user_scrape, folder_collection, tmp_path), 5))
+
+    assert listing.requested_pages == [1, 2]
+    assert len(single_user_scrape.failed_submissions) == len(listing.submissions)
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_discover_folder_ids(single_user_scrape, monkeypatch, incremental):
+    '''
+    the folder list has pages too, and past the last one is page 1 again. `--incremental` goes through them one at
+    a time instead of finding out how many there are first
+    '''
+
+    folder_pages = [["1", "2"], ["3", "4"], ["5"]]
+    requested_pages = list()
+
+    class _FakeHttpFetcher:
+        async def fetch(self, httpx_client, url, endpoint, params):
+            page_number = int(params[content_types.STORIES.page_param])
+            requested_pages.append(page_number)
+            page = folder_pages[page_number - 1] if page_number <= len(folder_pages) else folder_pages[0]
+            return httpx.Response(200, content=",".join(page).encode())
+
+    monkeypatch.setattr(single_user_scrape_module.html_extract, "extract_folder_ids", lambda html: html.decode().split(","))
+    single_user_scrape.http_fetcher = _FakeHttpFetcher()
+    single_user_scrape.incremental = incremental
+
+    folder_ids = asyncio.run(single_user_scrape.discover_folder_ids(None, "1", content_types.STORIES))
+
+    assert folder_ids == ["1", "2", "3", "4", "5"]
+    if incremental:
+        assert requested_pages == [1, 2, 3, 4]
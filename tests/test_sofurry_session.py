@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import httpx
+
+from sofurry_scrape import sofurry_session
+
+
+CREDENTIAL_JSON = {"username": "someone", "password": "hunter2"}
+
+
+def _check_login_page(status_code:int, content:bytes=b"") -> bool:
+
+    async def _run():
+        transport = httpx.MockTransport(lambda request: httpx.Response(status_code, content=content))
+        async with httpx.AsyncClient(transport=transport) as httpx_client:
+            return await sofurry_session.is_logged_in(httpx_client)
+
+    return asyncio.run(_run())
+
+
+def test_is_logged_in():
+
+    assert _check_login_page(200, b"<html>welcome back</html>")
+    assert not _check_login_page(200, b"<input name=\"" + sofurry_session.LOGIN_FORM_FIELD + b"\">")
+
+
+def test_is_logged_in_is_false_when_the_site_doesnt_give_us_the_login_page():
+
+    assert not _check_login_page(503)
+    assert not _check_login_page(429)
+
+
+def test_is_logged_in_is_false_when_getting_the_login_page_fails():
+
+    for iter_exception in (httpx.ConnectError("connection refused"), httpx.ReadTimeout("timed out")):
+
+        def _handler(request):
+            raise iter_exception
+
+        async def _run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as httpx_client:
+                return await sofurry_session.is_logged_in(httpx_client)
+
+        assert not asyncio.run(_run())
+
+
+def test_saved_session_is_replaced_by_logging_in_when_the_check_fails(tmp_path):
+
+    session_cache_path = tmp_path / "session.json"
+    session_cache_path.write_text(json.dumps({"username": CREDENTIAL_JSON["username"],
+        "cookies": [{"name": "PHPSESSID", "value": "old", "domain": ".sofurry.com", "path": "/"}]}))
+
+    requests = list()
+
+    def _handler(request):
+        requests.append((request.method, request.url.path))
+        if len(requests) == 1:
+            # the check of the saved session
+            return httpx.Response(503)
+        if request.method == "POST":
+            return httpx.Response(200, headers={"set-cookie": "PHPSESSID=new; Domain=.sofurry.com; Path=/"})
+        return httpx.Response(200)
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as httpx_client:
+            session_cookie_manager = sofurry_session.SessionCookieManager(httpx_client, session_cache_path, None)
+            await session_cookie_manager.log_in(CREDENTIAL_JSON)
+
+    asyncio.run(_run())
+
+    assert ("POST", "/user/login") in requests
+    saved_cookies = json.loads(session_cache_path.read_text())["cookies"]
+    assert [x["value"] for x in saved_cookies if x["name"] == "PHPSESSID"] == ["new"]
+
+
+def test_changed_cookies_are_saved_during_the_run(tmp_path):
+
+    session_cache_path = tmp_path / "session.json"
+    cookiefile_path = tmp_path / "cookie.dat"
+
+    def _handler(request):
+        if request.url.path == "/rotate":
+            return httpx.Response(200, headers={"set-cookie": "PHPSESSID=rotated; Domain=.sofurry.com; Path=/"})
+        if request.method == "POST":
+            return httpx.Response(200, headers={"set-cookie": "PHPSESSID=new; Domain=.sofurry.com; Path=/"})
+        return httpx.Response(200)
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as httpx_client:
+            session_cookie_manager = sofurry_session.SessionCookieManager(httpx_client, session_cache_path, cookiefile_path)
+            await session_cookie_manager.log_in(CREDENTIAL_JSON)
+            await httpx_client.get("https://www.sofurry.com/rotate")
+
+    asyncio.run(_run())
+
+    saved_cookies = json.loads(session_cache_path.read_text())["cookies"]
+    assert [x["value"] for x in saved_cookies if x["name"] == "PHPSESSID"] == ["rotated"]
+    assert "rotated" in cookiefile_path.read_text()
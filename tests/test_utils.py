@@ -0,0 +1,10 @@
+from sofurry_scrape import utils
+
+
+def test_escape_and_parse_json_omg_takes_raw_newlines_and_valid_json():
+
+    # the site's responses can have raw newlines in their strings, a failure on one doesn't change how the next is parsed
+    for _ in range(3):
+        assert utils.escape_and_parse_json_omg(b'{"description": "one\ntwo"}') == {"description": "one\ntwo"}
+        assert utils.escape_and_parse_json_omg(b'{"description": "one\\ntwo"}') == {"description": "one\ntwo"}
+        assert utils.escape_and_parse_json_omg('{"title": "café"}') == {"title": "café"}
@@ -0,0 +1,11 @@
+import gzip
+
+from sofurry_scrape import warc_reader
+
+
+def test_decode_chunked():
+    assert warc_reader.decode_chunked(b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n") == b"hello world"
+
+
+def test_decode_content_gzip():
+    assert warc_reader.decode_content(gzip.compress(b"hello"), "gzip") == b"hello"
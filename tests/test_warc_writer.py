@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+
+import httpx
+
+from sofurry_scrape import http_fetch
+from sofurry_scrape import rolling_warc
+from sofurry_scrape import warc_reader
+from sofurry_scrape import warc_writer
+from sofurry_scrape import wget_utils
+
+PAGE_URL = "https://www.sofurry.com/view/1000"
+FINAL_PAGE_URL = "https://www.sofurry.com/view/1000/full"
+PAGE_HTML = (b"<html><img src=\"https://www.sofurryfiles.com/std/thumb?page=1000\">" +
+    b"<link rel=\"stylesheet\" href=\"/static/site.css\"><script src=\"/static/missing.js\"></script>" +
+    b"<a href=\"https://example.com/elsewhere\">not captured</a></html>")
+
+
+class _StreamingMockTransport(httpx.AsyncBaseTransport):
+    ''' like `httpx.MockTransport`, without reading the body first, since the capture reads it raw '''
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def handle_async_request(self, request:httpx.Request) -> httpx.Response:
+        status_code, headers, body = self.handler(request)
+        return httpx.Response(status_code, headers=headers, stream=httpx.ByteStream(body))
+
+
+def _handler(request:httpx.Request) -> tuple[int, dict, bytes]:
+
+    url = str(request.url)
+    if url == PAGE_URL:
+        return (302, {"Location": "/view/1000/full"}, b"")
+    if url == FINAL_PAGE_URL:
+        # sent compressed, the warc keeps it the way it was sent
+        return (200, {"Content-Type": "text/html", "Content-Encoding": "gzip"}, gzip.compress(PAGE_HTML))
+    if url.endswith("/std/thumb?page=1000"):
+        return (200, {"Content-Type": "image/jpeg"}, b"jpeg")
+    if url.endswith("/static/site.css"):
+        return (200, {"Content-Type": "text/css"}, b"body {}")
+    return (404, {}, b"")
+
+
+def test_native_capture_round_trip(tmp_path):
+    '''
+    capture a page that redirects, with its linked assets, and read the page back out of the warc like
+    `--html-from-warc` does
+    '''
+
+    warc_path = tmp_path / "1000.warc.gz"
+    requested_urls = list()
+
+    def _recording_handler(request:httpx.Request) -> tuple[int, dict, bytes]:
+        requested_urls.append(str(request.url))
+        return _handler(request)
+
+    async def _run() -> warc_writer.CaptureResult:
+        native_warc_capture = warc_writer.NativeWarcCapture(http_fetch.HttpFetcher(max_attempts=1), wget_utils.WGET_ACCEPT_REGEX)
+        async with httpx.AsyncClient(transport=_StreamingMockTransport(_recording_handler)) as httpx_client:
+            return await native_warc_capture.capture(httpx_client, PAGE_URL, warc_path, ["sofurry_submission_id: 1000"])
+
+    capture_result = asyncio.run(_run())
+
+    assert capture_result.page_content == PAGE_HTML
+    assert capture_result.page_url == FINAL_PAGE_URL
+    assert (capture_result.asset_count, capture_result.failed_asset_count) == (3, 1)
+    assert capture_result.warc_size == warc_path.stat().st_size
+    assert not any("example.com" in x for x in requested_urls)
+
+    assert warc_writer.get_page_content_from_warc(warc_path, PAGE_URL) == PAGE_HTML
+
+    records = list(warc_reader.iter_warc_records(warc_path))
+    assert records[0].headers["warc-type"] == "warcinfo"
+    assert b"sofurry_submission_id: 1000" in records[0].block
+
+    responses = {x.headers["warc-target-uri"].strip("<>"): x for x in records if x.headers["warc-type"] == "response"}
+    assert set(responses.keys()) == {PAGE_URL, FINAL_PAGE_URL,
+        "https://www.sofurryfiles.com/std/thumb?page=1000", "https://www.sofurry.com/static/site.css"}
+    # the payload digest is of the body as it was sent
+    assert responses[FINAL_PAGE_URL].headers["warc-payload-digest"] == warc_reader.get_warc_digest(gzip.compress(PAGE_HTML))
+
+    # every response has the request that went with it
+    request_records = [x for x in records if x.headers["warc-type"] == "request"]
+    assert sorted(x.headers["warc-concurrent-to"] for x in request_records) == sorted(x.headers["warc-record-id"] for x in responses.values())
+
+    # and each record is a gzip member of its own, so the index can point right at it
+    assert len(rolling_warc.index_warc_file(warc_path)) == len(responses)